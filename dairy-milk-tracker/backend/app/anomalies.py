@@ -0,0 +1,228 @@
+import os
+from dataclasses import dataclass
+from datetime import date, timedelta
+from typing import Optional
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from sqlalchemy import delete, func, insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.models.alert import HerdAlert
+from app.models.herd import Herd
+from app.models.rollup import MilkDailyTotal
+
+# Days of history loaded per run; alerts inside this window are recomputed
+ANOMALY_LOOKBACK_DAYS = int(os.environ.get("ANOMALY_LOOKBACK_DAYS", "180"))
+# Herds per matrix; bounds memory at roughly 10 float arrays of this x days
+ANOMALY_BLOCK_HERDS = int(os.environ.get("ANOMALY_BLOCK_HERDS", "4096"))
+
+# A day is a drop when it sits DROP_Z_SCORE deviations, and at least
+# DROP_MIN_FRACTION, below the mean of the BASELINE_DAYS before it (with at
+# least MIN_BASELINE_DAYS of data)
+BASELINE_DAYS = 28
+MIN_BASELINE_DAYS = 14
+DROP_Z_SCORE = -3.0
+DROP_MIN_FRACTION = 0.10
+# Floor on the baseline's deviation as a fraction of its mean, so a nearly
+# constant series doesn't turn a small wobble into a huge z-score
+MIN_RELATIVE_STD = 0.02
+# A level shift is a day where the mean of the SHIFT_WINDOW_DAYS from it on
+# is SHIFT_MIN_DROP below the mean of the window before, and the largest
+# such drop within a window either side
+SHIFT_WINDOW_DAYS = 7
+SHIFT_MIN_DAYS = 5
+SHIFT_MIN_DROP = 0.15
+
+ALERT_KINDS = ("drop", "level_shift")
+
+
+@dataclass
+class Anomalies:
+    """Flagged cells of a herds x days matrix, as parallel arrays"""
+
+    herds: np.ndarray  # row index
+    days: np.ndarray  # column index
+    kinds: np.ndarray  # index into ALERT_KINDS
+    values: np.ndarray
+    baselines: np.ndarray
+    scores: np.ndarray
+
+
+def _cumulative(values: np.ndarray):
+    """Prefix sums along days of presence, values and squares (NaN skipped).
+
+    Column ``t`` holds the sums over days ``[0, t)``, so any window is one
+    subtraction for every herd and day at once.
+    """
+    present = ~np.isnan(values)
+    filled = np.where(present, values, 0.0)
+    zeros = np.zeros((values.shape[0], 1))
+    return [
+        np.concatenate([zeros, np.cumsum(column, axis=1)], axis=1)
+        for column in (present.astype(np.float64), filled, filled * filled)
+    ]
+
+
+def detect_anomalies(values: np.ndarray) -> Anomalies:
+    """Yield drops and level shifts in a herds x days matrix of liters per cow.
+
+    Missing days are NaN. Every statistic is computed for all herds and days
+    together from prefix sums; there is no loop over herds or days.
+    """
+    day_count = values.shape[1]
+    t = np.arange(day_count)
+    counts, sums, squares = _cumulative(values)
+
+    def window(prefix, start, end):
+        return prefix[:, end] - prefix[:, start]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # Rolling z-score against the days before
+        start = np.maximum(t - BASELINE_DAYS, 0)
+        n = window(counts, start, t)
+        mean = window(sums, start, t) / n
+        variance = np.maximum(window(squares, start, t) / n - mean * mean, 0)
+        std = np.maximum(np.sqrt(variance), MIN_RELATIVE_STD * mean)
+        z = (values - mean) / std
+        drops = (
+            (n >= MIN_BASELINE_DAYS)
+            & (z <= DROP_Z_SCORE)
+            & (values <= mean * (1 - DROP_MIN_FRACTION))
+        )
+
+        # Change points: the window from each day on against the one before
+        before = np.maximum(t - SHIFT_WINDOW_DAYS, 0)
+        after = np.minimum(t + SHIFT_WINDOW_DAYS, day_count)
+        n_before = window(counts, before, t)
+        n_after = window(counts, t, after)
+        mean_before = window(sums, before, t) / n_before
+        mean_after = window(sums, t, after) / n_after
+        relative_drop = 1 - mean_after / mean_before
+    enough = (n_before >= SHIFT_MIN_DAYS) & (n_after >= SHIFT_MIN_DAYS) & (mean_before > 0)
+    score = np.where(enough, relative_drop, -np.inf)
+    # Keep only the peak of each run of large drops
+    reach = SHIFT_WINDOW_DAYS - 1
+    padded = np.pad(score, ((0, 0), (reach, reach)), constant_values=-np.inf)
+    local_max = sliding_window_view(padded, 2 * reach + 1, axis=1).max(axis=-1)
+    shifts = enough & (relative_drop >= SHIFT_MIN_DROP) & (score >= local_max)
+
+    drop_herds, drop_days = np.nonzero(drops)
+    shift_herds, shift_days = np.nonzero(shifts)
+    return Anomalies(
+        herds=np.concatenate([drop_herds, shift_herds]),
+        days=np.concatenate([drop_days, shift_days]),
+        kinds=np.repeat([0, 1], [len(drop_herds), len(shift_herds)]),
+        values=np.concatenate(
+            [values[drop_herds, drop_days], mean_after[shift_herds, shift_days]]
+        ),
+        baselines=np.concatenate(
+            [mean[drop_herds, drop_days], mean_before[shift_herds, shift_days]]
+        ),
+        scores=np.concatenate(
+            [z[drop_herds, drop_days], relative_drop[shift_herds, shift_days]]
+        ),
+    )
+
+
+async def load_yield_per_cow(
+    db: AsyncSession,
+    herd_ids: np.ndarray,
+    cow_counts: np.ndarray,
+    start: date,
+    day_count: int,
+) -> np.ndarray:
+    """Daily liters per cow of a block of herds (sorted by id) from the rollups.
+
+    Herds without a cow count get an all-NaN row.
+    """
+    offset = func.julianday(MilkDailyTotal.day) - func.julianday(start)
+    # A Core query on the session's connection: no ORM row processing
+    conn = await db.connection()
+    result = await conn.execute(
+        select(MilkDailyTotal.herd_id, offset, MilkDailyTotal.total_liters).where(
+            MilkDailyTotal.herd_id.between(int(herd_ids[0]), int(herd_ids[-1])),
+            MilkDailyTotal.day >= start,
+            MilkDailyTotal.day < start + timedelta(days=day_count),
+        )
+    )
+    rows = result.all()
+    totals = np.full((len(herd_ids), day_count), np.nan)
+    if not rows:
+        return totals
+    # Transposed in Python first; numpy is slow at converting Row objects
+    row_herds, row_days, row_liters = zip(*rows)
+
+    row_herds = np.array(row_herds, dtype=np.int64)
+    positions = np.minimum(np.searchsorted(herd_ids, row_herds), len(herd_ids) - 1)
+    # Rollups of herds that no longer exist fall between the block's ids
+    known = herd_ids[positions] == row_herds
+    days = np.array(row_days, dtype=np.float64).astype(np.int64)
+    totals[positions[known], days[known]] = np.array(row_liters, dtype=np.float64)[known]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(cow_counts[:, None] > 0, totals / cow_counts[:, None], np.nan)
+
+
+async def delete_herd_alerts(db: AsyncSession, herd_id: int):
+    """Drop a deleted herd's alerts so a herd reusing its id starts clean"""
+    await db.execute(delete(HerdAlert).where(HerdAlert.herd_id == herd_id))
+
+
+async def run_anomaly_detection(
+    db: AsyncSession,
+    today: Optional[date] = None,
+    lookback_days: int = ANOMALY_LOOKBACK_DAYS,
+    block_size: int = ANOMALY_BLOCK_HERDS,
+) -> int:
+    """Recompute the alerts of every herd over the lookback window.
+
+    Today is left out since it is usually still incomplete. Alerts inside the
+    window are replaced, so the job can be re-run after corrections. Returns
+    the number of alerts stored.
+    """
+    today = today or date.today()
+    start = today - timedelta(days=lookback_days)
+    result = await db.execute(select(Herd.id, Herd.cow_count).order_by(Herd.id))
+    herds = result.all()
+    herd_ids = np.array([herd.id for herd in herds], dtype=np.int64)
+    cow_counts = np.array([herd.cow_count or 0 for herd in herds], dtype=np.float64)
+
+    stored = 0
+    for block in range(0, len(herd_ids), block_size):
+        ids = herd_ids[block : block + block_size]
+        values = await load_yield_per_cow(
+            db, ids, cow_counts[block : block + block_size], start, lookback_days
+        )
+        found = detect_anomalies(values)
+        days = (np.datetime64(start) + found.days).astype(date)
+        rows = [
+            dict(
+                herd_id=herd_id,
+                day=day,
+                kind=ALERT_KINDS[kind],
+                liters_per_cow=value,
+                baseline=baseline,
+                score=score,
+            )
+            for herd_id, day, kind, value, baseline, score in zip(
+                ids[found.herds].tolist(),
+                days.tolist(),
+                found.kinds.tolist(),
+                found.values.tolist(),
+                found.baselines.tolist(),
+                found.scores.tolist(),
+            )
+        ]
+
+        await db.execute(
+            delete(HerdAlert).where(
+                HerdAlert.herd_id.between(int(ids[0]), int(ids[-1])),
+                HerdAlert.day >= start,
+            )
+        )
+        if rows:
+            await db.execute(insert(HerdAlert), rows)
+        await db.commit()
+        stored += len(rows)
+    return stored
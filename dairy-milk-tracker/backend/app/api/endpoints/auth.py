@@ -2,25 +2,27 @@ from datetime import timedelta
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.ext.asyncio import AsyncSession
+import logging
 import os
 
 from app.auth import (
     ACCESS_TOKEN_EXPIRE_MINUTES,
     authenticate_user,
     create_access_token,
-    get_password_hash,
+    get_password_hash_async,
 )
-from app.database import get_db
+from app.database import get_db, get_read_db
 from app.models.user import User
 from app.schemas.user import Token, UserCreate, User as UserSchema
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
 
 @router.post("/token", response_model=Token)
 async def login_for_access_token(
     form_data: OAuth2PasswordRequestForm = Depends(),
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
 ):
     try:
         user = await authenticate_user(db, form_data.username, form_data.password)
@@ -35,8 +37,8 @@ async def login_for_access_token(
             data={"sub": user.email}, expires_delta=access_token_expires
         )
         return {"access_token": access_token, "token_type": "bearer"}
-    except Exception as e:
-        print(f"Login error: {str(e)}")
+    except Exception:
+        logger.exception("Login error")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="An error occurred during login"
@@ -60,7 +62,7 @@ async def register_user(user: UserCreate, db: AsyncSession = Depends(get_db)):
         username = user.username if user.username else user.email
         
         # Create new user
-        hashed_password = get_password_hash(user.password)
+        hashed_password = await get_password_hash_async(user.password)
         db_user = User(
             email=user.email, 
             hashed_password=hashed_password,
@@ -73,8 +75,8 @@ async def register_user(user: UserCreate, db: AsyncSession = Depends(get_db)):
     except HTTPException:
         # Re-raise HTTP exceptions
         raise
-    except Exception as e:
-        print(f"Registration error: {str(e)}")
+    except Exception:
+        logger.exception("Registration error")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="An error occurred during registration"
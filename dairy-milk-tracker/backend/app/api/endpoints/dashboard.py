@@ -0,0 +1,100 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from sqlalchemy import and_, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.auth import get_current_active_user
+from app.database import get_read_db
+from app.models.herd import Herd
+from app.models.milk_production import MilkProduction
+from app.models.rollup import MilkDailyTotal
+from app.models.user import User
+from app.query_log import query_budget
+from app.response_cache import response_cache
+from app.rollups import build_stats, production_stats, time_span_start
+from app.schemas.dashboard import DashboardSummary, HerdSummary
+from app.schemas.herd import Herd as HerdSchema
+from app.schemas.milk_production import MilkProduction as MilkProductionSchema
+
+router = APIRouter()
+
+
+@router.get("/summary", response_model=DashboardSummary)
+@query_budget(4)
+async def read_dashboard_summary(
+    request: Request,
+    herd_id: int = None,
+    time_span: str = None,  # 'week', 'month', 'year'
+    recent_limit: int = Query(5, ge=0, le=100),
+    db: AsyncSession = Depends(get_read_db),
+    current_user: User = Depends(get_current_active_user),
+):
+    """Everything the dashboard shows, in one request and one session"""
+    # Answered from cache (or with a 304) while the user's data is unchanged
+    cached = response_cache.lookup(request, current_user.id)
+    cached_response = cached.response()
+    if cached_response is not None:
+        return cached_response
+    
+    start_date = time_span_start(time_span)
+    
+    # Herds with their totals from the daily rollups; the time filter sits in
+    # the join condition so herds without records still show up
+    join_condition = MilkDailyTotal.herd_id == Herd.id
+    if start_date:
+        join_condition = and_(join_condition, MilkDailyTotal.day >= start_date)
+    result = await db.execute(
+        select(
+            Herd,
+            func.sum(MilkDailyTotal.total_liters).label("total_liters"),
+            func.count(MilkDailyTotal.day).label("days_recorded"),
+        )
+        .outerjoin(MilkDailyTotal, join_condition)
+        .where(Herd.user_id == current_user.id)
+        .group_by(Herd.id)
+        .order_by(Herd.id)
+    )
+    herd_rows = result.all()
+    
+    herds = []
+    selected = None
+    for herd, total_liters, days_recorded in herd_rows:
+        stats = build_stats(total_liters, days_recorded, herd.cow_count)
+        herds.append(
+            HerdSummary(**HerdSchema.model_validate(herd).model_dump(), **stats.model_dump())
+        )
+        if herd.id == herd_id:
+            selected = (herd, stats)
+    
+    if herd_id and selected is None:
+        raise HTTPException(status_code=404, detail="Herd not found")
+    
+    # A single herd's stats are its row above; across herds a day counts
+    # once however many herds recorded it, which needs its own query
+    if selected:
+        stats = selected[1]
+    elif herd_rows:
+        stats = await production_stats(db, current_user.id, start_date=start_date)
+    else:
+        stats = build_stats(None, 0)
+    
+    recent_records = []
+    if recent_limit and herd_rows:
+        query = select(MilkProduction)
+        if herd_id:
+            query = query.where(MilkProduction.herd_id == herd_id)
+        else:
+            query = query.join(Herd).where(Herd.user_id == current_user.id)
+        result = await db.execute(
+            query.order_by(MilkProduction.date.desc(), MilkProduction.id.desc()).limit(
+                recent_limit
+            )
+        )
+        recent_records = [
+            MilkProductionSchema.model_validate(record)
+            for record in result.scalars().all()
+        ]
+    
+    return cached.store(
+        DashboardSummary(herds=herds, stats=stats, recent_records=recent_records)
+    )
@@ -0,0 +1,45 @@
+from fastapi import APIRouter, Depends
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.auth import (
+    EVENT_TOKEN_EXPIRE_SECONDS,
+    create_event_token,
+    get_current_active_user,
+    get_event_stream_user,
+)
+from app.database import get_read_db
+from app.events import event_broker
+from app.models.user import User
+from app.schemas.user import EventToken
+
+router = APIRouter()
+
+
+@router.post("/token", response_model=EventToken)
+async def create_stream_token(current_user: User = Depends(get_current_active_user)):
+    """Token for opening one event stream, so the login token stays out of URLs"""
+    return {
+        "token": create_event_token(current_user.email),
+        "expires_in": EVENT_TOKEN_EXPIRE_SECONDS,
+    }
+
+
+@router.get("")
+async def stream_events(
+    db: AsyncSession = Depends(get_read_db),
+    current_user: User = Depends(get_event_stream_user),
+):
+    """Server-Sent Events announcing changes to the user's herds and records.
+
+    Clients refetch on a notice (and on ``ready``, sent on every connect)
+    instead of polling.
+    """
+    user_id = current_user.id
+    # Don't keep the session's connection for the life of the stream
+    await db.close()
+    return StreamingResponse(
+        event_broker.stream(user_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
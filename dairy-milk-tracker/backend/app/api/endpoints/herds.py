@@ -1,18 +1,60 @@
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException
+import asyncio
+from datetime import date
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 
+from app.anomalies import delete_herd_alerts
+from app.archive import delete_herd_archives, remove_herd_archive_files
 from app.auth import get_current_active_user
-from app.database import get_db
+from app.database import get_db, get_read_db
+from app.events import event_broker
+from app.models.alert import HerdAlert
 from app.models.herd import Herd
 from app.models.user import User
-from app.schemas.herd import Herd as HerdSchema, HerdCreate
+from app.pagination import NEXT_CURSOR_HEADER, decode_cursor, encode_cursor
+from app.query_log import query_budget
+from app.response_cache import response_cache
+from app.rollups import delete_herd_rollups
+from app.row_encoding import encode_json_rows, schema_columns
+from app.schemas.herd import Herd as HerdSchema, HerdAlert as HerdAlertSchema, HerdCreate
 
 router = APIRouter()
 
+# The listing selects these as row tuples instead of loading ORM objects
+HERD_FIELDS = tuple(HerdSchema.model_fields)
+HERD_COLUMNS = schema_columns(Herd, HerdSchema)
+
+
+def herd_list_query(
+    user_id: int, skip: int = 0, limit: int = 100, after_id: Optional[int] = None
+):
+    """A user's herds ordered by id, after ``after_id`` or from an offset"""
+    query = select(*HERD_COLUMNS).where(Herd.user_id == user_id)
+    
+    # Keyset pagination on id when a cursor is given, offset otherwise
+    if after_id is not None:
+        query = query.where(Herd.id > after_id)
+    else:
+        query = query.offset(skip)
+    return query.order_by(Herd.id).limit(limit)
+
+
+def herd_query(user_id: int, herd_id: int):
+    return select(Herd).where(Herd.id == herd_id, Herd.user_id == user_id)
+
+
+def herd_alerts_query(herd_id: int, since: Optional[date] = None, limit: int = 100):
+    """A herd's alerts, newest first (a backwards scan of its unique index)"""
+    query = select(HerdAlert).where(HerdAlert.herd_id == herd_id)
+    if since:
+        query = query.where(HerdAlert.day >= since)
+    return query.order_by(HerdAlert.day.desc(), HerdAlert.kind.desc()).limit(limit)
+
 
 @router.post("/", response_model=HerdSchema)
+@query_budget(3)
 async def create_herd(
     herd: HerdCreate,
     db: AsyncSession = Depends(get_db),
@@ -21,36 +63,51 @@ async def create_herd(
     db_herd = Herd(**herd.model_dump(), user_id=current_user.id)
     db.add(db_herd)
     await db.commit()
+    response_cache.bump(current_user.id)
     await db.refresh(db_herd)
+    event_broker.publish(current_user.id, "herd", {"action": "created", "herd_id": db_herd.id})
     return db_herd
 
 
 @router.get("/", response_model=List[HerdSchema])
+@query_budget(2)
 async def read_herds(
+    request: Request,
     skip: int = 0,
     limit: int = 100,
-    db: AsyncSession = Depends(get_db),
+    cursor: str = None,
+    db: AsyncSession = Depends(get_read_db),
     current_user: User = Depends(get_current_active_user),
 ):
-    result = await db.execute(
-        select(Herd)
-        .where(Herd.user_id == current_user.id)
-        .offset(skip)
-        .limit(limit)
-    )
-    herds = result.scalars().all()
-    return herds
+    # Answered from cache (or with a 304) while the user's data is unchanged
+    cached = response_cache.lookup(request, current_user.id)
+    cached_response = cached.response()
+    if cached_response is not None:
+        return cached_response
+    
+    after_id = None
+    if cursor:
+        (after_id,) = decode_cursor(cursor, 1)
+        if not isinstance(after_id, int):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    
+    result = await db.execute(herd_list_query(current_user.id, skip, limit, after_id))
+    rows = result.all()
+    
+    headers = {}
+    if limit > 0 and len(rows) == limit:
+        headers[NEXT_CURSOR_HEADER] = encode_cursor(rows[-1].id)
+    return cached.store_json(encode_json_rows(HERD_FIELDS, rows), headers)
 
 
 @router.get("/{herd_id}", response_model=HerdSchema)
+@query_budget(2)
 async def read_herd(
     herd_id: int,
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
     current_user: User = Depends(get_current_active_user),
 ):
-    result = await db.execute(
-        select(Herd).where(Herd.id == herd_id, Herd.user_id == current_user.id)
-    )
+    result = await db.execute(herd_query(current_user.id, herd_id))
     herd = result.scalars().first()
     if herd is None:
         raise HTTPException(status_code=404, detail="Herd not found")
@@ -64,9 +121,7 @@ async def update_herd(
     db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user),
 ):
-    result = await db.execute(
-        select(Herd).where(Herd.id == herd_id, Herd.user_id == current_user.id)
-    )
+    result = await db.execute(herd_query(current_user.id, herd_id))
     db_herd = result.scalars().first()
     if db_herd is None:
         raise HTTPException(status_code=404, detail="Herd not found")
@@ -76,6 +131,8 @@ async def update_herd(
         setattr(db_herd, key, value)
     
     await db.commit()
+    response_cache.bump(current_user.id)
+    event_broker.publish(current_user.id, "herd", {"action": "updated", "herd_id": herd_id})
     await db.refresh(db_herd)
     return db_herd
 
@@ -86,13 +143,38 @@ async def delete_herd(
     db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user),
 ):
-    result = await db.execute(
-        select(Herd).where(Herd.id == herd_id, Herd.user_id == current_user.id)
-    )
+    result = await db.execute(herd_query(current_user.id, herd_id))
     db_herd = result.scalars().first()
     if db_herd is None:
         raise HTTPException(status_code=404, detail="Herd not found")
     
     await db.delete(db_herd)
+    # In the same transaction, so a herd that reuses the id starts empty
+    await delete_herd_rollups(db, herd_id)
+    await delete_herd_archives(db, herd_id)
+    await delete_herd_alerts(db, herd_id)
     await db.commit()
+    await asyncio.to_thread(remove_herd_archive_files, herd_id)
+    response_cache.bump(current_user.id)
+    event_broker.publish(current_user.id, "herd", {"action": "deleted", "herd_id": herd_id})
     return db_herd
+
+
+@router.get("/{herd_id}/alerts", response_model=List[HerdAlertSchema])
+@query_budget(3)
+async def read_herd_alerts(
+    herd_id: int,
+    since: Optional[date] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    db: AsyncSession = Depends(get_read_db),
+    current_user: User = Depends(get_current_active_user),
+):
+    """Yield drops flagged by the anomaly detection job"""
+    result = await db.execute(
+        select(Herd.id).where(Herd.id == herd_id, Herd.user_id == current_user.id)
+    )
+    if result.scalar() is None:
+        raise HTTPException(status_code=404, detail="Herd not found")
+    
+    result = await db.execute(herd_alerts_query(herd_id, since, limit))
+    return result.scalars().all()
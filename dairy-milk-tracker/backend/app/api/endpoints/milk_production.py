@@ -1,29 +1,133 @@
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy import func
+from typing import Any, Dict, List, Optional
+import io
+import logging
+from fastapi import (
+    APIRouter,
+    Body,
+    Depends,
+    File,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+    UploadFile,
+)
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+from sqlalchemy import func, insert, tuple_
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from datetime import datetime, timedelta
+from datetime import date, datetime
 
+from app.archive import archive_query, stream_archived_export_rows
 from app.auth import get_current_active_user
-from app.database import get_db
+from app.database import get_db, get_read_db
+from app.events import event_broker, milk_change
+from app.milk_export import (
+    EXPORT_ENCODERS,
+    EXPORT_FORMATS,
+    EXPORT_FORMATS_BY_MEDIA_TYPE,
+    EXPORT_MEDIA_TYPES,
+    build_export_query,
+    export_sort_key,
+    merge_sorted_chunks,
+    stream_export_rows,
+)
+from app.milk_import import (
+    IMPORT_FORMATS,
+    detect_format,
+    format_validation_error,
+    import_milk_productions,
+)
 from app.models.herd import Herd
 from app.models.milk_production import MilkProduction
 from app.models.user import User
+from app.pagination import NEXT_CURSOR_HEADER, decode_date_id_cursor, encode_cursor
+from app.query_log import query_budget
+from app.response_cache import response_cache
+from app.rollups import RollupDelta, production_stats, time_span_start
+from app.row_encoding import (
+    ARROW_STREAM_MEDIA_TYPE,
+    MSGPACK_MEDIA_TYPE,
+    arrow_schema,
+    columnar_media_types,
+    encode_arrow_stream,
+    encode_json_rows,
+    encode_msgpack_columns,
+    preferred_media_type,
+    schema_columns,
+)
+from app.series import SERIES_BUCKETS, build_series_query, compute_series
+from app.write_coalescer import HerdNotFound, MilkWriteCoalescer, get_milk_write_coalescer
 from app.schemas.milk_production import (
     MilkProduction as MilkProductionSchema,
+    MilkProductionBulkError,
+    MilkProductionBulkResult,
     MilkProductionCreate,
+    MilkProductionImportReject,
+    MilkProductionImportResult,
+    MilkProductionSeries,
     MilkProductionStats,
 )
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
+
+# Upper bound on rows accepted by a single bulk request
+BULK_MAX_ROWS = 10000
+# Number of rejected rows echoed back by the import endpoint
+IMPORT_MAX_REPORTED_REJECTS = 100
+
+# Listings select these as row tuples instead of loading ORM objects
+MILK_PRODUCTION_FIELDS = tuple(MilkProductionSchema.model_fields)
+MILK_PRODUCTION_COLUMNS = schema_columns(MilkProduction, MilkProductionSchema)
+
+
+def milk_production_list_query(
+    user_id: int,
+    herd_id: Optional[int] = None,
+    skip: int = 0,
+    limit: int = 100,
+    after: Optional[tuple] = None,
+):
+    """Records of a user's herds ordered by (date, id), as column rows.
+
+    ``after`` is a (date, id) keyset cursor, so deep pages cost the same as
+    the first one; without it ``skip`` is a plain offset.
+    """
+    # Join with herds to filter by user
+    query = (
+        select(*MILK_PRODUCTION_COLUMNS)
+        .join(Herd, MilkProduction.herd_id == Herd.id)
+        .where(Herd.user_id == user_id)
+    )
+    
+    # Filter by herd if specified
+    if herd_id:
+        query = query.where(MilkProduction.herd_id == herd_id)
+    
+    if after:
+        query = query.where(tuple_(MilkProduction.date, MilkProduction.id) > tuple_(*after))
+    else:
+        query = query.offset(skip)
+    return query.order_by(MilkProduction.date, MilkProduction.id).limit(limit)
+
+
+def milk_production_query(user_id: int, milk_production_id: int):
+    """A single record, provided it belongs to one of the user's herds"""
+    return (
+        select(MilkProduction)
+        .join(Herd)
+        .where(MilkProduction.id == milk_production_id, Herd.user_id == user_id)
+    )
 
 
 @router.post("/", response_model=MilkProductionSchema)
 async def create_milk_production(
     milk_production: MilkProductionCreate,
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
     current_user: User = Depends(get_current_active_user),
+    coalescer: MilkWriteCoalescer = Depends(get_milk_write_coalescer),
 ):
     # Verify herd belongs to user
     result = await db.execute(
@@ -34,68 +138,196 @@ async def create_milk_production(
     herd = result.scalars().first()
     if not herd:
         raise HTTPException(status_code=404, detail="Herd not found")
+    # Don't hold a read transaction open while waiting for the write
+    await db.close()
     
-    db_milk_production = MilkProduction(**milk_production.model_dump())
-    db.add(db_milk_production)
-    await db.commit()
-    await db.refresh(db_milk_production)
-    return db_milk_production
+    # Inserted together with other concurrent requests in one transaction
+    try:
+        row = await coalescer.submit(milk_production, current_user.id)
+    except HerdNotFound:
+        # Deleted (or handed over) while the record was waiting
+        raise HTTPException(status_code=404, detail="Herd not found")
+    response_cache.bump(current_user.id)
+    day = (milk_production.herd_id, milk_production.date.date())
+    event_broker.publish(
+        current_user.id,
+        "milk_production",
+        milk_change("created", {day: (row.day_total_liters, row.day_record_count)}),
+    )
+    # Answer with the record as stored (and as GET returns it): the column
+    # keeps a date's wall-clock time and drops its UTC offset
+    stored = milk_production.model_dump()
+    stored["date"] = stored["date"].replace(tzinfo=None)
+    return MilkProductionSchema(**stored, id=row.id, created_at=row.created_at)
+
+
+@router.post("/bulk", response_model=MilkProductionBulkResult)
+async def create_milk_productions_bulk(
+    rows: List[Dict[str, Any]] = Body(...),
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_active_user),
+):
+    if len(rows) > BULK_MAX_ROWS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Too many rows in one request (max {BULK_MAX_ROWS})",
+        )
+
+    # Validate every row up front so bad rows are reported, not fatal
+    errors = []
+    valid = []
+    for index, row in enumerate(rows):
+        try:
+            valid.append((index, MilkProductionCreate.model_validate(row)))
+        except ValidationError as e:
+            errors.append(
+                MilkProductionBulkError(index=index, detail=format_validation_error(e))
+            )
+
+    # One ownership check for all herds referenced by the batch
+    herd_ids = {record.herd_id for _, record in valid}
+    owned_herd_ids = set()
+    if herd_ids:
+        result = await db.execute(
+            select(Herd.id).where(
+                Herd.id.in_(herd_ids), Herd.user_id == current_user.id
+            )
+        )
+        owned_herd_ids = set(result.scalars().all())
+
+    values = []
+    delta = RollupDelta()
+    for index, record in valid:
+        if record.herd_id not in owned_herd_ids:
+            errors.append(MilkProductionBulkError(index=index, detail="Herd not found"))
+            continue
+        values.append(record.model_dump())
+        delta.add(record)
+
+    # executemany inside a single transaction
+    if values:
+        await db.execute(insert(MilkProduction), values)
+        daily_totals = await delta.apply(db)
+        await db.commit()
+        response_cache.bump(current_user.id)
+        event_broker.publish(
+            current_user.id, "milk_production", milk_change("created", daily_totals)
+        )
+
+    errors.sort(key=lambda error: error.index)
+    return MilkProductionBulkResult(inserted=len(values), errors=errors)
+
+
+@router.post("/import", response_model=MilkProductionImportResult)
+async def import_milk_production_file(
+    file: UploadFile = File(...),
+    format: str = None,  # 'csv', 'ndjson'; guessed from the file name if omitted
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_active_user),
+):
+    """Import a CSV or NDJSON file of records, committed in batches.
+
+    ``rejected`` counts every row that was turned down, but only the first
+    100 rejects are listed in ``rejects``; to get all of them, import the file
+    with ``import_milk_data.py``, which writes a reject file.
+    """
+    fmt = format or detect_format(file.filename)
+    if fmt not in IMPORT_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported import format. Must be one of: {', '.join(IMPORT_FORMATS)}",
+        )
+
+    # Only the first rejects are echoed back so the response stays small
+    rejects = []
+    # Herds that received rows, for the change notice
+    herd_ids = set()
+
+    def collect_reject(line, row, error):
+        if len(rejects) < IMPORT_MAX_REPORTED_REJECTS:
+            rejects.append(MilkProductionImportReject(line=line, detail=error))
+
+    # The upload is spooled to disk by Starlette; read it back line by line
+    stream = io.TextIOWrapper(file.file, encoding="utf-8-sig", newline="")
+    try:
+        stats = await import_milk_productions(
+            db,
+            stream,
+            fmt,
+            owner_id=current_user.id,
+            on_reject=collect_reject,
+            on_commit=herd_ids.update,
+        )
+    finally:
+        stream.detach()
+        # Rows may have been committed even if a later batch failed
+        response_cache.bump(current_user.id)
+        if herd_ids:
+            event_broker.publish(
+                current_user.id, "milk_production", milk_change("imported", herd_ids=herd_ids)
+            )
+
+    return MilkProductionImportResult(
+        processed=stats.processed,
+        inserted=stats.inserted,
+        rejected=stats.rejected,
+        rejects=rejects,
+    )
 
 
 @router.get("/", response_model=List[MilkProductionSchema])
+@query_budget(2)
 async def read_milk_productions(
+    request: Request,
     herd_id: int = None,
     skip: int = 0,
     limit: int = 100,
-    db: AsyncSession = Depends(get_db),
+    cursor: str = None,
+    db: AsyncSession = Depends(get_read_db),
     current_user: User = Depends(get_current_active_user),
 ):
-    # Base query joining milk production with herds to filter by user
-    query = select(MilkProduction).join(Herd).where(Herd.user_id == current_user.id)
-    
-    # Filter by herd if specified
-    if herd_id:
-        query = query.where(MilkProduction.herd_id == herd_id)
+    after = decode_date_id_cursor(cursor) if cursor else None
+    result = await db.execute(
+        milk_production_list_query(current_user.id, herd_id, skip, limit, after)
+    )
+    rows = result.all()
     
-    # Apply pagination
-    query = query.offset(skip).limit(limit)
+    headers = {"Vary": "Accept"}
+    if limit > 0 and len(rows) == limit:
+        last = rows[-1]
+        headers[NEXT_CURSOR_HEADER] = encode_cursor(last.date, last.id)
     
-    result = await db.execute(query)
-    milk_productions = result.scalars().all()
-    return milk_productions
+    # Columnar formats for bulk readers; the fields match the JSON objects
+    media_type = preferred_media_type(
+        request.headers.get("accept"), columnar_media_types()
+    )
+    if media_type == MSGPACK_MEDIA_TYPE:
+        content = encode_msgpack_columns(MILK_PRODUCTION_FIELDS, rows)
+    elif media_type == ARROW_STREAM_MEDIA_TYPE:
+        schema = arrow_schema(MILK_PRODUCTION_FIELDS, MILK_PRODUCTION_COLUMNS)
+        content = encode_arrow_stream(schema, rows)
+    else:
+        # Already in the response model's shape; skips validating every row
+        content = encode_json_rows(MILK_PRODUCTION_FIELDS, rows)
+    return Response(content=content, media_type=media_type, headers=headers)
 
 
 @router.get("/stats", response_model=MilkProductionStats)
+@query_budget(3)
 async def get_milk_production_stats(
+    request: Request,
     herd_id: int = None,
     time_span: str = None,  # 'week', 'month', 'year'
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
     current_user: User = Depends(get_current_active_user),
 ):
-    # Base query to filter by user's herds
-    query = (
-        select(
-            func.sum(MilkProduction.amount_liters).label("total_liters"),
-            func.count(MilkProduction.date.distinct()).label("days_recorded"),
-        )
-        .join(Herd)
-        .where(Herd.user_id == current_user.id)
-    )
+    # Answered from cache (or with a 304) while the user's data is unchanged
+    cached = response_cache.lookup(request, current_user.id)
+    cached_response = cached.response()
+    if cached_response is not None:
+        return cached_response
     
-    # Time filter
-    if time_span:
-        today = datetime.now().date()
-        if time_span == "week":
-            start_date = today - timedelta(days=7)
-        elif time_span == "month":
-            start_date = today - timedelta(days=30)
-        elif time_span == "year":
-            start_date = today - timedelta(days=365)
-        else:
-            start_date = None
-            
-        if start_date:
-            query = query.where(MilkProduction.date >= start_date)
+    start_date = time_span_start(time_span)
     
     # Filter by herd if specified
     herd = None
@@ -107,43 +339,114 @@ async def get_milk_production_stats(
         herd = herd_result.scalars().first()
         if not herd:
             raise HTTPException(status_code=404, detail="Herd not found")
-        
-        query = query.where(MilkProduction.herd_id == herd_id)
     
-    result = await db.execute(query)
-    stats = result.fetchone()
+    return cached.store(
+        await production_stats(db, current_user.id, herd, start_date)
+    )
+
+
+@router.get("/series", response_model=MilkProductionSeries)
+@query_budget(3)
+async def get_milk_production_series(
+    herd_id: int = None,
+    bucket: str = "day",  # 'day', 'week', 'month'
+    from_date: Optional[date] = Query(None, alias="from"),
+    to_date: Optional[date] = Query(None, alias="to"),
+    db: AsyncSession = Depends(get_read_db),
+    current_user: User = Depends(get_current_active_user),
+):
+    if bucket not in SERIES_BUCKETS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid bucket. Must be one of: {', '.join(SERIES_BUCKETS)}",
+        )
+    
+    # Cow count for liters per cow: the herd's, or all of the user's herds
+    if herd_id:
+        herd_result = await db.execute(
+            select(Herd.cow_count).where(
+                Herd.id == herd_id, Herd.user_id == current_user.id
+            )
+        )
+        herd_row = herd_result.first()
+        if herd_row is None:
+            raise HTTPException(status_code=404, detail="Herd not found")
+        cow_count = herd_row.cow_count or 0
+    else:
+        cow_result = await db.execute(
+            select(func.sum(Herd.cow_count)).where(Herd.user_id == current_user.id)
+        )
+        cow_count = cow_result.scalar() or 0
     
-    if not stats or stats.total_liters is None:
-        return MilkProductionStats(total_liters=0, average_per_day=0, days_recorded=0, liters_per_cow=0)
+    result = await db.execute(
+        build_series_query(current_user.id, bucket, herd_id, from_date, to_date)
+    )
+    series = compute_series(result.all(), bucket, cow_count)
+    points = [dict(zip(series.keys(), values)) for values in zip(*series.values())]
+    return MilkProductionSeries(bucket=bucket, points=points)
+
+
+@router.get("/export")
+async def export_milk_productions(
+    request: Request,
+    format: str = None,  # 'csv', 'ndjson', 'msgpack', 'arrow'; else from Accept
+    herd_id: int = None,
+    from_date: Optional[datetime] = Query(None, alias="from"),
+    to_date: Optional[datetime] = Query(None, alias="to"),
+    db: AsyncSession = Depends(get_read_db),
+    current_user: User = Depends(get_current_active_user),
+):
+    if format is None:
+        media_type = preferred_media_type(
+            request.headers.get("accept"), list(EXPORT_FORMATS_BY_MEDIA_TYPE)
+        )
+        format = EXPORT_FORMATS_BY_MEDIA_TYPE[media_type]
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported export format. Must be one of: {', '.join(EXPORT_FORMATS)}",
+        )
     
-    average_per_day = stats.total_liters / stats.days_recorded if stats.days_recorded > 0 else 0
+    if herd_id:
+        # Verify herd belongs to user
+        herd_result = await db.execute(
+            select(Herd.id).where(Herd.id == herd_id, Herd.user_id == current_user.id)
+        )
+        if herd_result.scalar() is None:
+            raise HTTPException(status_code=404, detail="Herd not found")
     
-    # Calculate liters per cow if herd is specified
-    liters_per_cow = 0
-    if herd and herd.cow_count > 0 and stats.days_recorded > 0:
-        liters_per_cow = (stats.total_liters / stats.days_recorded) / herd.cow_count
+    # Years moved to the archive are merged back in (date, id) order
+    archive_result = await db.execute(
+        archive_query(current_user.id, herd_id, from_date, to_date)
+    )
+    archives = archive_result.all()
     
-    return MilkProductionStats(
-        total_liters=stats.total_liters,
-        average_per_day=average_per_day,
-        days_recorded=stats.days_recorded,
-        liters_per_cow=liters_per_cow
+    query = build_export_query(current_user.id, herd_id, from_date, to_date)
+    chunks = stream_export_rows(db.bind, query)
+    if archives:
+        chunks = merge_sorted_chunks(
+            stream_archived_export_rows(archives, from_date, to_date),
+            chunks,
+            key=export_sort_key,
+        )
+    return StreamingResponse(
+        EXPORT_ENCODERS[format](chunks),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={
+            "Content-Disposition": f'attachment; filename="milk_production.{format}"'
+        },
     )
 
 
 @router.get("/{milk_production_id}", response_model=MilkProductionSchema)
+@query_budget(2)
 async def read_milk_production(
     milk_production_id: int,
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
     current_user: User = Depends(get_current_active_user),
 ):
-    # Query joining milk production with herds to filter by user
     result = await db.execute(
-        select(MilkProduction)
-        .join(Herd)
-        .where(
-            MilkProduction.id == milk_production_id, Herd.user_id == current_user.id
-        )
+        milk_production_query(current_user.id, milk_production_id)
     )
     milk_production = result.scalars().first()
     
@@ -173,28 +476,35 @@ async def update_milk_production(
         
         # Get the existing milk production record
         record_result = await db.execute(
-            select(MilkProduction)
-            .join(Herd)
-            .where(
-                MilkProduction.id == milk_production_id, Herd.user_id == current_user.id
-            )
+            milk_production_query(current_user.id, milk_production_id)
         )
         db_milk_production = record_result.scalars().first()
         
         if db_milk_production is None:
             raise HTTPException(status_code=404, detail="Milk production record not found")
         
-        # Update record attributes
+        # Update record attributes, moving its contribution in the rollups
+        delta = RollupDelta()
+        delta.remove(db_milk_production)
         for key, value in milk_production.model_dump().items():
             setattr(db_milk_production, key, value)
+        delta.add(db_milk_production)
+        daily_totals = await delta.apply(db)
         
         await db.commit()
+        response_cache.bump(current_user.id)
+        event_broker.publish(
+            current_user.id, "milk_production", milk_change("updated", daily_totals)
+        )
         await db.refresh(db_milk_production)
         
         return db_milk_production
     
-    except Exception as e:
-        print(f"Error updating milk production: {str(e)}")
+    except HTTPException:
+        # Re-raise HTTP exceptions
+        raise
+    except Exception:
+        logger.exception("Error updating milk production")
         raise
 
 
@@ -204,13 +514,8 @@ async def delete_milk_production(
     db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user),
 ):
-    # Query joining milk production with herds to filter by user
     result = await db.execute(
-        select(MilkProduction)
-        .join(Herd)
-        .where(
-            MilkProduction.id == milk_production_id, Herd.user_id == current_user.id
-        )
+        milk_production_query(current_user.id, milk_production_id)
     )
     milk_production = result.scalars().first()
     
@@ -218,6 +523,14 @@ async def delete_milk_production(
         raise HTTPException(status_code=404, detail="Milk production record not found")
     
     await db.delete(milk_production)
+    
+    delta = RollupDelta()
+    delta.remove(milk_production)
+    daily_totals = await delta.apply(db)
     await db.commit()
+    response_cache.bump(current_user.id)
+    event_broker.publish(
+        current_user.id, "milk_production", milk_change("deleted", daily_totals)
+    )
     
     return milk_production
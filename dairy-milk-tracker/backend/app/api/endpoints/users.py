@@ -1,16 +1,32 @@
+import asyncio
+import logging
+
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 
-from app.auth import get_current_active_user, get_password_hash
+from app.anomalies import delete_herd_alerts
+from app.archive import delete_herd_archives, remove_herd_archive_files
+from app.auth import (
+    get_current_active_user,
+    get_password_hash_async,
+    invalidate_cached_user,
+)
 from app.database import get_db
+from app.events import event_broker
+from app.models.herd import Herd
 from app.models.user import User
+from app.query_log import query_budget
+from app.response_cache import response_cache
+from app.rollups import delete_herd_rollups
 from app.schemas.user import User as UserSchema, UserUpdate
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
 
 @router.get("/me", response_model=UserSchema)
+@query_budget(1)
 async def read_users_me(current_user: User = Depends(get_current_active_user)):
     return current_user
 
@@ -22,6 +38,10 @@ async def update_profile(
     current_user: User = Depends(get_current_active_user),
 ):
     try:
+        # current_user comes from the read session; write through this one
+        current_user = await db.merge(current_user, load=False)
+        previous_email = current_user.email
+        
         # Update username if provided
         if user_data.username is not None:
             # Check if username already exists
@@ -44,14 +64,15 @@ async def update_profile(
         
         # Update password if provided
         if user_data.password is not None and user_data.password.strip():
-            current_user.hashed_password = get_password_hash(user_data.password)
+            current_user.hashed_password = await get_password_hash_async(user_data.password)
         
         await db.commit()
         await db.refresh(current_user)
+        invalidate_cached_user(previous_email, current_user.email)
         
         return current_user
-    except Exception as e:
-        print(f"Error updating user profile: {str(e)}")
+    except Exception:
+        logger.exception("Error updating user profile")
         raise
 
 
@@ -70,9 +91,11 @@ async def update_membership(
         )
     
     # Update user membership
+    current_user = await db.merge(current_user, load=False)
     current_user.membership_type = membership_type
     await db.commit()
     await db.refresh(current_user)
+    invalidate_cached_user(current_user.email)
     
     return current_user
 
@@ -83,9 +106,26 @@ async def delete_account(
     current_user: User = Depends(get_current_active_user),
 ):
     try:
+        current_user = await db.merge(current_user, load=False)
+        user_id = current_user.id
+        email = current_user.email
+        result = await db.execute(select(Herd.id).where(Herd.user_id == user_id))
+        herd_ids = result.scalars().all()
+        # The herds go with the user; clear what delete_herd would, in the
+        # same transaction, so a herd that reuses an id starts empty
+        for herd_id in herd_ids:
+            await delete_herd_rollups(db, herd_id)
+            await delete_herd_archives(db, herd_id)
+            await delete_herd_alerts(db, herd_id)
         await db.delete(current_user)
         await db.commit()
+        for herd_id in herd_ids:
+            await asyncio.to_thread(remove_herd_archive_files, herd_id)
+        invalidate_cached_user(email)
+        response_cache.bump(user_id)
+        for herd_id in herd_ids:
+            event_broker.publish(user_id, "herd", {"action": "deleted", "herd_id": herd_id})
         return {"detail": "User account deleted successfully"}
-    except Exception as e:
-        print(f"Error deleting user account: {str(e)}")
+    except Exception:
+        logger.exception("Error deleting user account")
         raise
@@ -0,0 +1,324 @@
+import asyncio
+import os
+import shutil
+import uuid
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import date, datetime
+from typing import AsyncIterator, Dict, List, Optional
+
+import numpy as np
+from sqlalchemy import Integer, cast, delete, func
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.database import DB_PATH
+from app.models.archive import MilkArchive
+from app.models.herd import Herd
+from app.models.milk_production import MilkProduction
+
+# Column files live under <database name>_archive/herd_<id>/<year>-<token>/
+ARCHIVE_DIR = os.environ.get(
+    "ARCHIVE_DIR", os.path.splitext(DB_PATH)[0] + "_archive"
+)
+# Whole years older than this many days are moved out of milk_productions
+ARCHIVE_HORIZON_DAYS = int(os.environ.get("ARCHIVE_HORIZON_DAYS", "730"))
+# Rows per chunk handed to the export encoders
+ARCHIVE_CHUNK_SIZE = 1000
+# Largest IN (...) list used when deleting archived rows
+_DELETE_BATCH_SIZE = 500
+
+# One .npy file per column; missing values are NaN (floats) or NaT (dates)
+ARCHIVE_COLUMNS = {
+    "id": np.int64,
+    "date": "datetime64[us]",
+    "amount_liters": np.float64,
+    "fat_percentage": np.float64,
+    "protein_percentage": np.float64,
+    "created_at": "datetime64[us]",
+}
+
+
+@dataclass
+class ArchiveResult:
+    herd_years: int = 0
+    records: int = 0
+
+
+def archive_cutoff(today: date, horizon_days: int = ARCHIVE_HORIZON_DAYS) -> datetime:
+    """Start of the oldest year that stays in milk_productions.
+
+    Only whole years are archived, so every herd-year file is written once
+    (and rewritten only if records for that year are added later).
+    """
+    horizon = date.fromordinal(today.toordinal() - horizon_days)
+    return datetime(horizon.year, 1, 1)
+
+
+def load_archive(path: str, archive_dir: Optional[str] = None) -> Dict[str, np.ndarray]:
+    """A herd-year's columns, memory-mapped read-only"""
+    directory = os.path.join(archive_dir or ARCHIVE_DIR, path)
+    return {
+        name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+        for name in ARCHIVE_COLUMNS
+    }
+
+
+def _write_archive(columns: Dict[str, np.ndarray], archive_dir: str, herd_id: int, year: int) -> str:
+    path = os.path.join(f"herd_{herd_id}", f"{year}-{uuid.uuid4().hex[:8]}")
+    final = os.path.join(archive_dir, path)
+    staging = final + ".tmp"
+    os.makedirs(staging)
+    for name, values in columns.items():
+        np.save(os.path.join(staging, f"{name}.npy"), values)
+    # A directory only appears under its final name once every file is written
+    os.rename(staging, final)
+    return path
+
+
+def _rows_to_columns(rows) -> Dict[str, np.ndarray]:
+    columns = {}
+    for name, dtype in ARCHIVE_COLUMNS.items():
+        values = [getattr(row, name) for row in rows]
+        if dtype == np.float64:
+            values = [np.nan if value is None else value for value in values]
+        columns[name] = np.array(values, dtype=dtype)
+    return columns
+
+
+def _sorted_by_date_and_id(columns: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    order = np.lexsort((columns["id"], columns["date"]))
+    return {name: np.asarray(values)[order] for name, values in columns.items()}
+
+
+async def archive_milk_productions(
+    db: AsyncSession, cutoff: datetime, archive_dir: Optional[str] = None
+) -> ArchiveResult:
+    """Move records dated before ``cutoff`` into per-herd, per-year files.
+
+    Each herd-year commits separately: its files are written first, then its
+    rows are deleted and its manifest entry saved in one transaction, so a
+    failure leaves at worst an unreferenced directory behind. Rollups are
+    left alone; they keep counting archived records.
+    """
+    archive_dir = archive_dir or ARCHIVE_DIR
+    year = cast(func.strftime("%Y", MilkProduction.date), Integer)
+    result = await db.execute(
+        select(MilkProduction.herd_id, year)
+        .where(MilkProduction.date < cutoff, MilkProduction.herd_id.is_not(None))
+        .distinct()
+        .order_by(MilkProduction.herd_id, year)
+    )
+    herd_years = result.all()
+    await db.commit()
+
+    archived = ArchiveResult()
+    for herd_id, herd_year in herd_years:
+        year_end = min(datetime(herd_year + 1, 1, 1), cutoff)
+        rows = (
+            await db.execute(
+                select(*[getattr(MilkProduction, name) for name in ARCHIVE_COLUMNS])
+                .where(
+                    MilkProduction.herd_id == herd_id,
+                    MilkProduction.date >= datetime(herd_year, 1, 1),
+                    MilkProduction.date < year_end,
+                )
+            )
+        ).all()
+        if not rows:
+            continue
+        columns = _rows_to_columns(rows)
+
+        # Records added to an already archived year go into a rewritten file
+        existing = await db.get(MilkArchive, (herd_id, herd_year))
+        previous_path = existing.path if existing is not None else None
+        if previous_path is not None:
+            previous = load_archive(previous_path, archive_dir)
+            columns = {
+                name: np.concatenate([previous[name], columns[name]]) for name in columns
+            }
+        columns = _sorted_by_date_and_id(columns)
+        path = await asyncio.to_thread(_write_archive, columns, archive_dir, herd_id, herd_year)
+
+        try:
+            ids = [row.id for row in rows]
+            for start in range(0, len(ids), _DELETE_BATCH_SIZE):
+                await db.execute(
+                    delete(MilkProduction).where(
+                        MilkProduction.id.in_(ids[start : start + _DELETE_BATCH_SIZE])
+                    )
+                )
+            entry = dict(
+                herd_id=herd_id,
+                year=herd_year,
+                path=path,
+                record_count=len(columns["id"]),
+                first_date=columns["date"][0].item(),
+                last_date=columns["date"][-1].item(),
+            )
+            stmt = sqlite_insert(MilkArchive).values(**entry)
+            await db.execute(
+                stmt.on_conflict_do_update(
+                    index_elements=[MilkArchive.herd_id, MilkArchive.year],
+                    set_={**entry, "archived_at": func.now()},
+                )
+            )
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            shutil.rmtree(os.path.join(archive_dir, path), ignore_errors=True)
+            raise
+
+        if previous_path is not None:
+            shutil.rmtree(os.path.join(archive_dir, previous_path), ignore_errors=True)
+        archived.herd_years += 1
+        archived.records += len(rows)
+    return archived
+
+
+async def delete_herd_archives(db: AsyncSession, herd_id: int):
+    """Drop a deleted herd's manifest entries; the caller commits.
+
+    Its column files are removed with remove_herd_archive_files once the
+    delete is committed, so a rollback never leaves entries without files.
+    """
+    await db.execute(delete(MilkArchive).where(MilkArchive.herd_id == herd_id))
+
+
+def remove_herd_archive_files(herd_id: int, archive_dir: Optional[str] = None):
+    shutil.rmtree(os.path.join(archive_dir or ARCHIVE_DIR, f"herd_{herd_id}"), ignore_errors=True)
+
+
+def archive_query(
+    user_id: int,
+    herd_id: Optional[int] = None,
+    from_date: Optional[datetime] = None,
+    to_date: Optional[datetime] = None,
+):
+    """Manifest entries (with the herd's name) of a user's archived years"""
+    query = (
+        select(MilkArchive.herd_id, MilkArchive.year, MilkArchive.path, Herd.name)
+        .join(Herd, MilkArchive.herd_id == Herd.id)
+        .where(Herd.user_id == user_id)
+    )
+    if herd_id:
+        query = query.where(MilkArchive.herd_id == herd_id)
+    if from_date:
+        query = query.where(MilkArchive.year >= from_date.year)
+    if to_date:
+        query = query.where(MilkArchive.year <= to_date.year)
+    # Unordered: stream_archived_export_rows groups the entries by year
+    return query
+
+
+def _object_column(values: np.ndarray) -> np.ndarray:
+    """Python values for the encoders, with NaN and NaT turned into None"""
+    objects = values.astype(object)
+    if values.dtype.kind == "f":
+        objects[np.isnan(values)] = None
+    return objects
+
+
+def _datetime64(value: datetime) -> np.datetime64:
+    # Archived dates are naive, like the ones SQLite returns
+    return np.datetime64(value.replace(tzinfo=None), "us")
+
+
+def _export_rows_for_year(entries, from_date, to_date, archive_dir) -> List[tuple]:
+    parts = []
+    for entry in entries:
+        columns = load_archive(entry.path, archive_dir)
+        keep = np.ones(len(columns["id"]), dtype=bool)
+        if from_date:
+            keep &= columns["date"] >= _datetime64(from_date)
+        if to_date:
+            keep &= columns["date"] <= _datetime64(to_date)
+        parts.append(
+            (entry.herd_id, entry.name, {name: values[keep] for name, values in columns.items()})
+        )
+
+    ids = np.concatenate([columns["id"] for _, _, columns in parts])
+    dates = np.concatenate([columns["date"] for _, _, columns in parts])
+    order = np.lexsort((ids, dates))
+    herd_ids = np.concatenate(
+        [np.full(len(columns["id"]), herd_id) for herd_id, _, columns in parts]
+    )
+    herd_names = np.concatenate(
+        [np.full(len(columns["id"]), name, dtype=object) for _, name, columns in parts]
+    )
+
+    def column(name):
+        return _object_column(np.concatenate([columns[name] for _, _, columns in parts])[order])
+
+    # Same column order as app.milk_export.EXPORT_COLUMNS
+    return list(
+        zip(
+            ids[order].tolist(),
+            herd_ids[order].tolist(),
+            herd_names[order].tolist(),
+            column("date"),
+            column("amount_liters"),
+            column("fat_percentage"),
+            column("protein_percentage"),
+            column("created_at"),
+        )
+    )
+
+
+async def stream_archived_export_rows(
+    entries, from_date=None, to_date=None, archive_dir: Optional[str] = None
+) -> AsyncIterator[list]:
+    """Export rows of the given manifest entries in (date, id) order.
+
+    Herds are merged one year at a time, so memory is bounded by a year of
+    the user's records rather than their whole history.
+    """
+    archive_dir = archive_dir or ARCHIVE_DIR
+    by_year = defaultdict(list)
+    for entry in entries:
+        by_year[entry.year].append(entry)
+    for year in sorted(by_year):
+        rows = await asyncio.to_thread(
+            _export_rows_for_year, by_year[year], from_date, to_date, archive_dir
+        )
+        for start in range(0, len(rows), ARCHIVE_CHUNK_SIZE):
+            yield rows[start : start + ARCHIVE_CHUNK_SIZE]
+
+
+def archive_daily_totals(herd_id: int, columns: Dict[str, np.ndarray]) -> List[dict]:
+    """Rollup rows (as for milk_daily_totals) for one archived herd-year"""
+    days, day_index = np.unique(columns["date"].astype("datetime64[D]"), return_inverse=True)
+
+    def sums(values):
+        present = ~np.isnan(values)
+        return (
+            np.bincount(day_index, weights=np.where(present, values, 0), minlength=len(days)),
+            np.bincount(day_index, weights=present, minlength=len(days)).astype(np.int64),
+        )
+
+    total_liters, _ = sums(np.asarray(columns["amount_liters"], dtype=np.float64))
+    record_count = np.bincount(day_index, minlength=len(days))
+    fat_sum, fat_count = sums(np.asarray(columns["fat_percentage"], dtype=np.float64))
+    protein_sum, protein_count = sums(np.asarray(columns["protein_percentage"], dtype=np.float64))
+    return [
+        dict(
+            herd_id=herd_id,
+            day=day,
+            total_liters=values[0],
+            record_count=values[1],
+            fat_sum=values[2],
+            fat_count=values[3],
+            protein_sum=values[4],
+            protein_count=values[5],
+        )
+        for day, *values in zip(
+            days.astype(date).tolist(),
+            total_liters.tolist(),
+            record_count.tolist(),
+            fat_sum.tolist(),
+            fat_count.tolist(),
+            protein_sum.tolist(),
+            protein_count.tolist(),
+        )
+    ]
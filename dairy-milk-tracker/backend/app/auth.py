@@ -1,5 +1,6 @@
 from datetime import datetime, timedelta
 from typing import Optional
+import logging
 import os
 import secrets
 
@@ -9,19 +10,49 @@ from jose import JWTError, jwt
 from passlib.context import CryptContext
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
+from sqlalchemy.orm import make_transient_to_detached
 
-from app.database import get_db
+from app.cache import TTLCache
+from app.database import DB_PATH, get_read_db
+from app.executors import BoundedThreadPool
+from app.file_lock import read_or_create
 from app.models.user import User
 from app.schemas.user import TokenData
 
-# Generate a secret key if not provided in environment
-SECRET_KEY = os.environ.get("SECRET_KEY", secrets.token_hex(32))
+logger = logging.getLogger(__name__)
+
+# Without SECRET_KEY a key is generated once and kept next to the database,
+# so every worker process (and every restart) accepts the same tokens
+SECRET_KEY_FILE = os.environ.get(
+    "SECRET_KEY_FILE", os.path.join(os.path.dirname(DB_PATH), ".secret_key")
+)
+SECRET_KEY = os.environ.get("SECRET_KEY") or read_or_create(
+    SECRET_KEY_FILE, lambda: secrets.token_hex(32)
+)
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.environ.get("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
+# Event stream tokens travel in the URL (and so end up in access logs); they
+# only open a stream and only for long enough to connect
+EVENT_TOKEN_SCOPE = "events"
+EVENT_TOKEN_EXPIRE_SECONDS = int(os.environ.get("EVENT_TOKEN_EXPIRE_SECONDS", "60"))
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/token")
 
+# bcrypt is deliberately slow, so it runs off the event loop on a small pool
+password_hashing_pool = BoundedThreadPool(
+    max_workers=int(
+        os.environ.get("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1)))
+    ),
+    name="password-hashing",
+)
+
+# Resolved users keyed by token subject (email), as plain column snapshots
+user_cache = TTLCache(
+    maxsize=int(os.environ.get("USER_CACHE_MAX_SIZE", "1024")),
+    ttl=float(os.environ.get("USER_CACHE_TTL_SECONDS", "60")),
+)
+
 
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
@@ -31,24 +62,72 @@ def get_password_hash(password):
     return pwd_context.hash(password)
 
 
+async def verify_password_async(plain_password, hashed_password):
+    return await password_hashing_pool.run(
+        verify_password, plain_password, hashed_password
+    )
+
+
+async def get_password_hash_async(password):
+    return await password_hashing_pool.run(get_password_hash, password)
+
+
+def user_by_email_query(email: str):
+    return select(User).filter(User.email == email)
+
+
 async def get_user(db: AsyncSession, email: str):
     try:
-        result = await db.execute(select(User).filter(User.email == email))
+        result = await db.execute(user_by_email_query(email))
         return result.scalars().first()
-    except Exception as e:
-        print(f"Error retrieving user: {str(e)}")
+    except Exception:
+        logger.exception("Error retrieving user")
         return None
 
 
+async def get_user_cached(db: AsyncSession, email: str):
+    """Like get_user, but served from user_cache when possible.
+
+    A hit rebuilds the user from its cached columns and merges it into
+    ``db`` without a SELECT, so handlers can modify and commit it as usual.
+    """
+    snapshot = user_cache.get(email)
+    if snapshot is None:
+        user = await get_user(db, email)
+        if user is not None:
+            user_cache.set(
+                email, {c.key: getattr(user, c.key) for c in User.__table__.columns}
+            )
+        return user
+
+    user = User(**snapshot)
+    make_transient_to_detached(user)
+    return await db.merge(user, load=False)
+
+
+def invalidate_cached_user(*emails: str):
+    """Drop users from user_cache after their row changed"""
+    for email in emails:
+        user_cache.delete(email)
+
+
 async def authenticate_user(db: AsyncSession, email: str, password: str):
     user = await get_user(db, email)
     if not user:
         return False
-    if not verify_password(password, user.hashed_password):
+    if not await verify_password_async(password, user.hashed_password):
         return False
     return user
 
 
+def create_event_token(email: str) -> str:
+    """Short-lived token that is only accepted by the event stream"""
+    return create_access_token(
+        data={"sub": email, "scope": EVENT_TOKEN_SCOPE},
+        expires_delta=timedelta(seconds=EVENT_TOKEN_EXPIRE_SECONDS),
+    )
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -61,22 +140,31 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
 
 
 async def get_current_user(
-    token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)
+    token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_read_db)
 ):
+    return await user_from_token(db, token)
+
+
+async def user_from_token(
+    db: AsyncSession, token: Optional[str], scope: Optional[str] = None
+):
+    """User a token was issued to; login tokens have no scope"""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    if not token:
+        raise credentials_exception
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         email: str = payload.get("sub")
-        if email is None:
+        if email is None or payload.get("scope") != scope:
             raise credentials_exception
         token_data = TokenData(email=email)
     except JWTError:
         raise credentials_exception
-    user = await get_user(db, email=token_data.email)
+    user = await get_user_cached(db, email=token_data.email)
     if user is None:
         raise credentials_exception
     return user
@@ -86,3 +174,14 @@ async def get_current_active_user(current_user: User = Depends(get_current_user)
     if not current_user.is_active:
         raise HTTPException(status_code=400, detail="Inactive user")
     return current_user
+
+
+async def get_event_stream_user(
+    token: Optional[str] = None, db: AsyncSession = Depends(get_read_db)
+):
+    """Like get_current_active_user, for an event token given as ``?token=``.
+
+    Browsers' EventSource can't send an Authorization header.
+    """
+    user = await user_from_token(db, token, scope=EVENT_TOKEN_SCOPE)
+    return await get_current_active_user(user)
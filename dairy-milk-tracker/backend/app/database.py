@@ -1,36 +1,113 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 import os
 
+from app.metrics import instrument_engine, timed_pool
+from app.query_log import install_configured_query_log
+
 # Ensuring an absolute path for the database file
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-DB_PATH = os.path.join(BASE_DIR, 'dairy_milk_tracker.db')
+# DATABASE_PATH points the app at another file, e.g. a benchmark database
+DB_PATH = os.environ.get("DATABASE_PATH", os.path.join(BASE_DIR, 'dairy_milk_tracker.db'))
 SQLALCHEMY_DATABASE_URL = f"sqlite+aiosqlite:///{DB_PATH}"
+# Taken by each server process while it migrates the schema at startup
+STARTUP_LOCK_PATH = f"{DB_PATH}.lock"
 
-print(f"Database URL: {SQLALCHEMY_DATABASE_URL}")
-
-# Create engine with connection pool settings
-engine = create_async_engine(
-    SQLALCHEMY_DATABASE_URL, 
-    connect_args={"check_same_thread": False},
-    # Add connection pool settings for better stability
-    pool_size=5,  # Default number of connections
-    max_overflow=10,  # Maximum number of connections to create above pool_size
-    pool_timeout=30,  # Seconds to wait before giving up obtaining a connection 
-    pool_recycle=1800,  # Recycle connections after 30 minutes
-    pool_pre_ping=True  # Verify connection validity before using it
-)
+# 'default' keeps a single shared pool; 'production' switches SQLite to WAL
+# with a pool of read-only connections and one dedicated writer connection
+DATABASE_PROFILE = os.environ.get("DATABASE_PROFILE", "default")
+SQLITE_READ_POOL_SIZE = int(os.environ.get("SQLITE_READ_POOL_SIZE", "4"))
+SQLITE_MMAP_SIZE = int(os.environ.get("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_CACHE_SIZE_KB = int(os.environ.get("SQLITE_CACHE_SIZE_KB", "65536"))
+
+
+def configure_sqlite_pragmas(async_engine, read_only=False):
+    """Apply the production pragmas to every new connection of an engine"""
+
+    @event.listens_for(async_engine.sync_engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        # Negative cache_size is in KiB rather than pages
+        cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+        cursor.execute("PRAGMA busy_timeout=5000")
+        if read_only:
+            cursor.execute("PRAGMA query_only=ON")
+        cursor.close()
+
+    return async_engine
+
+
+if DATABASE_PROFILE == "production":
+    # One writer connection: SQLite only allows a single writer anyway, so
+    # writes queue on the pool instead of failing with "database is locked"
+    engine = configure_sqlite_pragmas(
+        create_async_engine(
+            SQLALCHEMY_DATABASE_URL,
+            connect_args={"check_same_thread": False},
+            poolclass=timed_pool("writer"),
+            pool_size=1,
+            max_overflow=0,
+            pool_timeout=30,
+            pool_recycle=1800,
+            pool_pre_ping=True,
+        )
+    )
+    # Readers never block the writer (or each other) in WAL mode
+    read_engine = configure_sqlite_pragmas(
+        create_async_engine(
+            SQLALCHEMY_DATABASE_URL,
+            connect_args={"check_same_thread": False},
+            poolclass=timed_pool("reader"),
+            pool_size=SQLITE_READ_POOL_SIZE,
+            max_overflow=0,
+            pool_timeout=30,
+            pool_recycle=1800,
+            pool_pre_ping=True,
+        ),
+        read_only=True,
+    )
+    instrument_engine(engine, "writer")
+    instrument_engine(read_engine, "reader")
+    install_configured_query_log(engine)
+    install_configured_query_log(read_engine)
+else:
+    # Create engine with connection pool settings
+    engine = create_async_engine(
+        SQLALCHEMY_DATABASE_URL,
+        connect_args={"check_same_thread": False},
+        poolclass=timed_pool("default"),
+        # Add connection pool settings for better stability
+        pool_size=5,  # Default number of connections
+        max_overflow=10,  # Maximum number of connections to create above pool_size
+        pool_timeout=30,  # Seconds to wait before giving up obtaining a connection
+        pool_recycle=1800,  # Recycle connections after 30 minutes
+        pool_pre_ping=True  # Verify connection validity before using it
+    )
+    instrument_engine(engine, "default")
+    install_configured_query_log(engine)
+    read_engine = engine
 
 SessionLocal = sessionmaker(
-    autocommit=False, 
-    autoflush=False, 
-    bind=engine, 
+    autocommit=False,
+    autoflush=False,
+    bind=engine,
     class_=AsyncSession,
     expire_on_commit=False  # Prevent detached instance errors
 )
 
+ReadSessionLocal = sessionmaker(
+    autocommit=False,
+    autoflush=False,
+    bind=read_engine,
+    class_=AsyncSession,
+    expire_on_commit=False
+)
+
 Base = declarative_base()
 
 
@@ -41,3 +118,12 @@ async def get_db():
         yield db
     finally:
         await db.close()
+
+
+async def get_read_db():
+    """Dependency for sessions that only read (served by the reader pool)"""
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        await db.close()
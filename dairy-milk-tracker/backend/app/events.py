@@ -0,0 +1,269 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+from collections import defaultdict
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Set, Tuple
+
+import orjson
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from app.models.event import ChangeEvent
+
+logger = logging.getLogger(__name__)
+
+# Notices a slow subscriber may fall behind by before it is told to resync
+EVENT_QUEUE_SIZE = int(os.environ.get("EVENT_QUEUE_SIZE", "100"))
+# A comment line is sent when a stream has been quiet this long, so proxies
+# keep the connection open and dead clients are noticed
+EVENT_HEARTBEAT_SECONDS = float(os.environ.get("EVENT_HEARTBEAT_SECONDS", "15"))
+# Streams end after this long; EventSource reconnects (with a fresh token)
+EVENT_STREAM_MAX_SECONDS = float(os.environ.get("EVENT_STREAM_MAX_SECONDS", "600"))
+# Daily totals carried by one notice; larger changes only list their herds
+EVENT_MAX_TOTALS = 100
+# Milliseconds browsers wait before reconnecting a dropped stream
+EVENT_RETRY_MS = 5000
+# How often notices are exchanged with the other server workers through the
+# change_events table; 0 (a single worker) turns the exchange off. run.py
+# sets it to 1 when starting several workers
+EVENT_SHARE_INTERVAL_SECONDS = float(os.environ.get("EVENT_SHARE_INTERVAL_SECONDS", "0"))
+# Shared notices older than this are deleted
+EVENT_SHARE_RETENTION_SECONDS = 300
+
+_HEARTBEAT = b": heartbeat\n\n"
+
+
+def encode_event(event: str, data: dict) -> bytes:
+    """One message in the text/event-stream format"""
+    return b"event: " + event.encode() + b"\ndata: " + orjson.dumps(data) + b"\n\n"
+
+
+_RESYNC = encode_event("resync", {})
+
+
+def milk_change(
+    action: str, daily_totals: Optional[Dict[tuple, tuple]] = None, herd_ids: Iterable[int] = ()
+) -> dict:
+    """Notice for changed milk records, from RollupDelta.apply's daily totals"""
+    daily_totals = daily_totals or {}
+    herd_ids = sorted(set(herd_ids) | {herd_id for herd_id, _ in daily_totals})
+    data = {"action": action, "herd_ids": herd_ids}
+    if len(daily_totals) <= EVENT_MAX_TOTALS:
+        data["totals"] = [
+            {
+                "herd_id": herd_id,
+                "day": day,
+                "total_liters": float(total_liters),
+                "record_count": record_count,
+            }
+            for (herd_id, day), (total_liters, record_count) in sorted(daily_totals.items())
+        ]
+    return data
+
+
+class EventBroker:
+    """Publish/subscribe of change notices, per user.
+
+    Handlers ``publish`` after committing a change; each open event stream of
+    that user gets the notice on its own bounded queue. Publishing never
+    waits: a subscriber whose queue is full has its backlog replaced by a
+    single ``resync`` notice, telling the client to refetch everything.
+
+    Subscribers live in this process. Once ``start_sharing`` has been called,
+    published notices are also written to the change_events table in
+    batches, and the notices other workers wrote there are passed on to this
+    worker's subscribers, so a stream hears about every change within about
+    two ``share_interval``s whichever worker made it.
+    """
+
+    def __init__(
+        self,
+        queue_size: int = 100,
+        heartbeat: float = 15.0,
+        max_duration: Optional[float] = None,
+        share_interval: float = 0.0,
+    ):
+        self.queue_size = queue_size
+        self.heartbeat = heartbeat
+        self.max_duration = max_duration
+        self.share_interval = share_interval
+        self.worker_id = uuid.uuid4().hex
+        self._subscribers: Dict[int, Set[asyncio.Queue]] = defaultdict(set)
+        self._outbox: List[Tuple[int, bytes]] = []
+        self._last_shared_id: Optional[int] = None
+        self._share_task: Optional[asyncio.Task] = None
+        self._share_engine: Optional[AsyncEngine] = None
+        self.published = 0
+        self.delivered = 0
+        self.resyncs = 0
+        self.shared = 0
+        self.received = 0
+
+    def subscribe(self, user_id: int) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers[user_id].add(queue)
+        return queue
+
+    def unsubscribe(self, user_id: int, queue: asyncio.Queue):
+        queues = self._subscribers.get(user_id)
+        if queues is None:
+            return
+        queues.discard(queue)
+        if not queues:
+            del self._subscribers[user_id]
+
+    def publish(self, user_id: int, event: str, data: dict):
+        """Send a notice to the user's open streams, here and in other workers"""
+        message = encode_event(event, data)
+        if self._share_task is not None:
+            self._outbox.append((user_id, message))
+        if self._deliver(user_id, message):
+            self.published += 1
+
+    def _deliver(self, user_id: int, message: bytes) -> bool:
+        queues = self._subscribers.get(user_id)
+        if not queues:
+            return False
+        for queue in queues:
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                # The client is too far behind for the notices to be useful
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(_RESYNC)
+                self.resyncs += 1
+            else:
+                self.delivered += 1
+        return True
+
+    def start_sharing(self, engine: AsyncEngine, read_engine: Optional[AsyncEngine] = None):
+        """Exchange notices with the other workers until ``stop_sharing``"""
+        if self.share_interval <= 0 or self._share_task is not None:
+            return
+        self._share_engine = engine
+        self._share_task = asyncio.get_running_loop().create_task(
+            self._share(engine, read_engine or engine)
+        )
+
+    async def stop_sharing(self):
+        """Stop the exchange, writing out the notices still waiting"""
+        if self._share_task is None:
+            return
+        task, self._share_task = self._share_task, None
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        try:
+            await self.exchange(self._share_engine, read=False)
+        except Exception:
+            logger.exception("Failed to share the last change notices")
+        self._outbox.clear()
+        self._last_shared_id = None
+
+    async def _share(self, engine: AsyncEngine, read_engine: AsyncEngine):
+        while True:
+            await asyncio.sleep(self.share_interval)
+            try:
+                await self.exchange(engine, read_engine)
+            except Exception:
+                # Kept in the outbox and read again on the next round
+                logger.exception("Failed to exchange change notices")
+
+    async def exchange(
+        self, engine: AsyncEngine, read_engine: Optional[AsyncEngine] = None, read: bool = True
+    ):
+        """Write out this worker's notices and deliver the other workers' ones"""
+        read_engine = read_engine or engine
+        if self._last_shared_id is None:
+            # Only notices published from now on are of interest
+            async with read_engine.connect() as conn:
+                result = await conn.execute(select(func.max(ChangeEvent.id)))
+                self._last_shared_id = result.scalar() or 0
+
+        pending = list(self._outbox)
+        if pending:
+            now = time.time()
+            async with engine.begin() as conn:
+                await conn.execute(
+                    insert(ChangeEvent),
+                    [
+                        {
+                            "worker": self.worker_id,
+                            "user_id": user_id,
+                            "message": message,
+                            "created_at": now,
+                        }
+                        for user_id, message in pending
+                    ],
+                )
+                await conn.execute(
+                    delete(ChangeEvent).where(
+                        ChangeEvent.created_at < now - EVENT_SHARE_RETENTION_SECONDS
+                    )
+                )
+            del self._outbox[: len(pending)]
+            self.shared += len(pending)
+
+        if not read:
+            return
+        async with read_engine.connect() as conn:
+            result = await conn.execute(
+                select(ChangeEvent.id, ChangeEvent.user_id, ChangeEvent.message)
+                .where(
+                    ChangeEvent.id > self._last_shared_id,
+                    ChangeEvent.worker != self.worker_id,
+                )
+                .order_by(ChangeEvent.id)
+            )
+            rows = result.all()
+        for row in rows:
+            self._last_shared_id = row.id
+            if self._deliver(row.user_id, row.message):
+                self.received += 1
+
+    async def stream(self, user_id: int) -> AsyncIterator[bytes]:
+        """Body of a text/event-stream response for one subscriber"""
+        queue = self.subscribe(user_id)
+        deadline = time.monotonic() + self.max_duration if self.max_duration else None
+        try:
+            yield b"retry: " + str(EVENT_RETRY_MS).encode() + b"\n\n"
+            yield encode_event("ready", {})
+            while True:
+                timeout = self.heartbeat
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return
+                    timeout = min(timeout, remaining)
+                try:
+                    message = await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    message = _HEARTBEAT
+                yield message
+        finally:
+            self.unsubscribe(user_id, queue)
+
+    def stats(self) -> dict:
+        return {
+            "users": len(self._subscribers),
+            "subscribers": sum(len(queues) for queues in self._subscribers.values()),
+            "published": self.published,
+            "delivered": self.delivered,
+            "resyncs": self.resyncs,
+            "shared": self.shared,
+            "received": self.received,
+            "outbox": len(self._outbox),
+        }
+
+
+event_broker = EventBroker(
+    queue_size=EVENT_QUEUE_SIZE,
+    heartbeat=EVENT_HEARTBEAT_SECONDS,
+    max_duration=EVENT_STREAM_MAX_SECONDS,
+    share_interval=EVENT_SHARE_INTERVAL_SECONDS,
+)
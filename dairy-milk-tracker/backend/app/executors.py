@@ -0,0 +1,65 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+from app.metrics import THREAD_POOL_TASK_TIME
+
+
+class BoundedThreadPool:
+    """Thread pool for blocking CPU work with a fixed concurrency cap.
+
+    At most ``max_workers`` calls run at once; the rest wait in the pool's
+    queue. Queue depth and throughput counters are kept for diagnostics.
+    """
+
+    def __init__(self, max_workers: int, name: str):
+        self.max_workers = max_workers
+        self.name = name
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix=name
+        )
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.max_queued = 0
+
+    def _run(self, func: Callable, *args):
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+        started = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            THREAD_POOL_TASK_TIME.labels(self.name).observe(time.perf_counter() - started)
+            with self._lock:
+                self.running -= 1
+                self.completed += 1
+
+    def _on_done(self, future):
+        # Calls cancelled before they started never reach _run
+        if future.cancelled():
+            with self._lock:
+                self.queued -= 1
+
+    async def run(self, func: Callable, *args):
+        """Run ``func(*args)`` on the pool and await its result"""
+        with self._lock:
+            self.queued += 1
+            self.max_queued = max(self.max_queued, self.queued)
+        future = self._executor.submit(self._run, func, *args)
+        future.add_done_callback(self._on_done)
+        return await asyncio.wrap_future(future)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "queued": self.queued,
+                "running": self.running,
+                "completed": self.completed,
+                "max_queued": self.max_queued,
+            }
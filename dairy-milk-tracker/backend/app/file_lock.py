@@ -0,0 +1,67 @@
+import os
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+@contextmanager
+def file_lock(path: str):
+    """Hold an exclusive lock on ``path`` (created if missing) across processes.
+
+    Blocks until other holders, e.g. sibling server workers, release it. The
+    lock is released when the block exits or the process dies.
+    """
+    with open(path, "a+b") as handle:
+        if fcntl is not None:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_EX)
+        else:
+            handle.seek(0)
+            msvcrt.locking(handle.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+            else:
+                handle.seek(0)
+                msvcrt.locking(handle.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _write_durably(path: str, contents: str):
+    # Written and synced under another name first, so a crash never leaves a
+    # partly written file at ``path``
+    staging = path + ".tmp"
+    descriptor = os.open(staging, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(descriptor, "w") as handle:
+        handle.write(contents)
+        handle.flush()
+        os.fsync(handle.fileno())
+    os.replace(staging, path)
+    if fcntl is not None:
+        # Persist the rename itself
+        directory = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+
+
+def read_or_create(path: str, create) -> str:
+    """Contents of ``path``, written with ``create()`` first if it doesn't exist.
+
+    Concurrent callers all get the same value: the file is created under a
+    lock and only readable by its owner. An empty file is an error rather
+    than an empty value.
+    """
+    with file_lock(path + ".lock"):
+        if not os.path.exists(path):
+            _write_durably(path, create())
+        with open(path) as handle:
+            contents = handle.read().strip()
+    if not contents:
+        raise RuntimeError(f"{path} is empty; remove it to generate a new one")
+    return contents
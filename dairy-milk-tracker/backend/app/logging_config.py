@@ -0,0 +1,231 @@
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", "10000"))
+# Records per second let through for each message template below ERROR
+LOG_SAMPLE_PER_SECOND = float(os.environ.get("LOG_SAMPLE_PER_SECOND", "20"))
+ACCESS_LOG = os.environ.get("ACCESS_LOG", "false").lower() in ("1", "true", "yes")
+REQUEST_ID_HEADER = "X-Request-ID"
+
+request_id: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+# Set by background tasks doing work for several requests at once, e.g. a
+# group commit, to the ids of those requests
+batch_request_ids: ContextVar[Optional[tuple]] = ContextVar("batch_request_ids", default=None)
+
+access_logger = logging.getLogger("app.access")
+
+# Attributes every LogRecord has; anything else was passed in ``extra``
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {
+    "message",
+    "asctime",
+    "request_id",
+    "request_ids",
+    "sampled_out",
+    "taskName",
+}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, including request id and ``extra`` fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+        if getattr(record, "request_ids", None):
+            entry["request_ids"] = list(record.request_ids)
+        if getattr(record, "sampled_out", 0):
+            entry["sampled_out"] = record.sampled_out
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc_info"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class RequestIdFilter(logging.Filter):
+    """Stamps records with the current request id(s) before they are queued"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id.get()
+        record.request_ids = batch_request_ids.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Lets at most ``per_second`` records per message template through.
+
+    Errors always pass. The next record let through for a template carries
+    the number dropped since the last one in ``sampled_out``. Windows of past
+    seconds are forgotten once nothing dropped is left to report, so
+    messages formatted before logging don't pile up.
+    """
+
+    def __init__(self, per_second: float):
+        super().__init__()
+        self.per_second = per_second
+        self._lock = threading.Lock()
+        self._windows = {}
+        self._second = None
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.ERROR or self.per_second <= 0:
+            return True
+        key = (record.name, record.msg)
+        second = int(time.monotonic())
+        with self._lock:
+            if second != self._second:
+                self._second = second
+                self._windows = {
+                    key: entry for key, entry in self._windows.items() if entry[2]
+                }
+            window, count, dropped = self._windows.get(key, (second, 0, 0))
+            if window != second:
+                window, count = second, 0
+            if count >= self.per_second:
+                self._windows[key] = (window, count, dropped + 1)
+                return False
+            self._windows[key] = (window, count + 1, 0)
+        record.sampled_out = dropped
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """QueueHandler that drops records instead of blocking when the queue is full"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Resolve what can't safely cross threads; the JSON is built by the
+        # listener. Unlike QueueHandler.prepare this keeps ``extra`` fields.
+        record = copy.copy(record)
+        record.msg, record.args = record.getMessage(), None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_listener: Optional[QueueListener] = None
+_queue_handler: Optional[NonBlockingQueueHandler] = None
+
+
+def configure_logging(level: str = LOG_LEVEL, stream=None):
+    """Send all app logging through a queue to a background writer thread.
+
+    Callers only format and enqueue records. The write to stdout (or
+    ``stream``), which can block, happens on the listener's thread.
+    """
+    global _listener, _queue_handler
+    if _listener is not None:
+        return
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(JsonFormatter())
+    _queue_handler = NonBlockingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    _queue_handler.addFilter(RequestIdFilter())
+    _queue_handler.addFilter(SamplingFilter(LOG_SAMPLE_PER_SECOND))
+
+    root = logging.getLogger()
+    root.addHandler(_queue_handler)
+    logging.getLogger("app").setLevel(level)
+
+    _listener = QueueListener(_queue_handler.queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """Write out queued records and stop the listener thread"""
+    global _listener, _queue_handler
+    if _listener is None:
+        return
+    _listener.stop()
+    logging.getLogger().removeHandler(_queue_handler)
+    _listener = None
+    _queue_handler = None
+
+
+def logging_stats() -> dict:
+    if _queue_handler is None:
+        return {"queued": 0, "dropped": 0}
+    return {"queued": _queue_handler.queue.qsize(), "dropped": _queue_handler.dropped}
+
+
+class RequestIdMiddleware:
+    """ASGI middleware giving each request an id for its log records.
+
+    An incoming X-Request-ID header is reused (so ids can follow a request
+    through a proxy); otherwise a new one is generated. The id is echoed in
+    the response. With ACCESS_LOG enabled one record per request is logged.
+    """
+
+    def __init__(self, app, access_log: bool = ACCESS_LOG):
+        self.app = app
+        self.access_log = access_log
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        incoming = dict(scope["headers"]).get(b"x-request-id", b"").decode("latin-1")
+        rid = incoming[:64] if incoming else uuid.uuid4().hex
+        token = request_id.set(rid)
+        status = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                # Copied: the list may belong to a reused Response object
+                message["headers"] = list(message.get("headers", [])) + [
+                    (REQUEST_ID_HEADER.lower().encode(), rid.encode("latin-1"))
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if self.access_log:
+                route = scope.get("route")
+                access_logger.info(
+                    "request",
+                    extra={
+                        "method": scope["method"],
+                        "route": route.path if route is not None else scope["path"],
+                        "status": status,
+                        "duration_ms": round((time.perf_counter() - started) * 1000, 2),
+                    },
+                )
+            request_id.reset(token)
@@ -1,13 +1,34 @@
-from fastapi import FastAPI
+import logging
+
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
-import os
-import sqlite3
+from prometheus_client import REGISTRY
 
 from app.api.api import api_router
-from app.database import Base, engine
+from app.auth import password_hashing_pool, user_cache
+from app.database import SQLALCHEMY_DATABASE_URL, STARTUP_LOCK_PATH, engine, read_engine
+from app.events import EVENT_SHARE_INTERVAL_SECONDS, event_broker
+from app.logging_config import (
+    REQUEST_ID_HEADER,
+    RequestIdMiddleware,
+    configure_logging,
+    logging_stats,
+)
+from app.metrics import MetricsMiddleware, StatsCollector, render_metrics
+from app.migrations import run_migrations_once
+from app.pagination import NEXT_CURSOR_HEADER
+from app.rate_limit import RateLimitMiddleware, rate_limiter, write_limiter
+from app.response_cache import response_cache
+from app.write_coalescer import milk_write_coalescer
+
+configure_logging()
+logger = logging.getLogger(__name__)
 
 app = FastAPI(title="Dairy Milk Tracker API")
 
+# Innermost, so rejected requests still get the CORS headers
+app.add_middleware(RateLimitMiddleware)
+
 # Set up CORS
 origins = [
     "http://localhost",
@@ -20,64 +41,74 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, REQUEST_ID_HEADER],
 )
 
-app.include_router(api_router, prefix="/api")
+# Latency includes CORS handling and the whole response body
+app.add_middleware(MetricsMiddleware)
+# Outermost, so every log record written for a request carries its id
+app.add_middleware(RequestIdMiddleware)
 
+app.include_router(api_router, prefix="/api")
 
-async def ensure_columns_exist():
-    """Make sure all necessary columns exist in the database"""
-    try:
-        db_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'dairy_milk_tracker.db')
-        
-        # Only run if database already exists
-        if os.path.exists(db_path):
-            # Connect directly to SQLite to add columns if they don't exist
-            conn = sqlite3.connect(db_path)
-            cursor = conn.cursor()
-            
-            # Check users table for username column
-            cursor.execute("PRAGMA table_info(users)")
-            columns = [column[1] for column in cursor.fetchall()]
-            
-            if 'username' not in columns:
-                print("Adding username column to users table")
-                cursor.execute("ALTER TABLE users ADD COLUMN username TEXT")
-            
-            # Check herds table for location columns
-            cursor.execute("PRAGMA table_info(herds)")
-            columns = [column[1] for column in cursor.fetchall()]
-            
-            if 'location_line1' not in columns:
-                print("Adding location_line1 column to herds table")
-                cursor.execute("ALTER TABLE herds ADD COLUMN location_line1 TEXT")
-            
-            if 'location_line2' not in columns:
-                print("Adding location_line2 column to herds table")
-                cursor.execute("ALTER TABLE herds ADD COLUMN location_line2 TEXT")
-            
-            conn.commit()
-            conn.close()
-            print("Database schema updated successfully")
-            
-    except Exception as e:
-        print(f"Warning: Error updating database schema: {str(e)}")
-        # Continue anyway - tables will be created by SQLAlchemy if missing
+# The component counters from /health, exported as gauges as well
+REGISTRY.register(
+    StatsCollector(
+        {
+            "user_cache": user_cache.stats,
+            "password_hashing": password_hashing_pool.stats,
+            "milk_write_coalescer": milk_write_coalescer.stats,
+            "response_cache": response_cache.stats,
+            "events": event_broker.stats,
+            "rate_limit": rate_limiter.stats,
+            "write_concurrency": write_limiter.stats,
+            "logging": logging_stats,
+        }
+    )
+)
 
 
 @app.on_event("startup")
 async def startup():
-    # First ensure columns exist in the database
-    await ensure_columns_exist()
-    
-    # Then create tables if they don't exist
-    print("Creating database tables...")
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
-    
-    print("Database tables created successfully")
+    # Creates or upgrades the schema; a single PRAGMA read when it's current.
+    # The lock makes sibling workers wait instead of migrating concurrently.
+    logger.info("Database URL: %s", SQLALCHEMY_DATABASE_URL)
+    applied = await run_migrations_once(engine, STARTUP_LOCK_PATH)
+    if applied:
+        logger.info("Database schema migrated to version %s", applied[-1])
+    if EVENT_SHARE_INTERVAL_SECONDS > 0:
+        # Pass change notices to and from the event streams of sibling workers
+        event_broker.start_sharing(engine, read_engine)
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    # Commit any milk records still waiting for a group commit
+    await milk_write_coalescer.close()
+    await event_broker.stop_sharing()
 
 
 @app.get("/")
 async def root():
     return {"message": "Welcome to the Dairy Milk Tracker API"}
+
+
+@app.get("/health")
+async def health():
+    return {
+        "status": "ok",
+        "user_cache": user_cache.stats(),
+        "password_hashing": password_hashing_pool.stats(),
+        "milk_write_coalescer": milk_write_coalescer.stats(),
+        "response_cache": response_cache.stats(),
+        "events": event_broker.stats(),
+        "rate_limit": rate_limiter.stats(),
+        "write_concurrency": write_limiter.stats(),
+        "logging": logging_stats(),
+    }
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
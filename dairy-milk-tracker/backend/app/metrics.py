@@ -0,0 +1,190 @@
+import time
+from contextvars import ContextVar
+from typing import Callable, Dict, Optional
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.registry import REGISTRY
+from sqlalchemy import event
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+# Latency buckets reach past a second because login waits for bcrypt
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+REQUESTS = Counter(
+    "http_requests_total", "HTTP requests", ["method", "route", "status"]
+)
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Time to the end of the response body",
+    ["method", "route"],
+    buckets=LATENCY_BUCKETS,
+)
+REQUESTS_IN_PROGRESS = Gauge("http_requests_in_progress", "Requests being handled")
+REQUEST_DB_QUERIES = Histogram(
+    "http_request_db_queries",
+    "Database statements executed per request",
+    ["route"],
+    buckets=QUERY_COUNT_BUCKETS,
+)
+REQUEST_DB_TIME = Histogram(
+    "http_request_db_seconds",
+    "Time spent executing database statements per request",
+    ["route"],
+    buckets=LATENCY_BUCKETS,
+)
+DB_QUERIES = Counter("db_queries_total", "Database statements executed", ["engine"])
+DB_QUERY_TIME = Histogram(
+    "db_query_duration_seconds",
+    "Time to execute one database statement",
+    ["engine"],
+    buckets=LATENCY_BUCKETS,
+)
+POOL_CHECKOUT_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds",
+    "Time waiting for a pooled database connection",
+    ["engine"],
+    buckets=LATENCY_BUCKETS,
+)
+THREAD_POOL_TASK_TIME = Histogram(
+    "thread_pool_task_seconds",
+    "Time a thread pool task spent running (e.g. bcrypt)",
+    ["pool"],
+    buckets=LATENCY_BUCKETS,
+)
+
+
+class RequestStats:
+    """Database work done while handling one request"""
+
+    __slots__ = ("scope", "route", "queries", "db_seconds", "over_budget")
+
+    def __init__(self, scope=None):
+        # The ASGI scope; routing adds the matched route and endpoint to it
+        self.scope = scope
+        self.route = None
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.over_budget = False
+
+
+# Set by MetricsMiddleware for the duration of each request
+current_request: ContextVar[Optional[RequestStats]] = ContextVar(
+    "current_request", default=None
+)
+
+
+def instrument_engine(async_engine, name: str):
+    """Count and time every statement run on an engine"""
+    sync_engine = async_engine.sync_engine
+    queries = DB_QUERIES.labels(name)
+    query_time = DB_QUERY_TIME.labels(name)
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_started"].pop()
+        queries.inc()
+        query_time.observe(elapsed)
+        stats = current_request.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.db_seconds += elapsed
+
+    @event.listens_for(sync_engine, "handle_error")
+    def handle_error(exception_context):
+        # after_cursor_execute doesn't run for failed statements
+        started = exception_context.connection.info.get("query_started")
+        if started:
+            started.pop()
+
+    return async_engine
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """Queue pool that records how long each checkout waits for a connection"""
+
+    metrics_name = "default"
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            POOL_CHECKOUT_WAIT.labels(self.metrics_name).observe(
+                time.perf_counter() - started
+            )
+
+
+def timed_pool(name: str):
+    """A TimedQueuePool subclass labelled ``name``, for ``poolclass=``"""
+    return type(f"TimedQueuePool_{name}", (TimedQueuePool,), {"metrics_name": name})
+
+
+class StatsCollector:
+    """Exports the counters the /health endpoint shows as gauges"""
+
+    def __init__(self, sources: Dict[str, Callable[[], dict]]):
+        self.sources = sources
+
+    def collect(self):
+        family = GaugeMetricFamily(
+            "app_component_stat", "Counters from app components", labels=["component", "stat"]
+        )
+        for component, stats in self.sources.items():
+            for stat, value in stats().items():
+                if isinstance(value, (int, float)):
+                    family.add_metric([component, stat], value)
+        yield family
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording per-route latency and database usage.
+
+    Routes are labelled with their path template (``/api/herds/{herd_id}``)
+    so the label set stays bounded; anything unrouted is ``unmatched``.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats(scope)
+        token = current_request.set(stats)
+        status = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        REQUESTS_IN_PROGRESS.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            REQUESTS_IN_PROGRESS.dec()
+            current_request.reset(token)
+            elapsed = time.perf_counter() - started
+            route = scope.get("route")
+            route = route.path if route is not None else "unmatched"
+            stats.route = route
+            method = scope["method"]
+            REQUESTS.labels(method, route, str(status)).inc()
+            REQUEST_LATENCY.labels(method, route).observe(elapsed)
+            REQUEST_DB_QUERIES.labels(route).observe(stats.queries)
+            REQUEST_DB_TIME.labels(route).observe(stats.db_seconds)
+
+
+def render_metrics():
+    """Current metrics in the Prometheus text format, with its content type"""
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
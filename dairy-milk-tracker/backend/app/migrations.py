@@ -0,0 +1,175 @@
+import logging
+import os
+import shutil
+from typing import List
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from app.archive import ARCHIVE_DIR
+from app.database import Base
+from app.file_lock import file_lock
+from app.models import alert, archive, event, herd, milk_production, rollup, user  # noqa: F401
+from app.models.alert import HerdAlert
+from app.models.archive import MilkArchive
+from app.models.event import ChangeEvent
+from app.rollups import rebuild_rollups
+
+logger = logging.getLogger(__name__)
+
+# Columns added to tables after the first release; create_all never adds
+# columns to a table that already exists
+_LEGACY_COLUMNS = [
+    ("users", "username", "TEXT"),
+    ("herds", "location_line1", "TEXT"),
+    ("herds", "location_line2", "TEXT"),
+]
+
+
+async def _create_schema(conn: AsyncConnection):
+    """Create missing tables and bring pre-migration databases up to date"""
+    await conn.run_sync(Base.metadata.create_all)
+    for table, column, column_type in _LEGACY_COLUMNS:
+        result = await conn.exec_driver_sql(f"PRAGMA table_info({table})")
+        if column not in [row[1] for row in result.fetchall()]:
+            logger.info("Adding %s column to %s table", column, table)
+            await conn.exec_driver_sql(
+                f"ALTER TABLE {table} ADD COLUMN {column} {column_type}"
+            )
+
+
+async def _index_milk_productions_by_herd_and_date(conn: AsyncConnection):
+    # Serves per-herd listings, cursors and exports ordered by (date, id)
+    await conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_milk_productions_herd_id_date_id "
+        "ON milk_productions (herd_id, date, id)"
+    )
+
+
+async def _index_herds_by_user(conn: AsyncConnection):
+    # Every request filters herds by their owner
+    await conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_herds_user_id ON herds (user_id)"
+    )
+
+
+async def _build_rollups(conn: AsyncConnection):
+    # Fills the rollup tables for records written before they existed; no
+    # archive can exist yet at this version
+    await rebuild_rollups(conn, include_archives=False)
+
+
+async def _create_archive_manifest(conn: AsyncConnection):
+    # Herd-years moved out of milk_productions into column files
+    await conn.run_sync(MilkArchive.__table__.create, checkfirst=True)
+
+
+async def _create_herd_alerts(conn: AsyncConnection):
+    # Filled by the anomaly detection job
+    await conn.run_sync(HerdAlert.__table__.create, checkfirst=True)
+
+
+async def _drop_rollups_of_deleted_herds(conn: AsyncConnection):
+    # Deleting a herd used to leave its rollups for the next herd given its id
+    for table in ("milk_monthly_totals", "milk_daily_totals"):
+        await conn.exec_driver_sql(
+            f"DELETE FROM {table} WHERE herd_id NOT IN (SELECT id FROM herds)"
+        )
+
+
+async def _drop_archives_of_deleted_herds(conn: AsyncConnection):
+    # Their archived records would otherwise be exported to the next owner
+    # of the herd id
+    orphaned = "FROM milk_archives WHERE herd_id NOT IN (SELECT id FROM herds)"
+    result = await conn.exec_driver_sql(f"SELECT path {orphaned}")
+    paths = [row[0] for row in result.fetchall()]
+    await conn.exec_driver_sql(f"DELETE {orphaned}")
+
+    def remove_files():
+        for path in paths:
+            shutil.rmtree(os.path.join(ARCHIVE_DIR, path), ignore_errors=True)
+
+    return remove_files
+
+
+async def _drop_alerts_of_deleted_herds(conn: AsyncConnection):
+    await conn.exec_driver_sql(
+        "DELETE FROM herd_alerts WHERE herd_id NOT IN (SELECT id FROM herds)"
+    )
+
+
+async def _create_change_events(conn: AsyncConnection):
+    # Change notices passed between server workers for the event streams
+    await conn.run_sync(ChangeEvent.__table__.create, checkfirst=True)
+
+
+# (version, description, step) in the order they are applied. Append new
+# steps at the end and never renumber or edit ones that have shipped. A step
+# may return a function to call once the migration has committed, for changes
+# outside the database such as removing files.
+MIGRATIONS = [
+    (1, "Create tables and add legacy columns", _create_schema),
+    (2, "Index milk_productions by herd and date", _index_milk_productions_by_herd_and_date),
+    (3, "Index herds by user", _index_herds_by_user),
+    (4, "Build milk production rollups", _build_rollups),
+    (5, "Create milk archive manifest", _create_archive_manifest),
+    (6, "Create herd alerts", _create_herd_alerts),
+    (7, "Drop rollups of deleted herds", _drop_rollups_of_deleted_herds),
+    (8, "Drop archives of deleted herds", _drop_archives_of_deleted_herds),
+    (9, "Drop alerts of deleted herds", _drop_alerts_of_deleted_herds),
+    (10, "Create change events", _create_change_events),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+async def get_schema_version(conn: AsyncConnection) -> int:
+    """Version recorded in the database file header (0 before any migration)"""
+    result = await conn.exec_driver_sql("PRAGMA user_version")
+    return result.scalar()
+
+
+async def run_migrations(async_engine: AsyncEngine) -> List[int]:
+    """Apply pending migrations and return the versions that were applied.
+
+    When the schema is current this is a single PRAGMA read. Otherwise all
+    pending steps run in one transaction opened with BEGIN IMMEDIATE, which
+    holds SQLite's write lock: a second process starting at the same time
+    waits, then finds the new version and applies nothing.
+    """
+    async with async_engine.connect() as conn:
+        if await get_schema_version(conn) >= SCHEMA_VERSION:
+            return []
+
+        await conn.exec_driver_sql("BEGIN IMMEDIATE")
+        current = await get_schema_version(conn)
+        applied = []
+        after_commit = []
+        for version, description, step in MIGRATIONS:
+            if version <= current:
+                continue
+            logger.info("Applying migration %s: %s", version, description)
+            cleanup = await step(conn)
+            if cleanup is not None:
+                after_commit.append(cleanup)
+            applied.append(version)
+
+        if applied:
+            # PRAGMA values can't be bound parameters
+            await conn.execute(text(f"PRAGMA user_version = {int(applied[-1])}"))
+        await conn.commit()
+        # Only now: had the commit failed, the rows would still need the files
+        for cleanup in after_commit:
+            cleanup()
+        return applied
+
+
+async def run_migrations_once(async_engine: AsyncEngine, lock_path: str) -> List[int]:
+    """run_migrations while holding a file lock shared by all server workers.
+
+    Workers starting together queue on the lock; the first one migrates and
+    the others only read the new version. Blocking the event loop is fine
+    here since it runs before the worker serves requests.
+    """
+    with file_lock(lock_path):
+        return await run_migrations(async_engine)
@@ -0,0 +1,185 @@
+import csv
+import io
+import json
+from datetime import datetime
+from typing import AsyncIterator, Callable, Optional
+
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.future import select
+
+from app.models.herd import Herd
+from app.models.milk_production import MilkProduction
+from app.row_encoding import (
+    ARROW_END_OF_STREAM,
+    ARROW_STREAM_MEDIA_TYPE,
+    MSGPACK_MEDIA_TYPE,
+    arrow_schema,
+    encode_arrow_batch,
+    encode_msgpack_columns,
+    pyarrow,
+)
+
+EXPORT_MEDIA_TYPES = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "msgpack": MSGPACK_MEDIA_TYPE,
+}
+if pyarrow is not None:
+    EXPORT_MEDIA_TYPES["arrow"] = ARROW_STREAM_MEDIA_TYPE
+EXPORT_FORMATS = tuple(EXPORT_MEDIA_TYPES)
+# For picking a format from the Accept header; CSV is the default
+EXPORT_FORMATS_BY_MEDIA_TYPE = {
+    media_type: fmt for fmt, media_type in EXPORT_MEDIA_TYPES.items()
+}
+# Rows fetched from the cursor (and written to the response) at a time
+EXPORT_CHUNK_SIZE = 1000
+
+EXPORT_COLUMNS = (
+    "id",
+    "herd_id",
+    "herd_name",
+    "date",
+    "amount_liters",
+    "fat_percentage",
+    "protein_percentage",
+    "created_at",
+)
+
+
+def build_export_query(
+    user_id: int,
+    herd_id: Optional[int] = None,
+    from_date: Optional[datetime] = None,
+    to_date: Optional[datetime] = None,
+):
+    """Plain column select over MilkProduction joined to the owning Herd"""
+    query = (
+        select(
+            MilkProduction.id,
+            MilkProduction.herd_id,
+            Herd.name.label("herd_name"),
+            MilkProduction.date,
+            MilkProduction.amount_liters,
+            MilkProduction.fat_percentage,
+            MilkProduction.protein_percentage,
+            MilkProduction.created_at,
+        )
+        .join(Herd, MilkProduction.herd_id == Herd.id)
+        .where(Herd.user_id == user_id)
+    )
+    if herd_id:
+        query = query.where(MilkProduction.herd_id == herd_id)
+    if from_date:
+        query = query.where(MilkProduction.date >= from_date)
+    if to_date:
+        query = query.where(MilkProduction.date <= to_date)
+    return query.order_by(MilkProduction.date, MilkProduction.id)
+
+
+async def stream_export_rows(engine: AsyncEngine, query) -> AsyncIterator[list]:
+    """Yield lists of row tuples read from a server-side cursor.
+
+    Opens its own connection because the request's session is closed
+    before a streaming response body is sent.
+    """
+    async with engine.connect() as conn:
+        result = await conn.stream(query)
+        async for partition in result.partitions(EXPORT_CHUNK_SIZE):
+            yield partition
+
+
+def export_sort_key(row) -> tuple:
+    """(date, id) of an export row, the order of every export"""
+    return (row[3] or datetime.min, row[0])
+
+
+async def _next_chunk(chunks: AsyncIterator[list]) -> Optional[list]:
+    async for rows in chunks:
+        if rows:
+            return list(rows)
+    return None
+
+
+async def merge_sorted_chunks(
+    first: AsyncIterator[list], second: AsyncIterator[list], key: Callable
+) -> AsyncIterator[list]:
+    """Merge two streams of row chunks that are each sorted by ``key``.
+
+    Archived rows nearly always come before the ones still in the database,
+    so a chunk ending before the other stream's next row passes through
+    whole; only overlapping chunks are merged row by row.
+    """
+    streams = [first.__aiter__(), second.__aiter__()]
+    heads = [await _next_chunk(streams[0]), await _next_chunk(streams[1])]
+    while heads[0] is not None and heads[1] is not None:
+        for side in (0, 1):
+            other = heads[1 - side]
+            if key(heads[side][-1]) <= key(other[0]):
+                yield heads[side]
+                heads[side] = await _next_chunk(streams[side])
+                break
+        else:
+            # Both chunks overlap: emit everything up to the smaller last key
+            limit = min(key(heads[0][-1]), key(heads[1][-1]))
+            merged = []
+            for side in (0, 1):
+                rows = heads[side]
+                split = sum(1 for row in rows if key(row) <= limit)
+                merged.extend(rows[:split])
+                heads[side] = rows[split:] or await _next_chunk(streams[side])
+            merged.sort(key=key)
+            yield merged
+
+    for side in (0, 1):
+        while heads[side] is not None:
+            yield heads[side]
+            heads[side] = await _next_chunk(streams[side])
+
+
+def _format_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+async def encode_csv(chunks: AsyncIterator[list]) -> AsyncIterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    yield buffer.getvalue()
+    async for rows in chunks:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows([_format_value(value) for value in row] for row in rows)
+        yield buffer.getvalue()
+
+
+async def encode_ndjson(chunks: AsyncIterator[list]) -> AsyncIterator[str]:
+    async for rows in chunks:
+        yield "".join(
+            json.dumps(dict(zip(EXPORT_COLUMNS, map(_format_value, row)))) + "\n"
+            for row in rows
+        )
+
+
+async def encode_msgpack(chunks: AsyncIterator[list]) -> AsyncIterator[bytes]:
+    # One map of column arrays per chunk; read with msgpack.Unpacker
+    async for rows in chunks:
+        yield encode_msgpack_columns(EXPORT_COLUMNS, rows)
+
+
+async def encode_arrow(chunks: AsyncIterator[list]) -> AsyncIterator[bytes]:
+    # An Arrow IPC stream with one record batch per chunk
+    schema = arrow_schema(EXPORT_COLUMNS, build_export_query(0).selected_columns)
+    yield schema.serialize().to_pybytes()
+    async for rows in chunks:
+        yield encode_arrow_batch(schema, rows)
+    yield ARROW_END_OF_STREAM
+
+
+EXPORT_ENCODERS = {
+    "csv": encode_csv,
+    "ndjson": encode_ndjson,
+    "msgpack": encode_msgpack,
+    "arrow": encode_arrow,
+}
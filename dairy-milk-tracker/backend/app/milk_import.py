@@ -0,0 +1,162 @@
+import asyncio
+import csv
+import json
+from dataclasses import dataclass
+from itertools import islice
+from typing import Callable, Iterator, List, Optional, Set, TextIO, Tuple
+
+from pydantic import ValidationError
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.models.herd import Herd
+from app.models.milk_production import MilkProduction
+from app.rollups import RollupDelta
+from app.schemas.milk_production import MilkProductionCreate
+
+IMPORT_FORMATS = ("csv", "ndjson")
+DEFAULT_BATCH_SIZE = 1000
+
+
+@dataclass
+class ImportStats:
+    processed: int = 0
+    inserted: int = 0
+    rejected: int = 0
+
+
+def format_validation_error(error: ValidationError):
+    """Turn a pydantic ValidationError into a JSON-safe list of errors"""
+    return [
+        {"loc": list(err["loc"]), "msg": err["msg"], "type": err["type"]}
+        for err in error.errors()
+    ]
+
+
+def detect_format(filename: Optional[str]) -> Optional[str]:
+    """Guess the import format from a file name"""
+    if not filename:
+        return None
+    extension = filename.rsplit(".", 1)[-1].lower()
+    if extension == "csv":
+        return "csv"
+    if extension in ("ndjson", "jsonl"):
+        return "ndjson"
+    return None
+
+
+def iter_rows(stream: TextIO, fmt: str) -> Iterator[tuple]:
+    """Yield (line number, row dict, parse error) one line at a time"""
+    if fmt == "csv":
+        reader = csv.DictReader(stream)
+        for row in reader:
+            # Empty cells mean "not provided" for the optional columns
+            yield reader.line_num, {k: v for k, v in row.items() if v != ""}, None
+    elif fmt == "ndjson":
+        for line_no, line in enumerate(stream, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError as e:
+                yield line_no, line, f"Invalid JSON: {e.msg}"
+                continue
+            if not isinstance(row, dict):
+                yield line_no, row, "Expected a JSON object"
+                continue
+            yield line_no, row, None
+    else:
+        raise ValueError(f"Unsupported import format: {fmt}")
+
+
+def _read_batch(rows: Iterator[tuple], size: int) -> Tuple[int, List[tuple], List[tuple]]:
+    """Parse and validate the next ``size`` rows.
+
+    Returns the number of rows read, (line, row, record) for the valid ones
+    and (line, row, error) for the rest.
+    """
+    valid = []
+    rejects = []
+    count = 0
+    for line_no, row, error in islice(rows, size):
+        count += 1
+        if error is None:
+            try:
+                valid.append((line_no, row, MilkProductionCreate.model_validate(row)))
+                continue
+            except ValidationError as e:
+                error = format_validation_error(e)
+        rejects.append((line_no, row, error))
+    return count, valid, rejects
+
+
+async def import_milk_productions(
+    db: AsyncSession,
+    stream: TextIO,
+    fmt: str,
+    owner_id: Optional[int] = None,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    on_reject: Optional[Callable[[int, object, object], None]] = None,
+    on_progress: Optional[Callable[[ImportStats], None]] = None,
+    on_commit: Optional[Callable[[Set[int]], None]] = None,
+) -> ImportStats:
+    """Stream milk records from a CSV/NDJSON file into the database.
+
+    Rows are validated against MilkProductionCreate and written in batches
+    of ``batch_size``, one transaction per batch, so memory use depends on
+    the batch size and not on the file size. When ``owner_id`` is given,
+    rows for herds that don't belong to that user are rejected.
+    ``on_commit`` gets the herd ids of every committed batch.
+    """
+    stats = ImportStats()
+    # herd_id -> whether rows may be imported for it
+    known_herds = {}
+
+    rows = iter_rows(stream, fmt)
+    while True:
+        # Reading and validating is CPU-bound; keep it off the event loop so
+        # a large file doesn't stall the requests it is serving meanwhile
+        count, valid, rejects = await asyncio.to_thread(_read_batch, rows, batch_size)
+        if not count:
+            break
+
+        # One herd lookup per batch, only for herds not seen before
+        unknown_herd_ids = {record.herd_id for _, _, record in valid} - known_herds.keys()
+        if unknown_herd_ids:
+            query = select(Herd.id).where(Herd.id.in_(unknown_herd_ids))
+            if owner_id is not None:
+                query = query.where(Herd.user_id == owner_id)
+            result = await db.execute(query)
+            found = set(result.scalars().all())
+            for herd_id in unknown_herd_ids:
+                known_herds[herd_id] = herd_id in found
+
+        values = []
+        delta = RollupDelta()
+        for line_no, row, record in valid:
+            if not known_herds[record.herd_id]:
+                rejects.append((line_no, row, "Herd not found"))
+                continue
+            values.append(record.model_dump())
+            delta.add(record)
+
+        if values:
+            await db.execute(insert(MilkProduction), values)
+            await delta.apply(db)
+            await db.commit()
+            if on_commit:
+                on_commit({value["herd_id"] for value in values})
+
+        if on_reject:
+            for line_no, row, error in sorted(rejects, key=lambda reject: reject[0]):
+                on_reject(line_no, row, error)
+
+        stats.processed += count
+        stats.inserted += len(values)
+        stats.rejected += len(rejects)
+        if on_progress:
+            on_progress(stats)
+
+    return stats
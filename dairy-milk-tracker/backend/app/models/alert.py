@@ -0,0 +1,23 @@
+from sqlalchemy import Column, Date, DateTime, Float, ForeignKey, Integer, String, UniqueConstraint
+from sqlalchemy.sql import func
+
+from app.database import Base
+
+
+class HerdAlert(Base):
+    """A day on which a herd's yield per cow was flagged by the anomaly job"""
+
+    __tablename__ = "herd_alerts"
+    __table_args__ = (
+        # Serves the per-herd listing (newest first) and re-runs of the job
+        UniqueConstraint("herd_id", "day", "kind", name="uq_herd_alerts_herd_id_day_kind"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    herd_id = Column(Integer, ForeignKey("herds.id"), nullable=False)
+    day = Column(Date, nullable=False)
+    kind = Column(String, nullable=False)  # 'drop' or 'level_shift'
+    liters_per_cow = Column(Float, nullable=False)
+    baseline = Column(Float, nullable=False)  # expected liters per cow
+    score = Column(Float, nullable=False)  # z-score, or relative drop for shifts
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
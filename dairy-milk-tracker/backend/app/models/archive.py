@@ -0,0 +1,18 @@
+from sqlalchemy import Column, DateTime, ForeignKey, Integer, String
+from sqlalchemy.sql import func
+
+from app.database import Base
+
+
+class MilkArchive(Base):
+    """Manifest entry for one herd-year of milk records moved to column files"""
+
+    __tablename__ = "milk_archives"
+
+    herd_id = Column(Integer, ForeignKey("herds.id"), primary_key=True)
+    year = Column(Integer, primary_key=True)
+    path = Column(String, nullable=False)  # relative to the archive directory
+    record_count = Column(Integer, nullable=False)
+    first_date = Column(DateTime(timezone=True))
+    last_date = Column(DateTime(timezone=True))
+    archived_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -0,0 +1,17 @@
+from sqlalchemy import Column, Float, Integer, LargeBinary, String
+
+from app.database import Base
+
+
+class ChangeEvent(Base):
+    """A change notice passed to the event streams of the other server workers"""
+
+    __tablename__ = "change_events"
+    # Ids must never be reused, or workers would skip notices after a prune
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    id = Column(Integer, primary_key=True)
+    worker = Column(String, nullable=False)  # the publishing process
+    user_id = Column(Integer, nullable=False)
+    message = Column(LargeBinary, nullable=False)  # encoded text/event-stream message
+    created_at = Column(Float, nullable=False)  # Unix time, for pruning
@@ -14,7 +14,7 @@ class Herd(Base):
     location_line1 = Column(String, nullable=True)
     location_line2 = Column(String, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
-    user_id = Column(Integer, ForeignKey("users.id"))
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
     
     # Relationships
     owner = relationship("User", back_populates="herds")
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, ForeignKey, Integer, Float, DateTime
+from sqlalchemy import Column, ForeignKey, Index, Integer, Float, DateTime
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 
@@ -7,6 +7,10 @@ from app.database import Base
 
 class MilkProduction(Base):
     __tablename__ = "milk_productions"
+    __table_args__ = (
+        # Backs per-herd listings ordered by (date, id) and keyset pagination
+        Index("ix_milk_productions_herd_id_date_id", "herd_id", "date", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     date = Column(DateTime(timezone=True), index=True)
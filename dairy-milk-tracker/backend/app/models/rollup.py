@@ -0,0 +1,34 @@
+from sqlalchemy import Column, Date, Float, ForeignKey, Integer
+
+from app.database import Base
+
+
+class MilkDailyTotal(Base):
+    """Per-herd, per-day totals kept in step with milk_productions"""
+
+    __tablename__ = "milk_daily_totals"
+
+    herd_id = Column(Integer, ForeignKey("herds.id"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    total_liters = Column(Float, nullable=False, default=0)
+    record_count = Column(Integer, nullable=False, default=0)
+    fat_sum = Column(Float, nullable=False, default=0)
+    fat_count = Column(Integer, nullable=False, default=0)
+    protein_sum = Column(Float, nullable=False, default=0)
+    protein_count = Column(Integer, nullable=False, default=0)
+
+
+class MilkMonthlyTotal(Base):
+    """Per-herd, per-month totals derived from milk_daily_totals"""
+
+    __tablename__ = "milk_monthly_totals"
+
+    herd_id = Column(Integer, ForeignKey("herds.id"), primary_key=True)
+    month = Column(Date, primary_key=True)  # first day of the month
+    total_liters = Column(Float, nullable=False, default=0)
+    record_count = Column(Integer, nullable=False, default=0)
+    days_recorded = Column(Integer, nullable=False, default=0)
+    fat_sum = Column(Float, nullable=False, default=0)
+    fat_count = Column(Integer, nullable=False, default=0)
+    protein_sum = Column(Float, nullable=False, default=0)
+    protein_count = Column(Integer, nullable=False, default=0)
@@ -0,0 +1,39 @@
+import base64
+import json
+from datetime import datetime
+from typing import List
+
+from fastapi import HTTPException
+
+# Response header carrying the cursor of the next page
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(*values) -> str:
+    """Pack the sort key of the last row into an opaque cursor string"""
+    payload = [
+        value.isoformat() if isinstance(value, datetime) else value for value in values
+    ]
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, size: int) -> List:
+    """Unpack a cursor produced by encode_cursor, or fail with a 400"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(values, list) or len(values) != size:
+            raise ValueError("wrong cursor size")
+        return values
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def decode_date_id_cursor(cursor: str):
+    """Decode a (date, id) cursor as used by the milk production listing"""
+    date_value, id_value = decode_cursor(cursor, 2)
+    try:
+        return datetime.fromisoformat(date_value), int(id_value)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
@@ -0,0 +1,104 @@
+import logging
+import os
+import time
+from typing import Callable, Optional
+
+from sqlalchemy import event
+
+from app.metrics import current_request
+
+logger = logging.getLogger(__name__)
+
+# Both are off unless configured: statements slower than SLOW_QUERY_LOG_MS
+# are logged, and QUERY_BUDGET_MODE=warn|raise checks @query_budget routes
+SLOW_QUERY_LOG_MS = os.environ.get("SLOW_QUERY_LOG_MS")
+QUERY_BUDGET_MODE = os.environ.get("QUERY_BUDGET_MODE", "off")
+QUERY_BUDGET_MODES = ("off", "warn", "raise")
+MAX_LOGGED_PARAMS_LENGTH = 500
+
+
+class QueryBudgetExceeded(RuntimeError):
+    pass
+
+
+def query_budget(max_queries: int) -> Callable:
+    """Declare how many statements one request to a route may execute.
+
+    The count includes the route's dependencies, e.g. loading the current
+    user. Exceeding it usually means an N+1 over a relationship.
+    """
+
+    def decorator(endpoint):
+        endpoint.query_budget = max_queries
+        return endpoint
+
+    return decorator
+
+
+def _route_of(stats) -> str:
+    route = stats.scope.get("route") if stats and stats.scope else None
+    return route.path if route is not None else "-"
+
+
+def install_query_log(
+    async_engine,
+    slow_query_ms: Optional[float] = None,
+    budget_mode: str = "off",
+):
+    """Add the slow-query log and/or query budget checks to an engine.
+
+    Budgets rely on the per-request count kept by metrics.instrument_engine,
+    so install this after it on the same engine.
+    """
+    if budget_mode not in QUERY_BUDGET_MODES:
+        raise ValueError(f"budget_mode must be one of {', '.join(QUERY_BUDGET_MODES)}")
+    if slow_query_ms is None and budget_mode == "off":
+        return async_engine
+    sync_engine = async_engine.sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_log_started", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed_ms = (time.perf_counter() - conn.info["query_log_started"].pop()) * 1000
+        stats = current_request.get()
+
+        if slow_query_ms is not None and elapsed_ms >= slow_query_ms:
+            logger.warning(
+                "Slow query (%.1f ms) on %s: %s params=%s",
+                elapsed_ms,
+                _route_of(stats),
+                " ".join(statement.split()),
+                repr(parameters)[:MAX_LOGGED_PARAMS_LENGTH],
+            )
+
+        if budget_mode == "off" or stats is None or stats.scope is None:
+            return
+        budget = getattr(stats.scope.get("endpoint"), "query_budget", None)
+        # The metrics listener has already counted this statement
+        if budget is None or stats.queries <= budget or stats.over_budget:
+            return
+        stats.over_budget = True
+        message = (
+            f"{_route_of(stats)} executed {stats.queries} queries, "
+            f"more than its budget of {budget}"
+        )
+        if budget_mode == "raise":
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
+
+    @event.listens_for(sync_engine, "handle_error")
+    def handle_error(exception_context):
+        started = exception_context.connection.info.get("query_log_started")
+        if started:
+            started.pop()
+
+    return async_engine
+
+
+def install_configured_query_log(async_engine):
+    """install_query_log with the settings from the environment"""
+    slow_query_ms = float(SLOW_QUERY_LOG_MS) if SLOW_QUERY_LOG_MS else None
+    return install_query_log(async_engine, slow_query_ms, QUERY_BUDGET_MODE)
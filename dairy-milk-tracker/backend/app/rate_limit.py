@@ -0,0 +1,249 @@
+import logging
+import math
+import os
+import time
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from jose import JWTError, jwt
+from starlette.responses import JSONResponse
+
+from app.auth import ALGORITHM, SECRET_KEY
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_ENABLED = os.environ.get("RATE_LIMIT_ENABLED", "true").lower() in ("1", "true", "yes")
+# An address may use this many times a user's read and write budgets, so
+# several users behind one NAT don't starve each other
+RATE_LIMIT_IP_FACTOR = float(os.environ.get("RATE_LIMIT_IP_FACTOR", "4"))
+# Buckets kept; the least recently used are dropped (an idle bucket is full)
+RATE_LIMIT_MAX_KEYS = int(os.environ.get("RATE_LIMIT_MAX_KEYS", "100000"))
+# Write requests handled at once; the rest are turned away, not queued
+WRITE_CONCURRENCY_LIMIT = int(os.environ.get("WRITE_CONCURRENCY_LIMIT", "64"))
+WRITE_RETRY_AFTER_SECONDS = 1
+
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+@dataclass(frozen=True)
+class RateBudget:
+    """A token bucket refilled at ``per_second`` and holding up to ``burst``"""
+
+    per_second: float
+    burst: float
+
+    def scaled(self, factor: float) -> "RateBudget":
+        return RateBudget(self.per_second * factor, self.burst * factor)
+
+
+def _budget(name: str, per_minute: int, burst: int) -> RateBudget:
+    prefix = f"RATE_LIMIT_{name.upper()}"
+    return RateBudget(
+        per_second=float(os.environ.get(f"{prefix}_PER_MINUTE", str(per_minute))) / 60,
+        burst=float(os.environ.get(f"{prefix}_BURST", str(burst))),
+    )
+
+
+RATE_BUDGETS = {
+    "read": _budget("read", per_minute=600, burst=100),
+    "write": _budget("write", per_minute=300, burst=60),
+    # Logins and sign-ups hash passwords with bcrypt; limited per address only
+    "auth": _budget("auth", per_minute=10, burst=5),
+}
+
+
+def route_budget(method: str, path: str) -> Optional[str]:
+    """Name of the budget a request is charged to; None for non-API paths"""
+    if not path.startswith("/api/"):
+        return None
+    if path.startswith("/api/auth/"):
+        return "auth"
+    return "read" if method in SAFE_METHODS else "write"
+
+
+class RateLimiter:
+    """In-memory token buckets keyed by (budget, "user" or "ip", identity).
+
+    Not thread-safe; it is meant to be used from the event loop only. The
+    buckets belong to this process, so with several server workers each
+    worker enforces the budgets separately.
+    """
+
+    def __init__(
+        self,
+        budgets: Dict[str, RateBudget],
+        ip_factor: float = 4.0,
+        max_keys: int = 100000,
+        enabled: bool = True,
+    ):
+        self.budgets = budgets
+        self.ip_factor = ip_factor
+        self.max_keys = max_keys
+        self.enabled = enabled
+        self._buckets = OrderedDict()
+        self.allowed = defaultdict(int)
+        self.limited = defaultdict(int)
+
+    def clear(self):
+        self._buckets.clear()
+        self.allowed.clear()
+        self.limited.clear()
+
+    def buckets_for(
+        self, budget: str, user: Optional[str], ip: Optional[str]
+    ) -> List[Tuple[tuple, RateBudget]]:
+        """Buckets a request is charged to: its address and, if known, its user"""
+        base = self.budgets[budget]
+        if budget == "auth":
+            return [((budget, "ip", ip), base)]
+        buckets = [((budget, "ip", ip), base.scaled(self.ip_factor))]
+        if user is not None:
+            buckets.append(((budget, "user", user), base))
+        return buckets
+
+    def take(
+        self, buckets: List[Tuple[tuple, RateBudget]], now: Optional[float] = None
+    ) -> float:
+        """Take a token from every bucket, or from none of them.
+
+        Returns 0 when the request may go ahead, otherwise the seconds until
+        all of the buckets hold a token again.
+        """
+        now = time.monotonic() if now is None else now
+        levels = []
+        wait = 0.0
+        for key, budget in buckets:
+            entry = self._buckets.get(key)
+            if entry is None:
+                tokens = budget.burst
+            else:
+                tokens = min(budget.burst, entry[0] + (now - entry[1]) * budget.per_second)
+            levels.append(tokens)
+            if tokens < 1:
+                wait = max(wait, (1 - tokens) / budget.per_second)
+
+        spend = 0 if wait else 1
+        for (key, _), tokens in zip(buckets, levels):
+            self._buckets[key] = (tokens - spend, now)
+            self._buckets.move_to_end(key)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return wait
+
+    def stats(self) -> dict:
+        stats = {"buckets": len(self._buckets)}
+        for name in self.budgets:
+            stats[f"{name}_allowed"] = self.allowed[name]
+            stats[f"{name}_limited"] = self.limited[name]
+        return stats
+
+
+class ConcurrencyLimiter:
+    """Counts requests in progress and refuses new ones past ``limit``"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.shed = 0
+
+    def try_acquire(self) -> bool:
+        if self.in_flight >= self.limit:
+            self.shed += 1
+            return False
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        return True
+
+    def release(self):
+        self.in_flight -= 1
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "shed": self.shed,
+        }
+
+
+rate_limiter = RateLimiter(
+    RATE_BUDGETS,
+    ip_factor=RATE_LIMIT_IP_FACTOR,
+    max_keys=RATE_LIMIT_MAX_KEYS,
+    enabled=RATE_LIMIT_ENABLED,
+)
+write_limiter = ConcurrencyLimiter(WRITE_CONCURRENCY_LIMIT)
+
+
+def token_subject(scope) -> Optional[str]:
+    """Subject of a valid bearer token in the request, without a database lookup"""
+    authorization = dict(scope["headers"]).get(b"authorization", b"").decode("latin-1")
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    try:
+        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]).get("sub")
+    except JWTError:
+        return None
+
+
+def _too_many_requests(detail: str, retry_after: float) -> JSONResponse:
+    return JSONResponse(
+        {"detail": detail},
+        status_code=429,
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+
+
+class RateLimitMiddleware:
+    """ASGI middleware applying the rate budgets and the write concurrency limit.
+
+    Requests over budget are answered with 429 and a Retry-After header
+    before any work is done. Write requests beyond ``write_limiter.limit``
+    are shed the same way instead of waiting for the database writer.
+    """
+
+    def __init__(
+        self,
+        app,
+        limiter: RateLimiter = rate_limiter,
+        writes: ConcurrencyLimiter = write_limiter,
+    ):
+        self.app = app
+        self.limiter = limiter
+        self.writes = writes
+
+    async def __call__(self, scope, receive, send):
+        budget = None
+        if scope["type"] == "http" and self.limiter.enabled:
+            budget = route_budget(scope["method"], scope["path"])
+        if budget is None:
+            await self.app(scope, receive, send)
+            return
+
+        user = token_subject(scope) if budget != "auth" else None
+        client = scope.get("client")
+        ip = client[0] if client else None
+        wait = self.limiter.take(self.limiter.buckets_for(budget, user, ip))
+        if wait:
+            self.limiter.limited[budget] += 1
+            logger.warning("Rate limit exceeded", extra={"budget": budget, "user": user, "ip": ip})
+            await _too_many_requests("Too many requests", wait)(scope, receive, send)
+            return
+        self.limiter.allowed[budget] += 1
+
+        if budget != "write":
+            await self.app(scope, receive, send)
+            return
+        if not self.writes.try_acquire():
+            response = _too_many_requests(
+                "Server busy, try again shortly", WRITE_RETRY_AFTER_SECONDS
+            )
+            await response(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.writes.release()
@@ -0,0 +1,156 @@
+import hashlib
+import os
+import secrets
+import time
+from collections import defaultdict
+from datetime import date
+from typing import Optional
+
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from app.cache import TTLCache
+from app.database import DB_PATH
+
+# Changes on every start so ETags from a previous process never match
+_BOOT_ID = secrets.token_hex(8)
+# Touched by the command-line tools after writing to the database, which
+# makes every cached response and ETag stale
+DATA_CHANGED_PATH = f"{DB_PATH}.changed"
+
+
+def mark_data_changed(path: str = DATA_CHANGED_PATH):
+    """Tell running servers that data changed outside the API"""
+    with open(path, "a"):
+        pass
+    now = time.time_ns()
+    os.utime(path, ns=(now, now))
+
+
+class ResponseCache:
+    """Per-user cache of JSON responses, invalidated by a per-user data version.
+
+    Every handler that changes a user's herds or milk records calls
+    ``bump(user_id)``. Cached entries and ETags include the version they were
+    built from, so a bump makes all of that user's cached responses stale.
+    ETags are derived from the version alone, which lets a matching
+    ``If-None-Match`` be answered with 304 without recomputing anything.
+
+    Versions live in this process, so with several server workers a bump in
+    one is invisible to the others; ``maxsize=0`` turns caching and ETags off.
+    Writes made by other processes are noticed through the modification
+    time of ``changed_path`` (see mark_data_changed), which is part of every
+    version.
+    """
+
+    def __init__(
+        self, maxsize: int = 4096, ttl: float = 300.0, changed_path: Optional[str] = None
+    ):
+        self.enabled = maxsize > 0
+        self.changed_path = changed_path
+        self._entries = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._versions = defaultdict(int)
+        self.not_modified = 0
+
+    def bump(self, user_id: int):
+        self._versions[user_id] += 1
+
+    def clear(self):
+        self._entries.clear()
+        self._versions.clear()
+
+    def _key(self, request: Request, user_id: int):
+        # Today's date is part of the key because "last 7 days" style
+        # queries change at midnight without any write
+        return (
+            user_id,
+            request.url.path,
+            tuple(sorted(request.query_params.multi_items())),
+            date.today().isoformat(),
+        )
+
+    def _etag(self, key, version: tuple) -> str:
+        digest = hashlib.sha256(repr((_BOOT_ID, key, version)).encode()).hexdigest()
+        return f'"{digest[:32]}"'
+
+    def _data_changed_at(self) -> int:
+        if self.changed_path is None:
+            return 0
+        try:
+            return os.stat(self.changed_path).st_mtime_ns
+        except FileNotFoundError:
+            return 0
+
+    def lookup(self, request: Request, user_id: int) -> "CachedResponse":
+        key = self._key(request, user_id)
+        version = (self._data_changed_at(), self._versions[user_id])
+        return CachedResponse(self, request, key, version)
+
+    def stats(self) -> dict:
+        stats = self._entries.stats()
+        stats["not_modified"] = self.not_modified
+        return stats
+
+
+class CachedResponse:
+    """Result of ResponseCache.lookup for a single request"""
+
+    def __init__(self, cache: ResponseCache, request: Request, key, version: tuple):
+        self._cache = cache
+        self._key = key
+        # Captured before the handler reads anything, so data written while
+        # the response is built can only make the stored entry newer
+        self._version = version
+        self.etag = cache._etag(key, version)
+        self._if_none_match = request.headers.get("if-none-match")
+
+    def _headers(self, extra: Optional[dict] = None) -> dict:
+        headers = {"Cache-Control": "private, no-cache"}
+        if self._cache.enabled:
+            headers["ETag"] = self.etag
+        if extra:
+            headers.update(extra)
+        return headers
+
+    def response(self) -> Optional[Response]:
+        """A 304 or cached 200 response, or None when the handler must run"""
+        if not self._cache.enabled:
+            return None
+        if self._if_none_match:
+            tags = [tag.strip() for tag in self._if_none_match.split(",")]
+            if self.etag in tags or "*" in tags:
+                self._cache.not_modified += 1
+                return Response(status_code=304, headers=self._headers())
+
+        entry = self._cache._entries.get(self._key)
+        if entry is not None and entry[0] == self._version:
+            _, body, extra_headers = entry
+            return Response(
+                content=body,
+                media_type="application/json",
+                headers=self._headers(extra_headers),
+            )
+        return None
+
+    def store(self, content, headers: Optional[dict] = None) -> Response:
+        """Cache the handler's result and return it as a JSON response"""
+        response = JSONResponse(
+            content=jsonable_encoder(content), headers=self._headers(headers)
+        )
+        self._cache._entries.set(self._key, (self._version, response.body, headers))
+        return response
+
+    def store_json(self, body: bytes, headers: Optional[dict] = None) -> Response:
+        """Like store, for a body that is already encoded JSON"""
+        self._cache._entries.set(self._key, (self._version, body, headers))
+        return Response(
+            content=body, media_type="application/json", headers=self._headers(headers)
+        )
+
+
+response_cache = ResponseCache(
+    maxsize=int(os.environ.get("RESPONSE_CACHE_MAX_SIZE", "4096")),
+    ttl=float(os.environ.get("RESPONSE_CACHE_TTL_SECONDS", "300")),
+    changed_path=DATA_CHANGED_PATH,
+)
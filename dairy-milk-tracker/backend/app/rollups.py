@@ -0,0 +1,298 @@
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import and_, delete, func, insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.archive import archive_daily_totals, load_archive
+from app.models.archive import MilkArchive
+from app.models.herd import Herd
+from app.models.milk_production import MilkProduction
+from app.models.rollup import MilkDailyTotal, MilkMonthlyTotal
+from app.schemas.milk_production import MilkProductionStats
+
+_SUM_COLUMNS = (
+    "total_liters",
+    "record_count",
+    "fat_sum",
+    "fat_count",
+    "protein_sum",
+    "protein_count",
+)
+
+
+def _day_of(value) -> date:
+    return value.date() if isinstance(value, datetime) else value
+
+
+class RollupDelta:
+    """Accumulates changes to milk records and applies them to the rollups.
+
+    Add every inserted record with ``sign=1`` and every removed record with
+    ``sign=-1`` (an update is a removal of the old values plus an addition
+    of the new ones), then call ``apply`` before committing so the rollups
+    change in the same transaction as the records.
+    """
+
+    def __init__(self):
+        self._totals = defaultdict(lambda: [0.0, 0, 0.0, 0, 0.0, 0])
+
+    def add(self, record, sign: int = 1):
+        if record.date is None or record.herd_id is None:
+            return
+        totals = self._totals[(record.herd_id, _day_of(record.date))]
+        totals[0] += sign * (record.amount_liters or 0)
+        totals[1] += sign
+        if record.fat_percentage is not None:
+            totals[2] += sign * record.fat_percentage
+            totals[3] += sign
+        if record.protein_percentage is not None:
+            totals[4] += sign * record.protein_percentage
+            totals[5] += sign
+
+    def remove(self, record):
+        self.add(record, sign=-1)
+
+    async def apply(self, db: AsyncSession) -> dict:
+        """Write the accumulated changes; returns the new daily totals.
+
+        The result maps each touched (herd_id, day) to its (total_liters,
+        record_count) after the change, as seen by this transaction.
+        """
+        rows = [
+            dict(herd_id=herd_id, day=day, **dict(zip(_SUM_COLUMNS, totals)))
+            for (herd_id, day), totals in self._totals.items()
+            if any(totals)
+        ]
+        self._totals.clear()
+        if not rows:
+            return {}
+
+        result = await db.execute(
+            _add_daily_totals_stmt().returning(
+                MilkDailyTotal.herd_id,
+                MilkDailyTotal.day,
+                MilkDailyTotal.total_liters,
+                MilkDailyTotal.record_count,
+            ),
+            rows,
+        )
+        daily_totals = {
+            (herd_id, day): (total_liters, record_count)
+            for herd_id, day, total_liters, record_count in result.all()
+        }
+
+        herd_ids = {row["herd_id"] for row in rows}
+        await db.execute(
+            delete(MilkDailyTotal).where(
+                MilkDailyTotal.herd_id.in_(herd_ids), MilkDailyTotal.record_count <= 0
+            )
+        )
+
+        # Recompute the touched months from their (at most 31) daily rows
+        months = {(row["herd_id"], row["day"].replace(day=1)) for row in rows}
+        for herd_id, month in months:
+            await _refresh_month(db, herd_id, month)
+        return daily_totals
+
+
+def _add_daily_totals_stmt():
+    # Add the sums onto the daily rows, creating them as needed
+    stmt = sqlite_insert(MilkDailyTotal)
+    return stmt.on_conflict_do_update(
+        index_elements=[MilkDailyTotal.herd_id, MilkDailyTotal.day],
+        set_={
+            name: getattr(MilkDailyTotal, name) + getattr(stmt.excluded, name)
+            for name in _SUM_COLUMNS
+        },
+    )
+
+
+async def _add_daily_totals(db: AsyncSession, rows: list):
+    await db.execute(_add_daily_totals_stmt(), rows)
+
+
+def _month_of(day_column):
+    return func.date(day_column, "start of month")
+
+
+def _monthly_select():
+    month = _month_of(MilkDailyTotal.day)
+    return select(
+        MilkDailyTotal.herd_id,
+        month,
+        func.sum(MilkDailyTotal.total_liters),
+        func.sum(MilkDailyTotal.record_count),
+        func.count(),
+        func.sum(MilkDailyTotal.fat_sum),
+        func.sum(MilkDailyTotal.fat_count),
+        func.sum(MilkDailyTotal.protein_sum),
+        func.sum(MilkDailyTotal.protein_count),
+    ).group_by(MilkDailyTotal.herd_id, month)
+
+
+_MONTHLY_COLUMNS = [
+    "herd_id",
+    "month",
+    "total_liters",
+    "record_count",
+    "days_recorded",
+    "fat_sum",
+    "fat_count",
+    "protein_sum",
+    "protein_count",
+]
+
+
+async def _refresh_month(db: AsyncSession, herd_id: int, month: date):
+    if month.month == 12:
+        next_month = month.replace(year=month.year + 1, month=1)
+    else:
+        next_month = month.replace(month=month.month + 1)
+
+    await db.execute(
+        delete(MilkMonthlyTotal).where(
+            MilkMonthlyTotal.herd_id == herd_id, MilkMonthlyTotal.month == month
+        )
+    )
+    await db.execute(
+        insert(MilkMonthlyTotal).from_select(
+            _MONTHLY_COLUMNS,
+            _monthly_select().where(
+                MilkDailyTotal.herd_id == herd_id,
+                and_(MilkDailyTotal.day >= month, MilkDailyTotal.day < next_month),
+            ),
+        )
+    )
+
+
+async def delete_herd_rollups(db: AsyncSession, herd_id: int):
+    """Drop a deleted herd's rollup rows; the caller commits.
+
+    SQLite reuses a freed herd id for the next herd created, which would
+    otherwise inherit these totals.
+    """
+    await db.execute(delete(MilkMonthlyTotal).where(MilkMonthlyTotal.herd_id == herd_id))
+    await db.execute(delete(MilkDailyTotal).where(MilkDailyTotal.herd_id == herd_id))
+
+
+async def rebuild_rollups(db: AsyncSession, include_archives: bool = True):
+    """Recompute both rollup tables from milk_productions and the archive.
+
+    The caller commits. ``include_archives=False`` is for databases that
+    predate the milk_archives table.
+    """
+    await db.execute(delete(MilkMonthlyTotal))
+    await db.execute(delete(MilkDailyTotal))
+
+    day = func.date(MilkProduction.date)
+    await db.execute(
+        insert(MilkDailyTotal).from_select(
+            ["herd_id", "day"] + list(_SUM_COLUMNS),
+            select(
+                MilkProduction.herd_id,
+                day,
+                func.sum(MilkProduction.amount_liters),
+                func.count(),
+                func.coalesce(func.sum(MilkProduction.fat_percentage), 0),
+                func.count(MilkProduction.fat_percentage),
+                func.coalesce(func.sum(MilkProduction.protein_percentage), 0),
+                func.count(MilkProduction.protein_percentage),
+            )
+            .where(MilkProduction.date.is_not(None), MilkProduction.herd_id.is_not(None))
+            .group_by(MilkProduction.herd_id, day),
+        )
+    )
+    if include_archives:
+        result = await db.execute(select(MilkArchive.herd_id, MilkArchive.path))
+        for herd_id, path in result.all():
+            rows = archive_daily_totals(herd_id, load_archive(path))
+            if rows:
+                await _add_daily_totals(db, rows)
+    await db.execute(
+        insert(MilkMonthlyTotal).from_select(_MONTHLY_COLUMNS, _monthly_select())
+    )
+
+
+def time_span_start(time_span: Optional[str]) -> Optional[date]:
+    """First day covered by a 'week', 'month' or 'year' time span"""
+    today = datetime.now().date()
+    if time_span == "week":
+        return today - timedelta(days=7)
+    if time_span == "month":
+        return today - timedelta(days=30)
+    if time_span == "year":
+        return today - timedelta(days=365)
+    return None
+
+
+def build_stats(total_liters, days_recorded, cow_count=None) -> MilkProductionStats:
+    if total_liters is None or not days_recorded:
+        return MilkProductionStats(
+            total_liters=total_liters or 0,
+            average_per_day=0,
+            days_recorded=days_recorded or 0,
+            liters_per_cow=0,
+        )
+    average_per_day = total_liters / days_recorded
+    liters_per_cow = average_per_day / cow_count if cow_count else 0
+    return MilkProductionStats(
+        total_liters=total_liters,
+        average_per_day=average_per_day,
+        days_recorded=days_recorded,
+        liters_per_cow=liters_per_cow,
+    )
+
+
+def stats_query(
+    user_id: int, herd_id: Optional[int] = None, start_date: Optional[date] = None
+):
+    """Total liters and days recorded; see production_stats"""
+    if herd_id and not start_date:
+        return select(
+            func.sum(MilkMonthlyTotal.total_liters).label("total_liters"),
+            func.sum(MilkMonthlyTotal.days_recorded).label("days_recorded"),
+        ).where(MilkMonthlyTotal.herd_id == herd_id)
+
+    # (herd_id, day) is the key, so only days across herds need DISTINCT
+    if herd_id:
+        days_recorded = func.count()
+    else:
+        days_recorded = func.count(MilkDailyTotal.day.distinct())
+    query = (
+        select(
+            func.sum(MilkDailyTotal.total_liters).label("total_liters"),
+            days_recorded.label("days_recorded"),
+        )
+        .join(Herd, MilkDailyTotal.herd_id == Herd.id)
+        .where(Herd.user_id == user_id)
+    )
+    if herd_id:
+        query = query.where(MilkDailyTotal.herd_id == herd_id)
+    if start_date:
+        query = query.where(MilkDailyTotal.day >= start_date)
+    return query
+
+
+async def production_stats(
+    db: AsyncSession,
+    user_id: int,
+    herd: Optional[Herd] = None,
+    start_date: Optional[date] = None,
+) -> MilkProductionStats:
+    """Totals for a user (or one of their herds) answered from the rollups.
+
+    A whole herd history reads one row per month, anything else one row
+    per day. ``herd`` must already be known to belong to ``user_id``.
+    """
+    query = stats_query(user_id, herd.id if herd else None, start_date)
+    result = await db.execute(query)
+    stats = result.fetchone()
+    if not stats:
+        return build_stats(None, 0)
+    # Liters per cow only makes sense for a single herd
+    cow_count = herd.cow_count if herd else None
+    return build_stats(stats.total_liters, stats.days_recorded, cow_count)
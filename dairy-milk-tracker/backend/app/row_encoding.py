@@ -0,0 +1,142 @@
+from datetime import date, datetime, timezone
+from typing import Iterable, List, Optional, Sequence, Tuple, Type
+
+import msgpack
+import orjson
+from pydantic import BaseModel
+
+try:
+    import pyarrow
+except ImportError:  # Arrow responses are only offered with pyarrow installed
+    pyarrow = None
+
+JSON_MEDIA_TYPE = "application/json"
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+ARROW_STREAM_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+
+# Marks the end of an Arrow IPC stream (continuation token, zero length)
+ARROW_END_OF_STREAM = b"\xff\xff\xff\xff\x00\x00\x00\x00"
+
+
+def schema_columns(model, schema: Type[BaseModel]) -> Tuple:
+    """The model's columns named by the schema's fields, in schema order.
+
+    Selecting these returns row tuples that line up with ``schema`` without
+    loading ORM objects into the session.
+    """
+    return tuple(getattr(model, field) for field in schema.model_fields)
+
+
+def encode_json_rows(fields: Sequence[str], rows: Iterable[tuple]) -> bytes:
+    """A JSON array of objects built straight from row tuples.
+
+    Produces the same JSON as validating each row with the response model
+    and serializing it, as long as the columns already have the schema's
+    types (which plain column selects do).
+    """
+    return orjson.dumps([dict(zip(fields, row)) for row in rows])
+
+
+def columnar_media_types(default: str = JSON_MEDIA_TYPE) -> List[str]:
+    """Media types a columnar endpoint can answer with, ``default`` first"""
+    media_types = [default, MSGPACK_MEDIA_TYPE]
+    if pyarrow is not None:
+        media_types.append(ARROW_STREAM_MEDIA_TYPE)
+    return media_types
+
+
+def preferred_media_type(accept: Optional[str], offered: Sequence[str]) -> str:
+    """The offered media type ranked highest by an Accept header.
+
+    Higher q wins, then an exact type over a wildcard, then the order in the
+    header. Wildcards and headers naming nothing offered get ``offered[0]``.
+    """
+    best = (0.0, 0, 0, offered[0])
+    for index, part in enumerate((accept or "").split(",")):
+        media_type, *params = [piece.strip() for piece in part.split(";")]
+        media_type = media_type.lower()
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if q <= 0:
+            continue
+        if media_type in offered:
+            candidate = (q, 1, -index, media_type)
+        elif media_type in ("*/*", offered[0].split("/")[0] + "/*"):
+            candidate = (q, 0, -index, offered[0])
+        else:
+            continue
+        best = max(best, candidate)
+    return best[3]
+
+
+def column_arrays(rows: Sequence[tuple], width: int) -> List[tuple]:
+    """Transpose row tuples into one tuple per column"""
+    return list(zip(*rows)) if rows else [()] * width
+
+
+def _msgpack_default(value):
+    # Stored datetimes are naive; they are packed as UTC timestamps
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return msgpack.Timestamp.from_datetime(value)
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError(f"Cannot pack {type(value).__name__}")
+
+
+def encode_msgpack_columns(fields: Sequence[str], rows: Sequence[tuple]) -> bytes:
+    """A MessagePack map of field name to the array of that column's values.
+
+    Datetimes use the MessagePack timestamp extension; unpack with
+    ``msgpack.unpackb(body, timestamp=3)`` to get datetime objects, and pass
+    the result to ``pandas.DataFrame`` to get one column per field.
+    """
+    columns = column_arrays(rows, len(fields))
+    return msgpack.packb(
+        {field: list(values) for field, values in zip(fields, columns)},
+        default=_msgpack_default,
+    )
+
+
+def arrow_schema(fields: Sequence[str], columns: Sequence) -> "pyarrow.Schema":
+    """An Arrow schema for a column select, typed from the SQLAlchemy columns"""
+    arrow_types = {
+        int: pyarrow.int64(),
+        float: pyarrow.float64(),
+        str: pyarrow.string(),
+        bool: pyarrow.bool_(),
+        datetime: pyarrow.timestamp("us"),
+        date: pyarrow.date32(),
+    }
+    return pyarrow.schema(
+        [
+            (field, arrow_types[column.type.python_type])
+            for field, column in zip(fields, columns)
+        ]
+    )
+
+
+def encode_arrow_batch(schema: "pyarrow.Schema", rows: Sequence[tuple]) -> bytes:
+    """One Arrow IPC record batch message built column by column"""
+    columns = column_arrays(rows, len(schema))
+    batch = pyarrow.RecordBatch.from_arrays(
+        [pyarrow.array(values, type=field.type) for values, field in zip(columns, schema)],
+        schema=schema,
+    )
+    return batch.serialize().to_pybytes()
+
+
+def encode_arrow_stream(schema: "pyarrow.Schema", rows: Sequence[tuple]) -> bytes:
+    """A complete Arrow IPC stream holding ``rows`` in a single batch"""
+    return (
+        schema.serialize().to_pybytes()
+        + encode_arrow_batch(schema, rows)
+        + ARROW_END_OF_STREAM
+    )
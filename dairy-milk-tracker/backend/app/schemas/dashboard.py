@@ -0,0 +1,18 @@
+from typing import List
+from pydantic import BaseModel
+
+from app.schemas.herd import Herd
+from app.schemas.milk_production import MilkProduction, MilkProductionStats
+
+
+class HerdSummary(Herd):
+    total_liters: float = 0
+    days_recorded: int = 0
+    average_per_day: float = 0
+    liters_per_cow: float = 0
+
+
+class DashboardSummary(BaseModel):
+    herds: List[HerdSummary]
+    stats: MilkProductionStats
+    recent_records: List[MilkProduction]
@@ -1,6 +1,6 @@
 from typing import List, Optional
 from pydantic import BaseModel
-from datetime import datetime
+from datetime import date, datetime
 
 
 class HerdBase(BaseModel):
@@ -21,3 +21,17 @@ class Herd(HerdBase):
     
     class Config:
         from_attributes = True
+
+
+class HerdAlert(BaseModel):
+    id: int
+    herd_id: int
+    day: date
+    kind: str
+    liters_per_cow: float
+    baseline: float
+    score: float
+    created_at: datetime
+    
+    class Config:
+        from_attributes = True
@@ -1,6 +1,6 @@
-from typing import List, Optional
+from typing import Any, List, Optional
 from pydantic import BaseModel
-from datetime import datetime
+from datetime import date, datetime
 
 
 class MilkProductionBase(BaseModel):
@@ -28,3 +28,43 @@ class MilkProductionStats(BaseModel):
     average_per_day: float
     days_recorded: int
     liters_per_cow: float = 0
+
+
+class MilkProductionBulkError(BaseModel):
+    index: int
+    detail: Any
+
+
+class MilkProductionBulkResult(BaseModel):
+    inserted: int
+    errors: List[MilkProductionBulkError] = []
+
+
+class MilkProductionImportReject(BaseModel):
+    line: int
+    detail: Any
+
+
+class MilkProductionImportResult(BaseModel):
+    processed: int
+    inserted: int
+    rejected: int
+    rejects: List[MilkProductionImportReject] = []
+
+
+class MilkProductionSeriesPoint(BaseModel):
+    period_start: date
+    total_liters: float
+    record_count: int
+    days_recorded: int
+    average_per_day: float
+    fat_percentage: Optional[float] = None
+    protein_percentage: Optional[float] = None
+    liters_per_cow: Optional[float] = None
+    moving_average_7d: Optional[float] = None
+    moving_average_30d: Optional[float] = None
+
+
+class MilkProductionSeries(BaseModel):
+    bucket: str
+    points: List[MilkProductionSeriesPoint] = []
@@ -38,5 +38,10 @@ class Token(BaseModel):
     token_type: str
 
 
+class EventToken(BaseModel):
+    token: str
+    expires_in: int  # seconds
+
+
 class TokenData(BaseModel):
     email: Optional[str] = None
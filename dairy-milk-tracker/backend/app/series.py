@@ -0,0 +1,144 @@
+from datetime import date
+from typing import List, Optional
+
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.future import select
+
+from app.models.herd import Herd
+from app.models.rollup import MilkDailyTotal
+
+SERIES_BUCKETS = ("day", "week", "month")
+# Approximate length of each bucket, used to size the moving-average windows
+BUCKET_DAYS = {"day": 1, "week": 7, "month": 30}
+MOVING_AVERAGE_DAYS = (7, 30)
+
+
+def bucket_expression(bucket: str):
+    """SQL expression mapping a rollup day onto the first day of its bucket"""
+    if bucket == "day":
+        return MilkDailyTotal.day
+    if bucket == "week":
+        # Monday of the week: jump to the next Sunday, then back six days
+        return func.date(MilkDailyTotal.day, "weekday 0", "-6 days")
+    if bucket == "month":
+        return func.date(MilkDailyTotal.day, "start of month")
+    raise ValueError(f"Unsupported bucket: {bucket}")
+
+
+def build_series_query(
+    user_id: int,
+    bucket: str,
+    herd_id: Optional[int] = None,
+    from_date: Optional[date] = None,
+    to_date: Optional[date] = None,
+):
+    """One GROUP BY over the daily rollups, one row per bucket"""
+    period = bucket_expression(bucket).label("period")
+    query = (
+        select(
+            period,
+            func.sum(MilkDailyTotal.total_liters).label("total_liters"),
+            func.sum(MilkDailyTotal.record_count).label("record_count"),
+            func.count(MilkDailyTotal.day.distinct()).label("days_recorded"),
+            func.sum(MilkDailyTotal.fat_sum).label("fat_sum"),
+            func.sum(MilkDailyTotal.fat_count).label("fat_count"),
+            func.sum(MilkDailyTotal.protein_sum).label("protein_sum"),
+            func.sum(MilkDailyTotal.protein_count).label("protein_count"),
+        )
+        .join(Herd, MilkDailyTotal.herd_id == Herd.id)
+        .where(Herd.user_id == user_id)
+    )
+    if herd_id:
+        query = query.where(MilkDailyTotal.herd_id == herd_id)
+    if from_date:
+        query = query.where(MilkDailyTotal.day >= from_date)
+    if to_date:
+        query = query.where(MilkDailyTotal.day <= to_date)
+    return query.group_by(period).order_by(period)
+
+
+def _bucket_ordinals(periods: List[date], bucket: str) -> np.ndarray:
+    """Consecutive integers for consecutive buckets, so gaps are visible"""
+    if bucket == "month":
+        return np.array([p.year * 12 + p.month - 1 for p in periods], dtype=np.int64)
+    ordinals = np.array([p.toordinal() for p in periods], dtype=np.int64)
+    return ordinals // 7 if bucket == "week" else ordinals
+
+
+def _trailing_mean(values: np.ndarray, positions: np.ndarray, window: int) -> np.ndarray:
+    """Mean of the non-missing values in the trailing ``window`` buckets.
+
+    ``values`` are placed on a dense bucket axis (missing buckets don't count
+    towards the mean) and cumulative sums give every window in one pass.
+    """
+    dense_values = np.zeros(positions[-1] + 1)
+    dense_counts = np.zeros(positions[-1] + 1)
+    dense_values[positions] = values
+    dense_counts[positions] = 1
+
+    sums = np.cumsum(dense_values)
+    counts = np.cumsum(dense_counts)
+    sums[window:] = sums[window:] - sums[:-window]
+    counts[window:] = counts[window:] - counts[:-window]
+    return (sums / counts)[positions]
+
+
+def _ratio(numerators: np.ndarray, denominators: np.ndarray) -> np.ndarray:
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(denominators > 0, numerators / denominators, np.nan)
+
+
+def _to_list(values: np.ndarray) -> list:
+    """Array to list, with NaN turned into None for JSON"""
+    return [None if np.isnan(value) else value for value in values.tolist()]
+
+
+def compute_series(rows, bucket: str, cow_count: int = 0) -> dict:
+    """Turn bucket rows into column arrays plus derived series"""
+    if not rows:
+        return {}
+
+    periods = [
+        row.period if isinstance(row.period, date) else date.fromisoformat(row.period)
+        for row in rows
+    ]
+    columns = np.array(
+        [
+            (
+                row.total_liters,
+                row.record_count,
+                row.days_recorded,
+                row.fat_sum,
+                row.fat_count,
+                row.protein_sum,
+                row.protein_count,
+            )
+            for row in rows
+        ],
+        dtype=np.float64,
+    )
+    total, records, days, fat_sum, fat_count, protein_sum, protein_count = columns.T
+
+    average_per_day = _ratio(total, days)
+    positions = _bucket_ordinals(periods, bucket)
+    positions = positions - positions[0]
+
+    series = {
+        "period_start": periods,
+        "total_liters": total.tolist(),
+        "record_count": records.astype(np.int64).tolist(),
+        "days_recorded": days.astype(np.int64).tolist(),
+        "average_per_day": average_per_day.tolist(),
+        "fat_percentage": _to_list(_ratio(fat_sum, fat_count)),
+        "protein_percentage": _to_list(_ratio(protein_sum, protein_count)),
+        "liters_per_cow": _to_list(average_per_day / cow_count)
+        if cow_count > 0
+        else [None] * len(periods),
+    }
+    for window_days in MOVING_AVERAGE_DAYS:
+        window = max(1, round(window_days / BUCKET_DAYS[bucket]))
+        series[f"moving_average_{window_days}d"] = _to_list(
+            _trailing_mean(average_per_day, positions, window)
+        )
+    return series
@@ -0,0 +1,216 @@
+import asyncio
+import logging
+import os
+from typing import List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import insert, select
+
+from app.database import SessionLocal
+from app.logging_config import batch_request_ids, request_id
+from app.metrics import current_request
+from app.models.herd import Herd
+from app.models.milk_production import MilkProduction
+from app.rollups import RollupDelta
+from app.schemas.milk_production import MilkProductionCreate
+
+logger = logging.getLogger(__name__)
+
+MILK_WRITE_BATCH_SIZE = int(os.environ.get("MILK_WRITE_BATCH_SIZE", "500"))
+MILK_WRITE_BATCH_WINDOW_MS = float(os.environ.get("MILK_WRITE_BATCH_WINDOW_MS", "2"))
+
+
+class HerdNotFound(LookupError):
+    """The record's herd was deleted, or changed owner, before the insert"""
+
+
+class InsertedRecord(NamedTuple):
+    id: int
+    created_at: object
+    # The record's herd and day after the batch was committed
+    day_total_liters: float
+    day_record_count: int
+
+
+class MilkWriteCoalescer:
+    """Group commit for single milk record inserts.
+
+    Callers ``submit`` a validated record and await its new row. A background
+    task collects everything submitted within ``max_delay`` seconds (or up to
+    ``max_batch`` records), inserts it with one statement and commits once,
+    so concurrent requests share a transaction and an fsync. The herd owners
+    are checked again inside that transaction; records whose herd no longer
+    belongs to the submitting user fail with HerdNotFound.
+    """
+
+    def __init__(self, session_factory, max_batch: int = 500, max_delay: float = 0.002):
+        self.session_factory = session_factory
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._loop = None
+        self.batches = 0
+        self.rows = 0
+        self.max_batch_seen = 0
+
+    def _ensure_worker(self):
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._loop is not loop:
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._task = loop.create_task(self._worker())
+
+    async def submit(self, record: MilkProductionCreate, user_id: int):
+        """Queue a record of one of the user's herds; returns its InsertedRecord"""
+        self._ensure_worker()
+        future = self._loop.create_future()
+        await self._queue.put((record, user_id, future, request_id.get()))
+        return await future
+
+    async def close(self):
+        """Flush whatever is queued and stop the background task"""
+        if self._task is None or self._task.done():
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+
+    async def _worker(self):
+        # The task was started inside a request; its batches belong to none
+        # (their logs list the requests of the batch instead)
+        current_request.set(None)
+        request_id.set(None)
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+
+            # Give concurrent requests a moment to join this transaction
+            if self.max_delay > 0 and self._queue.qsize() < self.max_batch - 1:
+                await asyncio.sleep(self.max_delay)
+
+            closing = False
+            while len(batch) < self.max_batch and not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is None:
+                    closing = True
+                    break
+                batch.append(item)
+
+            await self._flush(batch)
+            if closing:
+                return
+
+    async def _flush(self, batch: list):
+        self.batches += 1
+        self.rows += len(batch)
+        self.max_batch_seen = max(self.max_batch_seen, len(batch))
+        token = batch_request_ids.set(tuple(rid for *_, rid in batch if rid))
+        try:
+            await self._commit(batch)
+        finally:
+            batch_request_ids.reset(token)
+
+    async def _commit(self, batch: list):
+        try:
+            results = await self._insert([(record, user_id) for record, user_id, _, _ in batch])
+        except Exception:
+            logger.warning(
+                "Milk write batch failed, retrying records one by one",
+                exc_info=True,
+                extra={"rows": len(batch)},
+            )
+            # Retry one by one so a single bad row only fails its own caller
+            for record, user_id, future, _ in batch:
+                try:
+                    results = await self._insert([(record, user_id)])
+                except Exception as e:
+                    results = [e]
+                self._resolve(future, results[0])
+            return
+        logger.debug("Milk write batch committed", extra={"rows": len(batch)})
+        for (_, _, future, _), result in zip(batch, results):
+            self._resolve(future, result)
+
+    @staticmethod
+    def _resolve(future: asyncio.Future, result):
+        if future.done():
+            return
+        if isinstance(result, Exception):
+            future.set_exception(result)
+        else:
+            future.set_result(result)
+
+    async def _insert(self, items: List[Tuple[MilkProductionCreate, int]]) -> list:
+        """Insert the records of herds still owned by their submitters.
+
+        Returns an InsertedRecord, or a HerdNotFound to raise, per item.
+        """
+        async with self.session_factory() as db:
+            # Read in the write transaction: a herd deleted or handed over
+            # since the request looked it up must not get the record
+            result = await db.execute(
+                select(Herd.id, Herd.user_id).where(
+                    Herd.id.in_({record.herd_id for record, _ in items})
+                )
+            )
+            owners = dict(result.all())
+            records = [
+                record for record, user_id in items if owners.get(record.herd_id) == user_id
+            ]
+
+            rows = []
+            daily_totals = {}
+            if records:
+                result = await db.execute(
+                    insert(MilkProduction).returning(
+                        MilkProduction.id,
+                        MilkProduction.created_at,
+                        sort_by_parameter_order=True,
+                    ),
+                    [record.model_dump() for record in records],
+                )
+                rows = result.all()
+
+                delta = RollupDelta()
+                for record in records:
+                    delta.add(record)
+                daily_totals = await delta.apply(db)
+                await db.commit()
+
+            inserted = iter(rows)
+            results = []
+            for record, user_id in items:
+                if owners.get(record.herd_id) != user_id:
+                    results.append(HerdNotFound(f"Herd {record.herd_id} not found"))
+                    continue
+                row = next(inserted)
+                results.append(
+                    InsertedRecord(
+                        row.id,
+                        row.created_at,
+                        *daily_totals[(record.herd_id, record.date.date())],
+                    )
+                )
+            return results
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize() if self._queue else 0,
+            "batches": self.batches,
+            "rows": self.rows,
+            "max_batch": self.max_batch_seen,
+        }
+
+
+milk_write_coalescer = MilkWriteCoalescer(
+    SessionLocal,
+    max_batch=MILK_WRITE_BATCH_SIZE,
+    max_delay=MILK_WRITE_BATCH_WINDOW_MS / 1000,
+)
+
+
+def get_milk_write_coalescer():
+    """Dependency returning the coalescer used for single record inserts"""
+    return milk_write_coalescer
@@ -0,0 +1,63 @@
+# Milk production archival script
+# Run with: python archive_milk_data.py [--horizon-days 730] [--vacuum]
+
+import argparse
+import asyncio
+from datetime import date
+
+from app.archive import (
+    ARCHIVE_DIR,
+    ARCHIVE_HORIZON_DAYS,
+    archive_cutoff,
+    archive_milk_productions,
+)
+from app.database import STARTUP_LOCK_PATH, SessionLocal, engine
+from app.migrations import run_migrations_once
+from app.response_cache import mark_data_changed
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Move old milk production records into per-herd, per-year column files"
+    )
+    parser.add_argument(
+        "--horizon-days",
+        type=int,
+        default=ARCHIVE_HORIZON_DAYS,
+        help="Archive whole years older than this many days",
+    )
+    parser.add_argument(
+        "--vacuum",
+        action="store_true",
+        help="Rebuild the database file afterwards to return the freed space",
+    )
+    return parser.parse_args()
+
+
+async def run(args):
+    # The manifest table is added by a migration
+    await run_migrations_once(engine, STARTUP_LOCK_PATH)
+
+    cutoff = archive_cutoff(date.today(), args.horizon_days)
+    print(f"Archiving records dated before {cutoff.date()} to {ARCHIVE_DIR}")
+    async with SessionLocal() as db:
+        result = await archive_milk_productions(db, cutoff)
+    if result.records:
+        mark_data_changed()
+
+    if args.vacuum and result.records:
+        async with engine.connect() as conn:
+            await conn.exec_driver_sql("VACUUM")
+    await engine.dispose()
+    return result
+
+
+def main():
+    print("Dairy Milk Tracker - Archive Milk Production Records")
+    print("====================================================")
+    result = asyncio.run(run(parse_args()))
+    print(f"Archived {result.records} records in {result.herd_years} herd-years")
+
+
+if __name__ == "__main__":
+    main()
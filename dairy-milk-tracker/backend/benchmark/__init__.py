@@ -0,0 +1,6 @@
+"""Synthetic farm data and load scenarios for measuring the API.
+
+``python -m benchmark.generate`` fills a SQLite database with users, herds
+and daily milk records; ``python -m benchmark.load`` drives the ASGI app
+against it and reports throughput and latency percentiles per route.
+"""
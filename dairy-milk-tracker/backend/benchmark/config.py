@@ -0,0 +1,21 @@
+from dataclasses import dataclass
+from datetime import date
+
+# Kept free of app imports: the load driver must set DATABASE_PATH before
+# anything imports app.database
+BENCHMARK_PASSWORD = "benchmark"
+DEFAULT_END_DATE = date(2025, 12, 31)
+
+
+def benchmark_email(index: int) -> str:
+    return f"bench-user-{index}@example.com"
+
+
+@dataclass
+class FarmConfig:
+    users: int = 100
+    herds_per_user: int = 3
+    days: int = 365
+    milkings_per_day: int = 2
+    end_date: date = DEFAULT_END_DATE
+    seed: int = 42
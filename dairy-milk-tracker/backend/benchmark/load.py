@@ -0,0 +1,251 @@
+# Benchmark load driver
+# Run with: python -m benchmark.load bench.db --concurrency 50 --duration 30
+
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import httpx
+
+from benchmark.config import BENCHMARK_PASSWORD, DEFAULT_END_DATE, benchmark_email
+from benchmark.report import LatencyRecorder, format_summary, load_summary, save_summary
+
+SCENARIOS = ("login", "dashboard", "sync", "pagination")
+
+
+class LoadDriver:
+    """Runs load scenarios against the app through an in-process httpx client.
+
+    Each scenario starts ``concurrency`` virtual clients that repeat one
+    interaction until the scenario's time is up. Latencies are recorded per
+    route into the recorder passed to ``run``.
+    """
+
+    def __init__(self, client: httpx.AsyncClient, args):
+        self.client = client
+        self.args = args
+        self.accounts = []
+        self.recorder = None
+
+    async def request(self, route: str, method: str, url: str, **kwargs) -> httpx.Response:
+        started = time.perf_counter()
+        response = await self.client.request(method, url, **kwargs)
+        self.recorder.record(route, time.perf_counter() - started, response.status_code < 400)
+        return response
+
+    async def _login(self, email: str) -> httpx.Response:
+        return await self.request(
+            "POST /api/auth/token",
+            "POST",
+            "/api/auth/token",
+            data={"username": email, "password": BENCHMARK_PASSWORD},
+        )
+
+    async def setup(self, users: int):
+        """Log in the benchmark accounts and look up their herds (not measured)"""
+        self.recorder = LatencyRecorder()
+
+        async def sign_in(index):
+            response = await self._login(benchmark_email(index))
+            response.raise_for_status()
+            headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+            response = await self.client.get("/api/herds/", headers=headers)
+            herd_ids = [herd["id"] for herd in response.json()]
+            return {"email": benchmark_email(index), "headers": headers, "herd_ids": herd_ids}
+
+        accounts = await asyncio.gather(*(sign_in(i) for i in range(1, users + 1)))
+        self.accounts = [account for account in accounts if account["herd_ids"]]
+        if not self.accounts:
+            raise SystemExit("The benchmark accounts have no herds; run benchmark.generate first")
+
+    async def login(self, rng: random.Random, state: dict):
+        await self._login(rng.choice(self.accounts)["email"])
+
+    async def dashboard(self, rng: random.Random, state: dict):
+        # Pollers send back the ETags they were given, like the browser does
+        account = rng.choice(self.accounts)
+        herd_id = rng.choice(account["herd_ids"])
+        for route, url in (
+            ("GET /api/dashboard/summary", "/api/dashboard/summary"),
+            ("GET /api/dashboard/summary?herd_id", f"/api/dashboard/summary?herd_id={herd_id}"),
+            ("GET /api/milk-production/stats", "/api/milk-production/stats?time_span=month"),
+            ("GET /api/milk-production/series", "/api/milk-production/series?bucket=day"),
+        ):
+            headers = dict(account["headers"])
+            etag = state.get((account["email"], url))
+            if etag:
+                headers["If-None-Match"] = etag
+            response = await self.request(route, "GET", url, headers=headers)
+            if "etag" in response.headers:
+                state[(account["email"], url)] = response.headers["etag"]
+
+    async def sync(self, rng: random.Random, state: dict):
+        # A parlour uploads one milking for a herd, then a late single entry
+        account = rng.choice(self.accounts)
+        herd_id = rng.choice(account["herd_ids"])
+        day = DEFAULT_END_DATE + timedelta(days=rng.randint(1, 365))
+        milked_at = datetime(day.year, day.month, day.day, rng.randint(4, 20))
+        records = [
+            {
+                "herd_id": herd_id,
+                "date": (milked_at + timedelta(seconds=i)).isoformat(),
+                "amount_liters": round(rng.uniform(8, 40), 1),
+                "fat_percentage": round(rng.uniform(3.4, 4.4), 2),
+            }
+            for i in range(self.args.sync_batch)
+        ]
+        await self.request(
+            "POST /api/milk-production/bulk",
+            "POST",
+            "/api/milk-production/bulk",
+            json=records,
+            headers=account["headers"],
+        )
+        await self.request(
+            "POST /api/milk-production/",
+            "POST",
+            "/api/milk-production/",
+            json=records[0],
+            headers=account["headers"],
+        )
+
+    async def pagination(self, rng: random.Random, state: dict):
+        # Walk a herd's history page by page, then jump deep with an offset
+        account = rng.choice(self.accounts)
+        herd_id = rng.choice(account["herd_ids"])
+        page_size = self.args.page_size
+        url = f"/api/milk-production/?herd_id={herd_id}&limit={page_size}"
+        cursor = None
+        for _ in range(self.args.max_pages):
+            page_url = f"{url}&cursor={cursor}" if cursor else url
+            response = await self.request(
+                "GET /api/milk-production/ (cursor)",
+                "GET",
+                page_url,
+                headers=account["headers"],
+            )
+            cursor = response.headers.get("x-next-cursor")
+            if not cursor:
+                break
+        await self.request(
+            "GET /api/milk-production/ (offset)",
+            "GET",
+            f"{url}&skip={page_size * self.args.max_pages}",
+            headers=account["headers"],
+        )
+
+    async def run(self, scenario: str, recorder: LatencyRecorder) -> float:
+        """Run one scenario for the configured duration; returns elapsed seconds"""
+        self.recorder = recorder
+        interaction = getattr(self, scenario)
+        started = time.perf_counter()
+        deadline = started + self.args.duration
+
+        async def virtual_client(seed):
+            rng = random.Random(seed)
+            state = {}
+            while time.perf_counter() < deadline:
+                await interaction(rng, state)
+
+        await asyncio.gather(
+            *(virtual_client(self.args.seed + i) for i in range(self.args.concurrency))
+        )
+        return time.perf_counter() - started
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Run load scenarios against the API and report latency per route"
+    )
+    parser.add_argument("path", help="Database created by benchmark.generate")
+    parser.add_argument(
+        "--scenarios",
+        default=",".join(SCENARIOS),
+        help=f"Comma separated, any of: {', '.join(SCENARIOS)}",
+    )
+    parser.add_argument("--concurrency", type=int, default=20, help="Virtual clients")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds per scenario")
+    parser.add_argument("--users", type=int, default=100, help="Accounts to log in")
+    parser.add_argument("--sync-batch", type=int, default=50, help="Records per upload")
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--max-pages", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="Compare p95 against an earlier --output file")
+    parser.add_argument(
+        "--in-place",
+        action="store_true",
+        help="Run against the database itself instead of a copy (sync writes to it)",
+    )
+    args = parser.parse_args()
+
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    args.scenarios = scenarios
+    return args
+
+
+async def run(args) -> dict:
+    # Imported here because the database path is read when app.database loads
+    from app.main import app
+
+    await app.router.startup()
+    results = {}
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://benchmark", timeout=None
+        ) as client:
+            driver = LoadDriver(client, args)
+            await driver.setup(args.users)
+            for scenario in args.scenarios:
+                print(f"Running {scenario} for {args.duration:g}s...")
+                recorder = LatencyRecorder()
+                elapsed = await driver.run(scenario, recorder)
+                results[scenario] = recorder.summary(elapsed)
+    finally:
+        await app.router.shutdown()
+    return results
+
+
+def main():
+    args = parse_args()
+    if not os.path.exists(args.path):
+        raise SystemExit(f"{args.path} not found; create it with benchmark.generate")
+    # Every virtual client shares one address; measure the API, not the limiter
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+
+    print("Dairy Milk Tracker - Load Benchmark")
+    print("===================================")
+    path = os.path.abspath(args.path)
+    if args.in_place:
+        os.environ["DATABASE_PATH"] = path
+        results = asyncio.run(run(args))
+    else:
+        # The sync scenario inserts records; run on a copy so every run starts
+        # from the same data and results stay comparable
+        with tempfile.TemporaryDirectory(prefix="dairy-benchmark-") as scratch:
+            copy = os.path.join(scratch, os.path.basename(path))
+            shutil.copyfile(path, copy)
+            os.environ["DATABASE_PATH"] = copy
+            os.environ.setdefault("ARCHIVE_DIR", os.path.splitext(path)[0] + "_archive")
+            results = asyncio.run(run(args))
+
+    baseline = load_summary(args.baseline) if args.baseline else None
+    for scenario, summary in results.items():
+        print(f"\n{scenario}")
+        print(format_summary(summary, baseline.get(scenario, {}) if baseline else None))
+    if args.output:
+        save_summary(results, args.output)
+        print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
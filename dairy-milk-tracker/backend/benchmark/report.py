@@ -0,0 +1,69 @@
+import json
+from collections import defaultdict
+from typing import Dict, Optional
+
+import numpy as np
+
+PERCENTILES = (50, 95, 99)
+
+
+class LatencyRecorder:
+    """Collects request latencies per route and summarizes them"""
+
+    def __init__(self):
+        self._latencies = defaultdict(list)
+        self._errors = defaultdict(int)
+
+    def record(self, route: str, seconds: float, ok: bool = True):
+        self._latencies[route].append(seconds)
+        if not ok:
+            self._errors[route] += 1
+
+    def summary(self, elapsed: float) -> Dict[str, dict]:
+        """Per-route request count, errors, throughput and percentiles in ms"""
+        summary = {}
+        for route, latencies in sorted(self._latencies.items()):
+            values = np.array(latencies) * 1000
+            p50, p95, p99 = np.percentile(values, PERCENTILES)
+            summary[route] = {
+                "requests": len(values),
+                "errors": self._errors[route],
+                "rps": len(values) / elapsed if elapsed > 0 else 0.0,
+                "p50_ms": float(p50),
+                "p95_ms": float(p95),
+                "p99_ms": float(p99),
+                "max_ms": float(values.max()),
+            }
+        return summary
+
+
+def format_summary(summary: Dict[str, dict], baseline: Optional[Dict[str, dict]] = None) -> str:
+    """Render a summary as a text table, with p95 changes against a baseline"""
+    header = f"{'route':<44} {'reqs':>7} {'errs':>5} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8}"
+    if baseline is not None:
+        header += f" {'p95 vs base':>12}"
+    lines = [header, "-" * len(header)]
+    for route, row in summary.items():
+        line = (
+            f"{route:<44} {row['requests']:>7} {row['errors']:>5} {row['rps']:>8.1f} "
+            f"{row['p50_ms']:>8.1f} {row['p95_ms']:>8.1f} {row['p99_ms']:>8.1f}"
+        )
+        if baseline is not None:
+            base = baseline.get(route)
+            if base and base["p95_ms"] > 0:
+                change = (row["p95_ms"] / base["p95_ms"] - 1) * 100
+                line += f" {change:>+11.1f}%"
+            else:
+                line += f" {'new':>12}"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def save_summary(summary: Dict[str, dict], path: str):
+    with open(path, "w") as f:
+        json.dump(summary, f, indent=2, sort_keys=True)
+
+
+def load_summary(path: str) -> Dict[str, dict]:
+    with open(path) as f:
+        return json.load(f)
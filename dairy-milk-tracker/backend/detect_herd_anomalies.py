@@ -0,0 +1,45 @@
+# Herd yield anomaly detection script
+# Run with: python detect_herd_anomalies.py [--lookback-days 180]
+# Meant to run once a day, e.g. from cron shortly after midnight.
+
+import argparse
+import asyncio
+import time
+
+from app.anomalies import ANOMALY_LOOKBACK_DAYS, run_anomaly_detection
+from app.database import STARTUP_LOCK_PATH, SessionLocal, engine
+from app.migrations import run_migrations_once
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Flag drops in liters per cow for every herd"
+    )
+    parser.add_argument(
+        "--lookback-days",
+        type=int,
+        default=ANOMALY_LOOKBACK_DAYS,
+        help="Days of history to analyse; alerts in this window are recomputed",
+    )
+    return parser.parse_args()
+
+
+async def run(args):
+    # The alerts table is added by a migration
+    await run_migrations_once(engine, STARTUP_LOCK_PATH)
+    async with SessionLocal() as db:
+        stored = await run_anomaly_detection(db, lookback_days=args.lookback_days)
+    await engine.dispose()
+    return stored
+
+
+def main():
+    print("Dairy Milk Tracker - Herd Anomaly Detection")
+    print("===========================================")
+    started = time.perf_counter()
+    stored = asyncio.run(run(parse_args()))
+    print(f"Stored {stored} alerts in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+# Milk production import utility script
+# Run with: python import_milk_data.py history.csv [--format csv|ndjson]
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+
+from sqlalchemy.future import select
+
+from app.database import SessionLocal
+from app.milk_import import (
+    DEFAULT_BATCH_SIZE,
+    IMPORT_FORMATS,
+    detect_format,
+    import_milk_productions,
+)
+from app.models.user import User
+from app.response_cache import mark_data_changed
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Stream milk production records from a CSV or NDJSON file"
+    )
+    parser.add_argument("path", help="File to import")
+    parser.add_argument(
+        "--format", choices=IMPORT_FORMATS, help="Defaults to the file extension"
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=DEFAULT_BATCH_SIZE,
+        help="Rows written per transaction",
+    )
+    parser.add_argument(
+        "--rejects", help="Where to write rejected rows (default: <path>.rejects.ndjson)"
+    )
+    parser.add_argument(
+        "--user-email", help="Only import rows for herds owned by this user"
+    )
+    return parser.parse_args()
+
+
+async def run(args, fmt, rejects_path):
+    async with SessionLocal() as db:
+        owner_id = None
+        if args.user_email:
+            result = await db.execute(select(User.id).where(User.email == args.user_email))
+            owner_id = result.scalar()
+            if owner_id is None:
+                print(f"User not found: {args.user_email}")
+                return None
+
+        with open(args.path, encoding="utf-8-sig", newline="") as stream, open(
+            rejects_path, "w", encoding="utf-8"
+        ) as rejects_file:
+
+            def write_reject(line, row, error):
+                rejects_file.write(
+                    json.dumps({"line": line, "row": row, "error": error}, default=str)
+                    + "\n"
+                )
+
+            def report_progress(stats):
+                print(
+                    f"\rProcessed {stats.processed} rows: "
+                    f"{stats.inserted} inserted, {stats.rejected} rejected",
+                    end="",
+                    flush=True,
+                )
+
+            stats = await import_milk_productions(
+                db,
+                stream,
+                fmt,
+                owner_id=owner_id,
+                batch_size=args.batch_size,
+                on_reject=write_reject,
+                on_progress=report_progress,
+                # Running servers drop cached responses after every batch
+                on_commit=lambda herd_ids: mark_data_changed(),
+            )
+        print()
+        return stats
+
+
+def main():
+    print("Dairy Milk Tracker - Milk Production Import")
+    print("===========================================")
+
+    args = parse_args()
+    fmt = args.format or detect_format(args.path)
+    if fmt is None:
+        print("Could not tell the file format from its name, please pass --format")
+        sys.exit(1)
+    if not os.path.exists(args.path):
+        print(f"File not found: {args.path}")
+        sys.exit(1)
+
+    rejects_path = args.rejects or f"{args.path}.rejects.ndjson"
+    print(f"Importing {args.path} as {fmt} in batches of {args.batch_size}")
+
+    stats = asyncio.run(run(args, fmt, rejects_path))
+    if stats is None:
+        sys.exit(1)
+
+    print(f"\nDone: {stats.inserted} rows imported, {stats.rejected} rejected")
+    if stats.rejected:
+        print(f"Rejected rows were written to {rejects_path}")
+    else:
+        os.remove(rejects_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+# Database migration script
+# Run with: python migrate_database.py
+# The server applies pending migrations on startup as well.
+
+import asyncio
+
+from app.database import STARTUP_LOCK_PATH, engine
+from app.migrations import SCHEMA_VERSION, get_schema_version, run_migrations_once
+
+
+async def run():
+    # Same lock as server startup, so it can run while workers are starting
+    applied = await run_migrations_once(engine, STARTUP_LOCK_PATH)
+    async with engine.connect() as conn:
+        version = await get_schema_version(conn)
+    await engine.dispose()
+    return applied, version
+
+
+def main():
+    print("Dairy Milk Tracker - Database Migrations")
+    print("========================================")
+    applied, version = asyncio.run(run())
+    if applied:
+        print(f"Applied migrations: {', '.join(str(v) for v in applied)}")
+    else:
+        print("No pending migrations")
+    print(f"Schema version {version} (latest {SCHEMA_VERSION})")
+
+
+if __name__ == "__main__":
+    main()
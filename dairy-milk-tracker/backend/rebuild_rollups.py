@@ -0,0 +1,30 @@
+# Milk production rollup rebuild script
+# Run with: python rebuild_rollups.py
+
+import asyncio
+
+from app.database import SessionLocal, engine
+from app.migrations import run_migrations
+from app.response_cache import mark_data_changed
+from app.rollups import rebuild_rollups
+
+
+async def run():
+    # Make sure the rollup tables exist on databases that predate them
+    await run_migrations(engine)
+
+    async with SessionLocal() as db:
+        await rebuild_rollups(db)
+        await db.commit()
+    mark_data_changed()
+
+
+def main():
+    print("Dairy Milk Tracker - Rebuild Milk Production Rollups")
+    print("====================================================")
+    asyncio.run(run())
+    print("Daily and monthly rollups rebuilt successfully")
+
+
+if __name__ == "__main__":
+    main()
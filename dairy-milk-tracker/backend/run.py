@@ -1,4 +1,64 @@
+import argparse
+import os
+
 import uvicorn
 
+
+def available_cpus() -> int:
+    """CPUs this process may run on (respects taskset/cgroup CPU affinity)"""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def worker_count(value: str) -> int:
+    if value == "auto":
+        return available_cpus()
+    count = int(value)
+    if count < 1:
+        raise argparse.ArgumentTypeError("workers must be at least 1")
+    return count
+
+
+def configure_multi_worker():
+    """Settings that keep several worker processes consistent.
+
+    Each worker has its own memory, so the per-process response and user
+    caches are turned off (a write in one worker couldn't invalidate the
+    others), and SQLite runs in WAL mode with a busy timeout so workers'
+    reads and writes don't fail on each other's locks. Event streams get the
+    other workers' change notices through the database. Anything already set
+    in the environment wins.
+    """
+    os.environ.setdefault("DATABASE_PROFILE", "production")
+    os.environ.setdefault("RESPONSE_CACHE_MAX_SIZE", "0")
+    os.environ.setdefault("USER_CACHE_MAX_SIZE", "0")
+    os.environ.setdefault("EVENT_SHARE_INTERVAL_SECONDS", "1")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the Dairy Milk Tracker API")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument(
+        "--workers",
+        type=worker_count,
+        default=os.environ.get("WEB_CONCURRENCY", "1"),
+        help="worker processes, or 'auto' for one per available CPU "
+        "(default: $WEB_CONCURRENCY or 1)",
+    )
+    args = parser.parse_args()
+
+    if args.workers == 1:
+        # Development: a single process that reloads on code changes
+        uvicorn.run("app.main:app", host=args.host, port=args.port, reload=True)
+        return
+
+    configure_multi_worker()
+    uvicorn.run(
+        "app.main:app", host=args.host, port=args.port, workers=args.workers
+    )
+
+
 if __name__ == "__main__":
-    uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True)
+    main()
@@ -0,0 +1,11 @@
+import atexit
+import os
+import shutil
+import tempfile
+
+# The database path is read when app.database is imported, and the client
+# fixture runs the startup migrations against it, so point it at a scratch
+# file before any test module imports the app
+_DATABASE_DIR = tempfile.mkdtemp(prefix="dairy-milk-tracker-tests-")
+atexit.register(shutil.rmtree, _DATABASE_DIR, ignore_errors=True)
+os.environ["DATABASE_PATH"] = os.path.join(_DATABASE_DIR, "dairy_milk_tracker.db")
@@ -1,21 +1,72 @@
 import pytest
+from fastapi.responses import JSONResponse
 from fastapi.testclient import TestClient
+from sqlalchemy import select
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from pydantic import TypeAdapter
+from typing import List
 import os
 import asyncio
+import io
+import multiprocessing
+import secrets
+import json
+import logging
+from datetime import date, datetime, timedelta, timezone
 
+import httpx
+import msgpack
+import numpy as np
+
+from app import archive, milk_import
+from app.anomalies import detect_anomalies, run_anomaly_detection
+from app.api.endpoints import herds
 from app.main import app
-from app.database import Base, get_db
-from app.auth import get_password_hash
+from app.database import Base, configure_sqlite_pragmas, get_db, get_read_db
+from app.events import EventBroker, event_broker
+from app.file_lock import read_or_create
+from app.auth import get_password_hash, password_hashing_pool, user_cache
+from app.logging_config import JsonFormatter, RequestIdFilter, SamplingFilter, request_id
+from app.metrics import instrument_engine
+from app.query_log import QueryBudgetExceeded, install_query_log
+from app.rate_limit import (
+    RATE_BUDGETS,
+    ConcurrencyLimiter,
+    RateBudget,
+    RateLimiter,
+    RateLimitMiddleware,
+    rate_limiter,
+)
+from app.milk_export import merge_sorted_chunks
+from app.migrations import MIGRATIONS, SCHEMA_VERSION, get_schema_version, run_migrations
+from app.models.alert import HerdAlert
+from app.models.archive import MilkArchive
+from app.models.herd import Herd
+from app.models.milk_production import MilkProduction
+from app.models.rollup import MilkMonthlyTotal
 from app.models.user import User
+from app.response_cache import mark_data_changed, response_cache
+from app.rollups import rebuild_rollups
+from app.schemas.herd import Herd as HerdSchema
+from app.schemas.milk_production import MilkProduction as MilkProductionSchema, MilkProductionCreate
+from app.write_coalescer import HerdNotFound, MilkWriteCoalescer, get_milk_write_coalescer
+from benchmark.config import FarmConfig
+from benchmark.generate import generate
 
 # Use an in-memory SQLite database for testing
 SQLALCHEMY_DATABASE_URL = "sqlite+aiosqlite:///:memory:"
 
 engine = create_async_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+    SQLALCHEMY_DATABASE_URL,
+    connect_args={"check_same_thread": False},
+    poolclass=StaticPool,
 )
+instrument_engine(engine, "test")
+# Routes going over their @query_budget fail the test that called them
+install_query_log(engine, budget_mode="raise")
 TestingSessionLocal = sessionmaker(
     autocommit=False, autoflush=False, bind=engine, class_=AsyncSession
 )
@@ -27,8 +78,13 @@ async def override_get_db():
         yield session
 
 
-# Override the get_db dependency in the app
+# Override the get_db and get_read_db dependencies in the app
 app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_read_db] = override_get_db
+
+# Group commits go to the test database as well
+test_write_coalescer = MilkWriteCoalescer(TestingSessionLocal)
+app.dependency_overrides[get_milk_write_coalescer] = lambda: test_write_coalescer
 
 
 @pytest.fixture
@@ -49,6 +105,11 @@ async def test_db():
     
     yield
     
+    # Cached users and responses belong to this test's database
+    user_cache.clear()
+    response_cache.clear()
+    rate_limiter.clear()
+    
     # Drop all tables after the test is complete
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.drop_all)
@@ -141,3 +202,1368 @@ async def test_create_milk_production(client, test_db):
     assert data["herd_id"] == herd_id
     assert data["amount_liters"] == 150.5
     assert data["fat_percentage"] == 3.5
+    
+    # The response is the stored record, the same one GET returns
+    response = client.get(
+        f"/api/milk-production/{data['id']}",
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    assert response.json() == data
+    assert data["date"] == "2025-04-19T10:00:00"
+
+
+@pytest.mark.asyncio
+async def test_create_milk_production_bulk(client, test_db):
+    # First login to get token
+    response = client.post(
+        "/api/auth/token",
+        data={"username": "test@example.com", "password": "password123"},
+    )
+    token = response.json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    
+    # Create a herd
+    response = client.post(
+        "/api/herds/",
+        json={"name": "Test Herd", "cow_count": 10},
+        headers=headers,
+    )
+    herd_id = response.json()["id"]
+    
+    # Two valid rows, one invalid row and one row for a herd we don't own
+    response = client.post(
+        "/api/milk-production/bulk",
+        json=[
+            {"herd_id": herd_id, "date": "2025-04-19T10:00:00Z", "amount_liters": 150.5},
+            {"herd_id": herd_id, "date": "2025-04-20T10:00:00Z", "amount_liters": 148.0},
+            {"herd_id": herd_id, "date": "not a date", "amount_liters": 10},
+            {"herd_id": herd_id + 1, "date": "2025-04-20T10:00:00Z", "amount_liters": 1},
+        ],
+        headers=headers,
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert data["inserted"] == 2
+    assert [error["index"] for error in data["errors"]] == [2, 3]
+    assert data["errors"][1]["detail"] == "Herd not found"
+    
+    response = client.get(
+        f"/api/milk-production/?herd_id={herd_id}", headers=headers
+    )
+    assert len(response.json()) == 2
+
+
+@pytest.mark.asyncio
+async def test_import_milk_production_csv(client, test_db, monkeypatch):
+    # First login to get token
+    response = client.post(
+        "/api/auth/token",
+        data={"username": "test@example.com", "password": "password123"},
+    )
+    token = response.json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    
+    # Create a herd
+    response = client.post(
+        "/api/herds/",
+        json={"name": "Test Herd", "cow_count": 10},
+        headers=headers,
+    )
+    herd_id = response.json()["id"]
+    
+    csv_data = (
+        "herd_id,date,amount_liters,fat_percentage,protein_percentage\n"
+        f"{herd_id},2025-04-19T10:00:00Z,150.5,3.5,\n"
+        f"{herd_id},not a date,150.5,,\n"
+        f"{herd_id},2025-04-20T10:00:00Z,149,,3.1\n"
+    )
+    response = client.post(
+        "/api/milk-production/import",
+        files={"file": ("history.csv", csv_data, "text/csv")},
+        headers=headers,
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert data["processed"] == 3
+    assert data["inserted"] == 2
+    assert data["rejected"] == 1
+    assert data["rejects"][0]["line"] == 3
+    
+    # Batches are parsed off the event loop; every reject is counted, the
+    # first 100 are listed
+    on_loop = []
+    read_batch = milk_import._read_batch
+    
+    def spy(rows, size):
+        try:
+            asyncio.get_running_loop()
+            on_loop.append(True)
+        except RuntimeError:
+            on_loop.append(False)
+        return read_batch(rows, size)
+    
+    monkeypatch.setattr(milk_import, "_read_batch", spy)
+    bad_rows = "".join(f"{herd_id},not a date,1,,\n" for _ in range(150))
+    response = client.post(
+        "/api/milk-production/import",
+        files={"file": ("history.csv", "herd_id,date,amount_liters,fat_percentage,protein_percentage\n" + bad_rows, "text/csv")},
+        headers=headers,
+    )
+    data = response.json()
+    assert data["rejected"] == 150
+    assert len(data["rejects"]) == 100
+    assert on_loop and not any(on_loop)
+
+
+@pytest.mark.asyncio
+async def test_export_milk_production(client, test_db):
+    # First login to get token
+    response = client.post(
+        "/api/auth/token",
+        data={"username": "test@example.com", "password": "password123"},
+    )
+    token = response.json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    
+    # Create a herd with a few records
+    response = client.post(
+        "/api/herds/",
+        json={"name": "Test Herd", "cow_count": 10},
+        headers=headers,
+    )
+    herd_id = response.json()["id"]
+    client.post(
+        "/api/milk-production/bulk",
+        json=[
+            {"herd_id": herd_id, "date": f"2025-04-{day:02d}T10:00:00", "amount_liters": day}
+            for day in range(1, 11)
+        ],
+        headers=headers,
+    )
+    
+    response = client.get(
+        "/api/milk-production/export?format=csv&from=2025-04-03&to=2025-04-05T23:59:59",
+        headers=headers,
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    lines = response.text.strip().splitlines()
+    assert lines[0].startswith("id,herd_id,herd_name,date,amount_liters")
+    assert len(lines) == 4
+    
+    response = client.get(
+        f"/api/milk-production/export?format=ndjson&herd_id={herd_id}",
+        headers=headers,
+    )
+    assert response.status_code == 200
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [row["amount_liters"] for row in rows] == list(range(1, 11))
+    assert rows[0]["herd_name"] == "Test Herd"
+
+
+@pytest.mark.asyncio
+async def test_milk_production_cursor_pagination(client, test_db):
+    # First login to get token
+    response = client.post(
+        "/api/auth/token",
+        data={"username": "test@example.com", "password": "password123"},
+    )
+    token = response.json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    
+    # Create a herd with records inserted out of date order
+    response = client.post(
+        "/api/herds/",
+        json={"name": "Test Herd", "cow_count": 10},
+        headers=headers,
+    )
+    herd_id = response.json()["id"]
+    days = [5, 3, 1, 4, 2, 3]
+    client.post(
+        "/api/milk-production/bulk",
+        json=[
+            {"herd_id": herd_id, "date": f"2025-04-{day:02d}T10:00:00", "amount_liters": day}
+            for day in days
+        ],
+        headers=headers,
+    )
+    
+    seen = []
+    url = f"/api/milk-production/?herd_id={herd_id}&limit=4"
+    response = client.get(url, headers=headers)
+    while True:
+        assert response.status_code == 200
+        seen.extend(record["amount_liters"] for record in response.json())
+        cursor = response.headers.get("x-next-cursor")
+        if not cursor:
+            break
+        response = client.get(f"{url}&cursor={cursor}", headers=headers)
+    assert seen == sorted(days)
+    
+    response = client.get(f"{url}&cursor=garbage", headers=headers)
+    assert response.status_code == 400
+    
+    # Herds page by id
+    client.post("/api/herds/", json={"name": "Second", "cow_count": 5}, headers=headers)
+    response = client.get("/api/herds/?limit=1", headers=headers)
+    cursor = response.headers["x-next-cursor"]
+    response = client.get(f"/api/herds/?limit=1&cursor={cursor}", headers=headers)
+    assert [herd["name"] for herd in response.json()] == ["Second"]
+
+
+@pytest.mark.asyncio
+async def test_list_endpoints_match_response_model(client, test_db):
+    # First login to get token
+    response = client.post(
+        "/api/auth/token",
+        data={"username": "test@example.com", "password": "password123"},
+    )
+    token = response.json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    client.post(
+        "/api/herds/",
+        json={"name": "Kühe am Hang", "cow_count": 10, "location_line1": "Alm 1"},
+        headers=headers,
+    )
+    herd_id = client.post(
+        "/api/herds/", json={"name": "Second", "cow_count": 5}, headers=headers
+    ).json()["id"]
+    client.post(
+        "/api/milk-production/bulk",
+        json=[
+            {"herd_id": herd_id, "date": "2025-04-01T10:00:00", "amount_liters": 120},
+            {
+                "herd_id": herd_id,
+                "date": "2025-04-02T06:30:15.250000",
+                "amount_liters": 98.5,
+                "fat_percentage": 4.1,
+                "protein_percentage": 3.3,
+            },
+        ],
+        headers=headers,
+    )
+    
+    # The lean listings must produce exactly what validating ORM objects
+    # with the response model would
+    async with TestingSessionLocal() as session:
+        herd_objects = (await session.execute(select(Herd).order_by(Herd.id))).scalars().all()
+        record_objects = (
+            await session.execute(select(MilkProduction).order_by(MilkProduction.date))
+        ).scalars().all()
+        herd_adapter = TypeAdapter(List[HerdSchema])
+        record_adapter = TypeAdapter(List[MilkProductionSchema])
+        expected_herds = herd_adapter.dump_json(herd_adapter.validate_python(herd_objects))
+        expected_records = record_adapter.dump_json(
+            record_adapter.validate_python(record_objects)
+        )
+    
+    response = client.get("/api/herds/", headers=headers)
+    assert response.headers["content-type"] == "application/json"
+    assert response.content == expected_herds
+    # Served again from the response cache
+    assert client.get("/api/herds/", headers=headers).content == expected_herds
+    
+    response = client.get("/api/milk-production/", headers=headers)
+    assert response.headers["content-type"] == "application/json"
+    assert response.content == expected_records
+
+
+@pytest.mark.asyncio
+async def test_columnar_list_and_export_formats(client, test_db):
+    pyarrow = pytest.importorskip("pyarrow")
+    # First login to get token
+    response = client.post(
+        "/api/auth/token",
+        data={"username": "test@example.com", "password": "password123"},
+    )
+    token = response.json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    herd_id = client.post(
+        "/api/herds/", json={"name": "Test Herd", "cow_count": 10}, headers=headers
+    ).json()["id"]
+    client.post(
+        "/api/milk-production/bulk",
+        json=[
+            {"herd_id": herd_id, "date": f"2025-04-0{day}T10:00:00", "amount_liters": day * 10}
+            for day in (1, 2, 3)
+        ]
+        + [{"herd_id": herd_id, "date": "2025-04-04T10:00:00", "amount_liters": 5, "fat_percentage": 4.0}],
+        headers=headers,
+    )
+    records = client.get("/api/milk-production/", headers=headers).json()
+    
+    # MessagePack: one array per field
+    response = client.get(
+        "/api/milk-production/?limit=3",
+        headers={**headers, "Accept": "application/msgpack"},
+    )
+    assert response.headers["content-type"] == "application/msgpack"
+    assert "x-next-cursor" in response.headers
+    columns = msgpack.unpackb(response.content, timestamp=3)
+    assert list(columns) == list(records[0])
+    assert columns["amount_liters"] == [10.0, 20.0, 30.0]
+    assert columns["date"][0] == datetime(2025, 4, 1, 10, tzinfo=timezone.utc)
+    
+    # Arrow: typed columns, nulls included
+    response = client.get(
+        "/api/milk-production/",
+        headers={**headers, "Accept": "application/vnd.apache.arrow.stream, application/json;q=0.5"},
+    )
+    assert response.headers["content-type"] == "application/vnd.apache.arrow.stream"
+    table = pyarrow.ipc.open_stream(response.content).read_all()
+    assert table.column_names == list(records[0])
+    assert table.schema.field("date").type == pyarrow.timestamp("us")
+    assert table.column("id").to_pylist() == [record["id"] for record in records]
+    assert table.column("fat_percentage").to_pylist() == [None, None, None, 4.0]
+    
+    # Browsers and plain clients still get JSON
+    response = client.get(
+        "/api/milk-production/", headers={**headers, "Accept": "text/html,*/*;q=0.8"}
+    )
+    assert response.json() == records
+    
+    # Export picks the format from Accept unless ?format= is given
+    response = client.get(
+        "/api/milk-production/export",
+        headers={**headers, "Accept": "application/vnd.apache.arrow.stream"},
+    )
+    assert response.headers["content-type"] == "application/vnd.apache.arrow.stream"
+    table = pyarrow.ipc.open_stream(response.content).read_all()
+    assert table.column("herd_name").to_pylist() == ["Test Herd"] * 4
+    response = client.get("/api/milk-production/export?format=msgpack", headers=headers)
+    chunks = list(msgpack.Unpacker(io.BytesIO(response.content), timestamp=3))
+    assert [amount for chunk in chunks for amount in chunk["amount_liters"]] == [10, 20, 30, 5]
+    response = client.get("/api/milk-production/export", headers=headers)
+    assert response.headers["content-type"].startswith("text/csv")
+
+
+@pytest.mark.asyncio
+async def test_stats_follow_rollups(client, test_db, caplog):
+    # First login to get token
+    response = client.post(
+        "/api/auth/token",
+        data={"username": "test@example.com", "password": "password123"},
+    )
+    token = response.json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    
+    response = client.post(
+        "/api/herds/",
+        json={"name": "Test Herd", "cow_count": 10},
+        headers=headers,
+    )
+    herd_id = response.json()["id"]
+    
+    # Two milkings on one day plus one on another day, a month apart
+    client.post(
+        "/api/milk-production/bulk",
+        json=[
+            {"herd_id": herd_id, "date": "2025-03-31T06:00:00", "amount_liters": 100},
+            {"herd_id": herd_id, "date": "2025-03-31T18:00:00", "amount_liters": 50},
+        ],
+        headers=headers,
+    )
+    response = client.post(
+        "/api/milk-production/",
+        json={"herd_id": herd_id, "date": "2025-04-01T06:00:00", "amount_liters": 90},
+        headers=headers,
+    )
+    record_id = response.json()["id"]
+    
+    response = client.get(f"/api/milk-production/stats?herd_id={herd_id}", headers=headers)
+    data = response.json()
+    assert data["total_liters"] == 240
+    assert data["days_recorded"] == 2
+    assert data["average_per_day"] == 120
+    assert data["liters_per_cow"] == 12
+    
+    # Moving the record onto the first day merges the two days
+    client.put(
+        f"/api/milk-production/{record_id}",
+        json={"herd_id": herd_id, "date": "2025-03-31T12:00:00", "amount_liters": 60},
+        headers=headers,
+    )
+    response = client.get("/api/milk-production/stats", headers=headers)
+    data = response.json()
+    assert data["total_liters"] == 210
+    assert data["days_recorded"] == 1
+    
+    client.delete(f"/api/milk-production/{record_id}", headers=headers)
+    response = client.get(f"/api/milk-production/stats?herd_id={herd_id}", headers=headers)
+    assert response.json()["total_liters"] == 150
+    
+    # Updating the deleted record is a plain 404, not a logged error
+    with caplog.at_level("ERROR", logger="app.api.endpoints.milk_production"):
+        response = client.put(
+            f"/api/milk-production/{record_id}",
+            json={"herd_id": herd_id, "date": "2025-03-31T12:00:00", "amount_liters": 60},
+            headers=headers,
+        )
+    assert response.status_code == 404
+    assert "Error updating milk production" not in caplog.text
+    
+    # A full rebuild agrees with the incrementally maintained tables
+    async with TestingSessionLocal() as session:
+        before = (await session.execute(select(MilkMonthlyTotal.__table__))).all()
+        await rebuild_rollups(session)
+        await session.commit()
+        after = (await session.execute(select(MilkMonthlyTotal.__table__))).all()
+    assert before == after
+
+
+def login_headers(client, email, password):
+    response = client.post("/api/auth/token", data={"username": email, "password": password})
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+async def add_herd_history(client, headers, herd_id):
+    """Records (one of them archived), rollups and an alert for a herd"""
+    client.post(
+        "/api/milk-production/bulk",
+        json=[
+            {"herd_id": herd_id, "date": "2020-06-01T06:00:00", "amount_liters": 20},
+            {"herd_id": herd_id, "date": "2025-03-31T06:00:00", "amount_liters": 999},
+        ],
+        headers=headers,
+    )
+    async with TestingSessionLocal() as session:
+        await archive.archive_milk_productions(session, datetime(2021, 1, 1))
+        session.add(
+            HerdAlert(
+                herd_id=herd_id,
+                day=date(2025, 3, 31),
+                kind="drop",
+                liters_per_cow=10,
+                baseline=100,
+                score=-5,
+            )
+        )
+        await session.commit()
+
+
+def assert_new_herd_is_empty(client, headers, herd_id, archive_dir):
+    response = client.get(f"/api/milk-production/stats?herd_id={herd_id}", headers=headers)
+    assert response.json()["total_liters"] == 0
+    response = client.get("/api/milk-production/series?bucket=month", headers=headers)
+    assert response.json()["points"] == []
+    response = client.get("/api/milk-production/export?format=ndjson", headers=headers)
+    assert response.text == ""
+    assert not (archive_dir / f"herd_{herd_id}").exists()
+    assert client.get(f"/api/herds/{herd_id}/alerts", headers=headers).json() == []
+    summary = client.get("/api/dashboard/summary", headers=headers).json()
+    assert summary["stats"]["total_liters"] == 0
+    assert summary["herds"][0]["total_liters"] == 0
+
+
+@pytest.mark.asyncio
+async def test_deleted_herd_data_not_inherited(client, test_db, tmp_path, monkeypatch):
+    monkeypatch.setattr(archive, "ARCHIVE_DIR", str(tmp_path))
+    headers = login_headers(client, "test@example.com", "password123")
+    response = client.post("/api/herds/", json={"name": "Old Herd", "cow_count": 10}, headers=headers)
+    herd_id = response.json()["id"]
+    await add_herd_history(client, headers, herd_id)
+    assert (tmp_path / f"herd_{herd_id}").exists()
+    assert client.delete(f"/api/herds/{herd_id}", headers=headers).status_code == 200
+    
+    # SQLite hands the freed id to the next herd, here another user's
+    client.post(
+        "/api/auth/register",
+        json={"email": "other@example.com", "password": "password456"},
+    )
+    other = login_headers(client, "other@example.com", "password456")
+    response = client.post("/api/herds/", json={"name": "New Herd", "cow_count": 5}, headers=other)
+    assert response.json()["id"] == herd_id
+    assert_new_herd_is_empty(client, other, herd_id, tmp_path)
+
+
+@pytest.mark.asyncio
+async def test_deleted_account_data_not_inherited(client, test_db, tmp_path, monkeypatch):
+    monkeypatch.setattr(archive, "ARCHIVE_DIR", str(tmp_path))
+    client.post(
+        "/api/auth/register",
+        json={"email": "leaving@example.com", "password": "password456"},
+    )
+    leaving = login_headers(client, "leaving@example.com", "password456")
+    response = client.post("/api/herds/", json={"name": "Old Herd", "cow_count": 10}, headers=leaving)
+    herd_id = response.json()["id"]
+    await add_herd_history(client, leaving, herd_id)
+    assert (tmp_path / f"herd_{herd_id}").exists()
+    # The account's herds are deleted with it
+    assert client.delete("/api/users/", headers=leaving).status_code == 200
+    
+    headers = login_headers(client, "test@example.com", "password123")
+    response = client.post("/api/herds/", json={"name": "New Herd", "cow_count": 5}, headers=headers)
+    assert response.json()["id"] == herd_id
+    assert_new_herd_is_empty(client, headers, herd_id, tmp_path)
+
+
+@pytest.mark.asyncio
+async def test_archived_years_stay_in_stats_and_export(client, test_db, tmp_path, monkeypatch):
+    monkeypatch.setattr(archive, "ARCHIVE_DIR", str(tmp_path))
+    # First login to get token
+    response = client.post(
+        "/api/auth/token",
+        data={"username": "test@example.com", "password": "password123"},
+    )
+    token = response.json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    herd_ids = [
+        client.post("/api/herds/", json={"name": name, "cow_count": 10}, headers=headers).json()["id"]
+        for name in ("North", "South")
+    ]
+    client.post(
+        "/api/milk-production/bulk",
+        json=[
+            {"herd_id": herd_ids[0], "date": "2019-06-01T06:00:00", "amount_liters": 10, "fat_percentage": 4.0},
+            {"herd_id": herd_ids[1], "date": "2019-06-01T05:00:00", "amount_liters": 20},
+            {"herd_id": herd_ids[0], "date": "2020-12-31T23:00:00", "amount_liters": 30},
+            {"herd_id": herd_ids[1], "date": "2021-01-01T00:00:00", "amount_liters": 40},
+            {"herd_id": herd_ids[0], "date": "2025-04-01T06:00:00", "amount_liters": 50},
+        ],
+        headers=headers,
+    )
+    stats_url = "/api/milk-production/stats"
+    stats_before = client.get(stats_url, headers=headers).json()
+    export_before = client.get("/api/milk-production/export", headers=headers).text
+    
+    assert archive.archive_cutoff(date(2023, 3, 1), horizon_days=730) == datetime(2021, 1, 1)
+    async with TestingSessionLocal() as session:
+        result = await archive.archive_milk_productions(session, datetime(2021, 1, 1))
+    assert (result.herd_years, result.records) == (3, 3)
+    
+    # Only the recent records are left in the table (and its listing)
+    listed = client.get("/api/milk-production/", headers=headers).json()
+    assert [record["amount_liters"] for record in listed] == [40, 50]
+    
+    response_cache.clear()
+    assert client.get(stats_url, headers=headers).json() == stats_before
+    assert client.get("/api/milk-production/export", headers=headers).text == export_before
+    response = client.get(
+        f"/api/milk-production/export?format=ndjson&herd_id={herd_ids[0]}&from=2019-01-01&to=2020-12-31T23:59:59",
+        headers=headers,
+    )
+    exported = [json.loads(line) for line in response.text.splitlines()]
+    assert [(row["amount_liters"], row["fat_percentage"]) for row in exported] == [(10, 4.0), (30, None)]
+    
+    # A record added later to an archived year is merged into a new file
+    client.post(
+        "/api/milk-production/",
+        json={"herd_id": herd_ids[0], "date": "2019-01-15T06:00:00", "amount_liters": 5},
+        headers=headers,
+    )
+    async with TestingSessionLocal() as session:
+        await archive.archive_milk_productions(session, datetime(2021, 1, 1))
+        entry = await session.get(MilkArchive, (herd_ids[0], 2019))
+        assert entry.record_count == 2
+        assert len(list(tmp_path.glob(f"herd_{herd_ids[0]}/2019-*"))) == 1
+    
+        # Rebuilding the rollups counts the archived records too
+        before = (await session.execute(select(MilkMonthlyTotal.__table__))).all()
+        await rebuild_rollups(session)
+        await session.commit()
+        after = (await session.execute(select(MilkMonthlyTotal.__table__))).all()
+    assert sorted(before) == sorted(after)
+    
+    # Export rows interleave when a herd-year overlaps the hot table
+    async def chunks(*batches):
+        for batch in batches:
+            yield batch
+    
+    key = lambda row: row
+    merged = [
+        chunk
+        async for chunk in merge_sorted_chunks(chunks([1, 2], [5, 8]), chunks([3], [4, 6, 9]), key)
+    ]
+    assert [value for chunk in merged for value in chunk] == [1, 2, 3, 4, 5, 6, 8, 9]
+    assert merged[0] == [1, 2]
+
+
+@pytest.mark.asyncio
+async def test_milk_production_series(client, test_db):
+    # First login to get token
+    response = client.post(
+        "/api/auth/token",
+        data={"username": "test@example.com", "password": "password123"},
+    )
+    token = response.json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    
+    response = client.post(
+        "/api/herds/",
+        json={"name": "Test Herd", "cow_count": 10},
+        headers=headers,
+    )
+    herd_id = response.json()["id"]
+    
+    # 2025-03-03 is a Monday; leave 2025-03-05 out to check gaps
+    rows = [
+        {"herd_id": herd_id, "date": f"2025-03-{day:02d}T06:00:00", "amount_liters": day * 10, "fat_percentage": 4.0}
+        for day in (3, 4, 6, 7, 8, 9, 10)
+    ]
+    client.post("/api/milk-production/bulk", json=rows, headers=headers)
+    
+    response = client.get(
+        f"/api/milk-production/series?herd_id={herd_id}&bucket=day&from=2025-03-01",
+        headers=headers,
+    )
+    assert response.status_code == 200
+    points = response.json()["points"]
+    assert [point["period_start"] for point in points][:3] == ["2025-03-03", "2025-03-04", "2025-03-06"]
+    # Trailing 7 days ending 2025-03-09 cover 3, 4, 6, 7, 8, 9
+    assert points[5]["moving_average_7d"] == pytest.approx((30 + 40 + 60 + 70 + 80 + 90) / 6)
+    # ...and ending 2025-03-10 drop the 3rd
+    assert points[6]["moving_average_7d"] == pytest.approx((40 + 60 + 70 + 80 + 90 + 100) / 6)
+    assert points[0]["liters_per_cow"] == 3
+    assert points[0]["fat_percentage"] == 4.0
+    
+    response = client.get(
+        f"/api/milk-production/series?herd_id={herd_id}&bucket=week",
+        headers=headers,
+    )
+    points = response.json()["points"]
+    assert [point["period_start"] for point in points] == ["2025-03-03", "2025-03-10"]
+    assert points[0]["total_liters"] == 30 + 40 + 60 + 70 + 80 + 90
+    assert points[0]["days_recorded"] == 6
+    
+    response = client.get("/api/milk-production/series?bucket=year", headers=headers)
+    assert response.status_code == 400
+
+
+def test_detect_anomalies_flags_drops_and_shifts():
+    rng = np.random.default_rng(0)
+    values = 30 + rng.normal(0, 0.5, (4, 90))
+    values[0, 50] = 18  # one bad day
+    values[1, 60:] -= 8  # lasting drop in yield
+    values[2, ::3] = np.nan  # gaps are skipped, not treated as zero
+    values[3, :] = np.nan  # no cow count
+    found = detect_anomalies(values)
+    flagged = set(zip(found.herds.tolist(), found.days.tolist(), found.kinds.tolist()))
+    assert (0, 50, 0) in flagged
+    assert (1, 60, 1) in flagged
+    assert not any(herd in (2, 3) for herd, _, _ in flagged)
+    # A single bad day is not a level shift
+    assert not any(herd == 0 and kind == 1 for herd, _, kind in flagged)
+
+
+@pytest.mark.asyncio
+async def test_herd_alerts(client, test_db):
+    # First login to get token
+    response = client.post(
+        "/api/auth/token",
+        data={"username": "test@example.com", "password": "password123"},
+    )
+    token = response.json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    herd_id = client.post(
+        "/api/herds/", json={"name": "Test Herd", "cow_count": 10}, headers=headers
+    ).json()["id"]
+    
+    # 40 days around 300 liters, then one day at 200
+    start = date(2025, 1, 1)
+    amounts = [300 + (day % 5) for day in range(40)] + [200, 302]
+    client.post(
+        "/api/milk-production/bulk",
+        json=[
+            {"herd_id": herd_id, "date": f"{start + timedelta(days=day)}T06:00:00", "amount_liters": amount}
+            for day, amount in enumerate(amounts)
+        ],
+        headers=headers,
+    )
+    async with TestingSessionLocal() as session:
+        today = start + timedelta(days=len(amounts))
+        assert await run_anomaly_detection(session, today=today, lookback_days=60) == 1
+        # Re-running replaces the alerts instead of adding duplicates
+        assert await run_anomaly_detection(session, today=today, lookback_days=60) == 1
+    
+    response = client.get(f"/api/herds/{herd_id}/alerts", headers=headers)
+    assert response.status_code == 200
+    (alert,) = response.json()
+    assert alert["day"] == "2025-02-10"
+    assert alert["kind"] == "drop"
+    assert alert["liters_per_cow"] == 20
+    assert alert["baseline"] == pytest.approx(30.2, abs=0.1)
+    assert alert["score"] < -3
+    
+    response = client.get(f"/api/herds/{herd_id}/alerts?since=2025-03-01", headers=headers)
+    assert response.json() == []
+    assert client.get("/api/herds/9999/alerts", headers=headers).status_code == 404
+    
+    # A block of herds without any rollups in the window flags nothing
+    async with TestingSessionLocal() as session:
+        assert await run_anomaly_detection(session, today=date(2026, 1, 1), lookback_days=60) == 0
+
+
+@pytest.mark.asyncio
+async def test_current_user_cache(client, test_db):
+    # First login to get token
+    response = client.post(
+        "/api/auth/token",
+        data={"username": "test@example.com", "password": "password123"},
+    )
+    token = response.json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    
+    hits = user_cache.hits
+    client.get("/api/users/me", headers=headers)
+    response = client.get("/api/users/me", headers=headers)
+    assert response.json()["membership_type"] == "free"
+    assert user_cache.hits == hits + 1
+    
+    # Changes made through a cached user are persisted and invalidate it
+    response = client.put("/api/users/membership?membership_type=annual", headers=headers)
+    assert response.json()["membership_type"] == "annual"
+    response = client.get("/api/users/me", headers=headers)
+    assert response.json()["membership_type"] == "annual"
+    
+    # A token for a changed email no longer resolves
+    client.put("/api/users/profile", json={"email": "new@example.com"}, headers=headers)
+    response = client.get("/api/users/me", headers=headers)
+    assert response.status_code == 401
+    
+    response = client.get("/health")
+    assert response.json()["user_cache"]["hits"] == user_cache.hits
+
+
+@pytest.mark.asyncio
+async def test_password_hashing_runs_on_pool(client, test_db):
+    completed = password_hashing_pool.stats()["completed"]
+    response = client.post(
+        "/api/auth/token",
+        data={"username": "test@example.com", "password": "password123"},
+    )
+    assert response.status_code == 200
+    
+    stats = client.get("/health").json()["password_hashing"]
+    assert stats["completed"] == completed + 1
+    assert stats["queued"] == 0
+    assert stats["running"] == 0
+
+
+@pytest.mark.asyncio
+async def test_production_sqlite_pragmas(tmp_path):
+    url = f"sqlite+aiosqlite:///{tmp_path / 'profile.db'}"
+    writer = configure_sqlite_pragmas(create_async_engine(url))
+    reader = configure_sqlite_pragmas(create_async_engine(url), read_only=True)
+    try:
+        async with writer.begin() as conn:
+            assert (await conn.exec_driver_sql("PRAGMA journal_mode")).scalar() == "wal"
+            assert (await conn.exec_driver_sql("PRAGMA synchronous")).scalar() == 1
+            await conn.exec_driver_sql("CREATE TABLE t (x INTEGER)")
+        
+        async with reader.connect() as conn:
+            await conn.exec_driver_sql("SELECT * FROM t")
+            with pytest.raises(OperationalError):
+                await conn.exec_driver_sql("INSERT INTO t VALUES (1)")
+    finally:
+        await writer.dispose()
+        await reader.dispose()
+
+
+@pytest.mark.asyncio
+async def test_migrations_upgrade_legacy_database(tmp_path):
+    url = f"sqlite+aiosqlite:///{tmp_path / 'legacy.db'}"
+    engines = [create_async_engine(url), create_async_engine(url)]
+    try:
+        # Schema from before username and herd locations were added
+        async with engines[0].begin() as conn:
+            await conn.exec_driver_sql(
+                "CREATE TABLE users (id INTEGER PRIMARY KEY, email VARCHAR, "
+                "hashed_password VARCHAR, is_active BOOLEAN, membership_type VARCHAR, "
+                "created_at DATETIME)"
+            )
+            await conn.exec_driver_sql(
+                "CREATE TABLE herds (id INTEGER PRIMARY KEY, name VARCHAR, "
+                "cow_count INTEGER, created_at DATETIME, user_id INTEGER)"
+            )
+        
+        # Two processes starting together apply each step exactly once
+        results = await asyncio.gather(*(run_migrations(e) for e in engines))
+        assert sorted(results) == [[], [version for version, _, _ in MIGRATIONS]]
+        assert await run_migrations(engines[0]) == []
+        
+        async with engines[0].connect() as conn:
+            assert await get_schema_version(conn) == SCHEMA_VERSION
+            columns = await conn.exec_driver_sql("PRAGMA table_info(herds)")
+            assert "location_line1" in [row[1] for row in columns]
+            indexes = await conn.exec_driver_sql("PRAGMA index_list(herds)")
+            assert "ix_herds_user_id" in [row[1] for row in indexes]
+    finally:
+        for e in engines:
+            await e.dispose()
+
+
+@pytest.mark.asyncio
+async def test_migration_removes_archive_files_after_commit(tmp_path, monkeypatch):
+    monkeypatch.setattr("app.migrations.ARCHIVE_DIR", str(tmp_path))
+    migration_engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'old.db'}")
+    try:
+        await run_migrations(migration_engine)
+        # An archive of a herd deleted before migration 8 existed
+        async with migration_engine.begin() as conn:
+            await conn.exec_driver_sql(
+                "INSERT INTO milk_archives (herd_id, year, path, record_count) "
+                "VALUES (99, 2020, 'herd_99/2020-abc', 1)"
+            )
+            await conn.exec_driver_sql("PRAGMA user_version = 7")
+        (tmp_path / "herd_99" / "2020-abc").mkdir(parents=True)
+        
+        # A later step fails: nothing is committed, so the files must stay
+        async def fail(conn):
+            raise RuntimeError("step failed")
+        
+        failing = [
+            (version, description, fail if version == 9 else step)
+            for version, description, step in MIGRATIONS
+        ]
+        monkeypatch.setattr("app.migrations.MIGRATIONS", failing)
+        with pytest.raises(RuntimeError):
+            await run_migrations(migration_engine)
+        assert (tmp_path / "herd_99" / "2020-abc").exists()
+        
+        monkeypatch.setattr("app.migrations.MIGRATIONS", MIGRATIONS)
+        assert await run_migrations(migration_engine) == [8, 9, 10]
+        assert not (tmp_path / "herd_99" / "2020-abc").exists()
+        async with migration_engine.connect() as conn:
+            result = await conn.exec_driver_sql("SELECT count(*) FROM milk_archives")
+            assert result.scalar() == 0
+    finally:
+        await migration_engine.dispose()
+
+
+def test_secret_key_file_shared_between_processes(tmp_path):
+    # Workers starting at the same time must all end up with the same key
+    path = str(tmp_path / ".secret_key")
+    with multiprocessing.get_context("spawn").Pool(4) as pool:
+        keys = pool.starmap(read_or_create, [(path, secrets.token_hex)] * 8)
+    assert len(set(keys)) == 1
+    assert len(keys[0]) == 64
+    assert os.stat(path).st_mode & 0o777 == 0o600
+    assert read_or_create(path, secrets.token_hex) == keys[0]
+    
+    # A truncated key file stops the server instead of signing with ""
+    empty = tmp_path / ".empty_key"
+    empty.write_text("")
+    with pytest.raises(RuntimeError):
+        read_or_create(str(empty), secrets.token_hex)
+
+
+@pytest.mark.asyncio
+async def test_benchmark_generator_is_deterministic(tmp_path):
+    config = FarmConfig(users=2, herds_per_user=2, days=3)
+    snapshots = []
+    for name in ("a.db", "b.db"):
+        counts = await generate(str(tmp_path / name), config)
+        assert counts == {"users": 2, "herds": 4, "milk_productions": 24}
+        bench_engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / name}")
+        async with bench_engine.connect() as conn:
+            result = await conn.exec_driver_sql(
+                "SELECT herd_id, date, amount_liters, fat_percentage FROM milk_productions"
+            )
+            snapshots.append(result.all())
+        await bench_engine.dispose()
+    assert snapshots[0] == snapshots[1]
+
+
+@pytest.mark.asyncio
+async def test_write_coalescer_group_commit(client, test_db):
+    # First login to get token
+    response = client.post(
+        "/api/auth/token",
+        data={"username": "test@example.com", "password": "password123"},
+    )
+    token = response.json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    response = client.post(
+        "/api/herds/",
+        json={"name": "Test Herd", "cow_count": 10},
+        headers=headers,
+    )
+    herd_id = response.json()["id"]
+    user_id = client.get("/api/users/me", headers=headers).json()["id"]
+    
+    coalescer = MilkWriteCoalescer(TestingSessionLocal, max_batch=20, max_delay=0.01)
+    records = [
+        MilkProductionCreate(herd_id=herd_id, date=f"2025-04-{day:02d}T10:00:00", amount_liters=day)
+        for day in range(1, 31)
+    ]
+    rows = await asyncio.gather(*(coalescer.submit(record, user_id) for record in records))
+    await coalescer.close()
+    
+    assert len({row.id for row in rows}) == 30
+    assert coalescer.stats()["batches"] == 2
+    assert coalescer.stats()["max_batch"] == 20
+    
+    response = client.get(f"/api/milk-production/stats?herd_id={herd_id}", headers=headers)
+    assert response.json()["total_liters"] == sum(range(1, 31))
+    
+    # Batch logs list the requests in the batch, not the one that happened
+    # to start the background task
+    async def submit_as(rid, record):
+        request_id.set(rid)
+        return await coalescer.submit(record, user_id)
+    
+    class Collect(logging.Handler):
+        def emit(self, record):
+            records.append(record)
+    
+    records = []
+    handler = Collect()
+    handler.addFilter(RequestIdFilter())
+    coalescer_logger = logging.getLogger("app.write_coalescer")
+    coalescer_logger.addHandler(handler)
+    coalescer_logger.setLevel(logging.DEBUG)
+    coalescer = MilkWriteCoalescer(TestingSessionLocal, max_batch=20, max_delay=0.01)
+    try:
+        await asyncio.gather(
+            submit_as("first", MilkProductionCreate(herd_id=herd_id, date="2025-05-01T10:00:00", amount_liters=1)),
+            submit_as("second", MilkProductionCreate(herd_id=herd_id, date="2025-05-02T10:00:00", amount_liters=2)),
+        )
+        await coalescer.close()
+    finally:
+        coalescer_logger.removeHandler(handler)
+        coalescer_logger.setLevel(logging.NOTSET)
+    (record,) = records
+    assert record.getMessage() == "Milk write batch committed"
+    assert record.request_id is None
+    assert sorted(record.request_ids) == ["first", "second"]
+    
+    # Ownership is checked again when the batch is written: a record for a
+    # herd that was deleted, or isn't the submitter's, fails on its own
+    response = client.post(
+        "/api/herds/",
+        json={"name": "Other Herd", "cow_count": 5},
+        headers=headers,
+    )
+    other_herd_id = response.json()["id"]
+    client.delete(f"/api/herds/{herd_id}", headers=headers)
+    coalescer = MilkWriteCoalescer(TestingSessionLocal, max_batch=20, max_delay=0.01)
+    results = await asyncio.gather(
+        coalescer.submit(MilkProductionCreate(herd_id=herd_id, date="2025-06-01T10:00:00", amount_liters=1), user_id),
+        coalescer.submit(MilkProductionCreate(herd_id=other_herd_id, date="2025-06-01T10:00:00", amount_liters=2), user_id + 1),
+        coalescer.submit(MilkProductionCreate(herd_id=other_herd_id, date="2025-06-01T10:00:00", amount_liters=3), user_id),
+        return_exceptions=True,
+    )
+    await coalescer.close()
+    assert isinstance(results[0], HerdNotFound)
+    assert isinstance(results[1], HerdNotFound)
+    assert results[2].day_total_liters == 3
+    assert coalescer.stats()["batches"] == 1
+
+
+@pytest.mark.asyncio
+async def test_stats_and_herds_etag(client, test_db, tmp_path, monkeypatch):
+    # First login to get token
+    response = client.post(
+        "/api/auth/token",
+        data={"username": "test@example.com", "password": "password123"},
+    )
+    token = response.json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    response = client.post(
+        "/api/herds/",
+        json={"name": "Test Herd", "cow_count": 10},
+        headers=headers,
+    )
+    herd_id = response.json()["id"]
+    
+    response = client.get("/api/milk-production/stats", headers=headers)
+    etag = response.headers["etag"]
+    assert response.json()["total_liters"] == 0
+    
+    response = client.get(
+        "/api/milk-production/stats", headers={**headers, "If-None-Match": etag}
+    )
+    assert response.status_code == 304
+    
+    # Other query parameters have their own ETag
+    response = client.get(
+        "/api/milk-production/stats?time_span=week", headers={**headers, "If-None-Match": etag}
+    )
+    assert response.status_code == 200
+    
+    # A write bumps the user's data version
+    client.post(
+        "/api/milk-production/",
+        json={"herd_id": herd_id, "date": "2025-04-19T10:00:00Z", "amount_liters": 150.5},
+        headers=headers,
+    )
+    response = client.get(
+        "/api/milk-production/stats", headers={**headers, "If-None-Match": etag}
+    )
+    assert response.status_code == 200
+    assert response.json()["total_liters"] == 150.5
+    assert response.headers["etag"] != etag
+    
+    response = client.get("/api/herds/", headers=headers)
+    etag = response.headers["etag"]
+    response = client.get("/api/herds/", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 304
+    client.put(
+        f"/api/herds/{herd_id}",
+        json={"name": "Renamed", "cow_count": 10},
+        headers=headers,
+    )
+    response = client.get("/api/herds/", headers={**headers, "If-None-Match": etag})
+    assert response.json()[0]["name"] == "Renamed"
+    
+    # Writes by the command-line tools make every cached response stale
+    changed_path = str(tmp_path / "test.db.changed")
+    monkeypatch.setattr(response_cache, "changed_path", changed_path)
+    etag = client.get("/api/herds/", headers=headers).headers["etag"]
+    response = client.get("/api/herds/", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 304
+    mark_data_changed(changed_path)
+    response = client.get("/api/herds/", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+
+
+def parse_events(messages):
+    events = []
+    for message in messages:
+        lines = dict(line.split(": ", 1) for line in message.decode().strip().split("\n"))
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+@pytest.mark.asyncio
+async def test_event_stream_notices(client, test_db, monkeypatch):
+    # First login to get token
+    response = client.post(
+        "/api/auth/token",
+        data={"username": "test@example.com", "password": "password123"},
+    )
+    token = response.json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    user_id = client.get("/api/users/me", headers=headers).json()["id"]
+    
+    queue = event_broker.subscribe(user_id)
+    try:
+        response = client.post(
+            "/api/herds/",
+            json={"name": "Test Herd", "cow_count": 10},
+            headers=headers,
+        )
+        herd_id = response.json()["id"]
+        for liters in (100.0, 50.5):
+            client.post(
+                "/api/milk-production/",
+                json={"herd_id": herd_id, "date": "2025-04-19T10:00:00", "amount_liters": liters},
+                headers=headers,
+            )
+        client.post(
+            "/api/milk-production/bulk",
+            json=[
+                {"herd_id": herd_id, "date": "2025-04-19T18:00:00", "amount_liters": 20},
+                {"herd_id": herd_id, "date": "2025-04-20T06:00:00", "amount_liters": 30},
+            ],
+            headers=headers,
+        )
+        messages = [queue.get_nowait() for _ in range(queue.qsize())]
+    finally:
+        event_broker.unsubscribe(user_id, queue)
+    
+    events = parse_events(messages)
+    assert events[0] == ("herd", {"action": "created", "herd_id": herd_id})
+    total = {"herd_id": herd_id, "day": "2025-04-19", "total_liters": 150.5, "record_count": 2}
+    assert events[2] == (
+        "milk_production",
+        {"action": "created", "herd_ids": [herd_id], "totals": [total]},
+    )
+    assert events[3][1]["totals"] == [
+        {**total, "total_liters": 170.5, "record_count": 3},
+        {"herd_id": herd_id, "day": "2025-04-20", "total_liters": 30.0, "record_count": 1},
+    ]
+    assert event_broker.stats()["subscribers"] == 0
+    
+    # A subscriber that falls behind gets one resync notice instead
+    broker = EventBroker(queue_size=2, heartbeat=0.01, max_duration=0.2)
+    stream = broker.stream(user_id)
+    assert (await anext(stream)).startswith(b"retry: ")
+    assert parse_events([await anext(stream)]) == [("ready", {})]
+    for index in range(3):
+        broker.publish(user_id, "herd", {"action": "updated", "herd_id": index})
+    assert parse_events([await anext(stream)]) == [("resync", {})]
+    assert await anext(stream) == b": heartbeat\n\n"
+    # Ends after max_duration so the client reconnects with a fresh token
+    assert set([message async for message in stream]) == {b": heartbeat\n\n"}
+    assert broker.stats()["resyncs"] == 1
+    assert broker.stats()["subscribers"] == 0
+    
+    # EventSource can't send headers, so a short-lived stream token goes in
+    # the query string; the login token is refused there
+    assert client.get("/api/events").status_code == 401
+    assert client.get(f"/api/events?token={token}").status_code == 401
+    response = client.post("/api/events/token", headers=headers)
+    assert response.status_code == 200
+    stream_token = response.json()["token"]
+    assert response.json()["expires_in"] == 60
+    # ... and the stream token opens nothing else
+    stream_headers = {"Authorization": f"Bearer {stream_token}"}
+    assert client.get("/api/users/me", headers=stream_headers).status_code == 401
+    monkeypatch.setattr(event_broker, "max_duration", 0.1)
+    response = client.get(f"/api/events?token={stream_token}")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert b"event: ready" in response.content
+
+
+@pytest.mark.asyncio
+async def test_event_notices_shared_between_workers(tmp_path):
+    shared_engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'events.db'}")
+    await run_migrations(shared_engine)
+    first, second = EventBroker(share_interval=1), EventBroker(share_interval=1)
+    try:
+        # Both workers start from the notices already in the table
+        for broker in (first, second):
+            await broker.exchange(shared_engine)
+        queue = second.subscribe(1)
+        first.start_sharing(shared_engine)
+        first.publish(1, "herd", {"action": "created", "herd_id": 5})
+        first.publish(2, "herd", {"action": "created", "herd_id": 6})
+        # Written out on the next round; stop_sharing flushes the rest
+        await first.stop_sharing()
+        assert first.stats()["shared"] == 2
+        
+        await second.exchange(shared_engine)
+        assert parse_events([queue.get_nowait()]) == [
+            ("herd", {"action": "created", "herd_id": 5})
+        ]
+        assert queue.empty()
+        assert second.stats()["received"] == 1
+        # Nothing is delivered twice, nor back to the worker that wrote it
+        await second.exchange(shared_engine)
+        await first.exchange(shared_engine)
+        assert queue.empty()
+        assert first.stats()["received"] == 0
+    finally:
+        await shared_engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_rate_limits_and_write_shedding(client, test_db, monkeypatch):
+    # First login to get token
+    response = client.post(
+        "/api/auth/token",
+        data={"username": "test@example.com", "password": "password123"},
+    )
+    token = response.json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    
+    slow = RateBudget(per_second=1 / 60, burst=2)
+    monkeypatch.setattr(rate_limiter, "budgets", {"read": slow, "write": slow, "auth": slow})
+    monkeypatch.setattr(rate_limiter, "ip_factor", 2)
+    
+    # Logins are limited per address
+    login = {"username": "test@example.com", "password": "wrong"}
+    assert client.post("/api/auth/token", data=login).status_code != 429
+    assert client.post("/api/auth/token", data=login).status_code != 429
+    response = client.post("/api/auth/token", data=login)
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "60"
+    
+    # Reads are charged to the user and, at twice the budget, the address
+    assert client.get("/api/herds/", headers=headers).status_code == 200
+    assert client.get("/api/herds/", headers=headers).status_code == 200
+    assert client.get("/api/herds/", headers=headers).status_code == 429
+    assert client.get("/api/herds/").status_code == 401
+    assert client.get("/api/herds/").status_code == 401
+    assert client.get("/api/herds/").status_code == 429
+    # Writes have their own buckets; paths outside /api aren't limited
+    response = client.post(
+        "/api/herds/",
+        json={"name": "Test Herd", "cow_count": 10},
+        headers=headers,
+    )
+    assert response.status_code == 200
+    assert client.get("/health").json()["rate_limit"]["read_limited"] == 2
+    
+    # Past the write concurrency limit requests are shed, not queued
+    release = asyncio.Event()
+    
+    async def api(scope, receive, send):
+        if scope["method"] == "POST":
+            await release.wait()
+        await JSONResponse({"ok": True})(scope, receive, send)
+    
+    writes = ConcurrencyLimiter(1)
+    middleware = RateLimitMiddleware(api, limiter=RateLimiter(RATE_BUDGETS), writes=writes)
+    transport = httpx.ASGITransport(app=middleware)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+        first = asyncio.create_task(http.post("/api/milk-production/"))
+        while writes.in_flight == 0:
+            await asyncio.sleep(0.001)
+        response = await http.post("/api/milk-production/")
+        assert response.status_code == 429
+        assert response.headers["Retry-After"] == "1"
+        assert (await http.get("/api/herds/")).status_code == 200
+        release.set()
+        assert (await first).status_code == 200
+    assert writes.stats() == {"limit": 1, "in_flight": 0, "max_in_flight": 1, "shed": 1}
+
+
+@pytest.mark.asyncio
+async def test_dashboard_summary(client, test_db):
+    # First login to get token
+    response = client.post(
+        "/api/auth/token",
+        data={"username": "test@example.com", "password": "password123"},
+    )
+    token = response.json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    herd_ids = []
+    for name, cow_count in (("North", 10), ("South", 5)):
+        response = client.post(
+            "/api/herds/",
+            json={"name": name, "cow_count": cow_count},
+            headers=headers,
+        )
+        herd_ids.append(response.json()["id"])
+    
+    # Both herds record on the same day, only the first on the next
+    client.post(
+        "/api/milk-production/bulk",
+        json=[
+            {"herd_id": herd_ids[0], "date": "2025-03-31T06:00:00", "amount_liters": 100},
+            {"herd_id": herd_ids[1], "date": "2025-03-31T06:00:00", "amount_liters": 40},
+            {"herd_id": herd_ids[0], "date": "2025-04-01T06:00:00", "amount_liters": 80},
+        ],
+        headers=headers,
+    )
+    
+    response = client.get("/api/dashboard/summary?recent_limit=2", headers=headers)
+    assert response.status_code == 200
+    data = response.json()
+    assert [herd["name"] for herd in data["herds"]] == ["North", "South"]
+    assert data["herds"][0]["total_liters"] == 180
+    assert data["herds"][0]["liters_per_cow"] == 9
+    assert data["herds"][1]["days_recorded"] == 1
+    assert data["stats"]["total_liters"] == 220
+    assert data["stats"]["days_recorded"] == 2
+    assert [record["amount_liters"] for record in data["recent_records"]] == [80, 40]
+    
+    response = client.get(f"/api/dashboard/summary?herd_id={herd_ids[1]}", headers=headers)
+    data = response.json()
+    assert data["stats"]["total_liters"] == 40
+    assert data["stats"]["liters_per_cow"] == 8
+    assert [record["herd_id"] for record in data["recent_records"]] == [herd_ids[1]]
+    
+    response = client.get("/api/dashboard/summary?herd_id=999", headers=headers)
+    assert response.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_metrics_endpoint(client, test_db):
+    # First login to get token
+    response = client.post(
+        "/api/auth/token",
+        data={"username": "test@example.com", "password": "password123"},
+    )
+    token = response.json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    response = client.post(
+        "/api/herds/",
+        json={"name": "Test Herd", "cow_count": 10},
+        headers=headers,
+    )
+    herd_id = response.json()["id"]
+    client.get(f"/api/herds/{herd_id}", headers=headers)
+    
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    body = response.text
+    # Routes are labelled by their template, not the concrete path
+    assert 'http_request_duration_seconds_count{method="GET",route="/api/herds/{herd_id}"}' in body
+    assert 'http_requests_total{method="POST",route="/api/auth/token",status="200"}' in body
+    assert "http_requests_in_progress" in body
+    assert 'http_request_db_queries_count{route="/api/herds/{herd_id}"}' in body
+    assert 'db_queries_total{engine="test"}' in body
+    assert 'thread_pool_task_seconds_count{pool="password-hashing"}' in body
+    assert 'app_component_stat{component="response_cache",stat="hits"}' in body
+    
+    (db_queries,) = [
+        float(line.split()[-1])
+        for line in body.splitlines()
+        if line.startswith('http_request_db_queries_sum{route="/api/herds/{herd_id}"}')
+    ]
+    assert db_queries >= 1
+
+
+@pytest.mark.asyncio
+async def test_query_budget_and_slow_query_log(client, test_db, monkeypatch, caplog):
+    # First login to get token
+    response = client.post(
+        "/api/auth/token",
+        data={"username": "test@example.com", "password": "password123"},
+    )
+    token = response.json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    response = client.post(
+        "/api/herds/",
+        json={"name": "Test Herd", "cow_count": 10},
+        headers=headers,
+    )
+    herd_id = response.json()["id"]
+    
+    # Loading the user and then the herd is two queries
+    user_cache.clear()
+    assert client.get(f"/api/herds/{herd_id}", headers=headers).status_code == 200
+    monkeypatch.setattr(herds.read_herd, "query_budget", 1)
+    user_cache.clear()
+    with pytest.raises(QueryBudgetExceeded, match="more than its budget of 1"):
+        client.get(f"/api/herds/{herd_id}", headers=headers)
+    
+    slow_engine = install_query_log(
+        create_async_engine("sqlite+aiosqlite:///:memory:"), slow_query_ms=0
+    )
+    with caplog.at_level("WARNING", logger="app.query_log"):
+        async with slow_engine.connect() as conn:
+            await conn.exec_driver_sql("SELECT ?", ("slow@example.com",))
+    await slow_engine.dispose()
+    assert "Slow query" in caplog.text
+    assert "slow@example.com" in caplog.text
+
+
+@pytest.mark.asyncio
+async def test_request_id_and_json_logging(client, test_db, monkeypatch):
+    response = client.get("/health")
+    generated = response.headers["X-Request-ID"]
+    assert len(generated) == 32
+    response = client.get("/health", headers={"X-Request-ID": "upstream-42"})
+    assert response.headers["X-Request-ID"] == "upstream-42"
+    
+    token = request_id.set("abc123")
+    try:
+        record = logging.LogRecord("app.test", logging.INFO, "", 0, "Saved %s", ("herd",), None)
+        record.herd_id = 7
+        RequestIdFilter().filter(record)
+    finally:
+        request_id.reset(token)
+    entry = json.loads(JsonFormatter().format(record))
+    assert entry["message"] == "Saved herd"
+    assert entry["request_id"] == "abc123"
+    assert entry["herd_id"] == 7
+    
+    # Past the per-second budget records of the same template are dropped,
+    # errors are not
+    sampler = SamplingFilter(per_second=2)
+    make = lambda level: logging.LogRecord("app.test", level, "", 0, "tick", (), None)
+    passed = [sampler.filter(make(logging.INFO)) for _ in range(5)]
+    assert passed.count(True) == 2
+    assert sampler.filter(make(logging.ERROR))
+    
+    # Windows of past seconds are dropped, except those with a count to report
+    clock = [1000.0]
+    monkeypatch.setattr("app.logging_config.time.monotonic", lambda: clock[0])
+    sampler = SamplingFilter(per_second=2)
+    for index in range(100):
+        sampler.filter(logging.LogRecord("app.test", logging.INFO, "", 0, f"herd {index}", (), None))
+    for _ in range(3):
+        sampler.filter(make(logging.INFO))
+    assert len(sampler._windows) == 101
+    clock[0] += 1
+    record = make(logging.INFO)
+    assert sampler.filter(record)
+    assert record.sampled_out == 1
+    assert len(sampler._windows) == 1
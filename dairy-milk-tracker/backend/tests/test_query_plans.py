@@ -0,0 +1,103 @@
+"""EXPLAIN QUERY PLAN checks for the hot queries.
+
+Each query is built by the same function the endpoint uses and explained on
+a database filled by the benchmark generator. A full scan of a table or a
+temporary B-tree (an unindexed sort) fails the test, so a refactor can't
+quietly turn an indexed lookup into a scan of milk_productions.
+"""
+from datetime import date, datetime
+
+import pytest
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from app.archive import archive_query
+from app.api.endpoints.herds import herd_alerts_query, herd_list_query, herd_query
+from app.api.endpoints.milk_production import (
+    milk_production_list_query,
+    milk_production_query,
+)
+from app.auth import user_by_email_query
+from app.milk_export import build_export_query
+from app.rollups import stats_query
+from benchmark.config import FarmConfig, benchmark_email
+from benchmark.generate import generate
+
+USER_ID = 3
+HERD_ID = 7  # owned by USER_ID with 3 herds per user
+AFTER = (datetime(2025, 12, 1, 5), 1000)
+
+
+@pytest.fixture(scope="module")
+async def plan_engine(tmp_path_factory):
+    path = tmp_path_factory.mktemp("plans") / "seeded.db"
+    await generate(str(path), FarmConfig(users=20, herds_per_user=3, days=60))
+    plan_engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    yield plan_engine
+    await plan_engine.dispose()
+
+
+async def explain(plan_engine, query) -> list:
+    sql = query.compile(
+        dialect=plan_engine.dialect, compile_kwargs={"literal_binds": True}
+    )
+    async with plan_engine.connect() as conn:
+        result = await conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}")
+        return [row[3] for row in result.all()]
+
+
+def assert_indexed(plan: list, allow=()):
+    """Fail on full scans and temp B-trees, except for details in ``allow``"""
+    for detail in plan:
+        if any(allowed in detail for allowed in allow):
+            continue
+        assert not detail.startswith("SCAN "), plan
+        assert "TEMP B-TREE" not in detail, plan
+
+
+HOT_QUERIES = {
+    "get_user": user_by_email_query(benchmark_email(USER_ID)),
+    "read_herds": herd_list_query(USER_ID),
+    "read_herds_cursor": herd_list_query(USER_ID, after_id=HERD_ID),
+    "read_herd": herd_query(USER_ID, HERD_ID),
+    "read_herd_alerts": herd_alerts_query(HERD_ID),
+    "read_herd_alerts_since": herd_alerts_query(HERD_ID, date(2025, 12, 1)),
+    "read_milk_productions_herd": milk_production_list_query(USER_ID, HERD_ID),
+    "read_milk_productions_herd_cursor": milk_production_list_query(
+        USER_ID, HERD_ID, after=AFTER
+    ),
+    "read_milk_production": milk_production_query(USER_ID, 1000),
+    "stats_herd": stats_query(USER_ID, HERD_ID),
+    "stats_herd_time_span": stats_query(USER_ID, HERD_ID, date(2025, 12, 1)),
+    "export_herd": build_export_query(USER_ID, HERD_ID, None, None),
+    "export_archives": archive_query(USER_ID),
+    "export_archives_herd": archive_query(USER_ID, HERD_ID),
+}
+
+
+@pytest.mark.parametrize("name", sorted(HOT_QUERIES))
+async def test_hot_query_uses_indexes(plan_engine, name):
+    assert_indexed(await explain(plan_engine, HOT_QUERIES[name]))
+
+
+# Across all of a user's herds the records come from one index range per
+# herd, so putting them in (date, id) order needs a sort; it covers only
+# that user's rows, never the whole table
+USER_WIDE_QUERIES = {
+    "read_milk_productions": milk_production_list_query(USER_ID),
+    "read_milk_productions_cursor": milk_production_list_query(USER_ID, after=AFTER),
+    "export": build_export_query(USER_ID, None, None, None),
+}
+
+
+@pytest.mark.parametrize("name", sorted(USER_WIDE_QUERIES))
+async def test_user_wide_query_searches_by_herd(plan_engine, name):
+    plan = await explain(plan_engine, USER_WIDE_QUERIES[name])
+    assert_indexed(plan, allow=("USE TEMP B-TREE FOR ORDER BY",))
+    assert any("ix_herds_user_id" in detail for detail in plan), plan
+    assert any("ix_milk_productions_herd_id_date_id" in detail for detail in plan), plan
+
+
+async def test_user_wide_stats_searches_by_herd(plan_engine):
+    # Counting distinct days needs a B-tree over the user's daily rows
+    plan = await explain(plan_engine, stats_query(USER_ID, start_date=date(2025, 12, 1)))
+    assert_indexed(plan, allow=("USE TEMP B-TREE FOR count(DISTINCT)",))
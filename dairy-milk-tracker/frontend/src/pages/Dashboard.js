@@ -15,6 +15,7 @@ const Dashboard = () => {
   });
   const [herds, setHerds] = useState([]);
   const [milkProductions, setMilkProductions] = useState([]);
+  const [seriesPoints, setSeriesPoints] = useState([]);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState('');
 
@@ -23,21 +24,20 @@ const Dashboard = () => {
       try {
         setLoading(true);
         
-        // Fetch stats
-        const statsResponse = await axios.get('/api/milk-production/stats');
+        // Stats, herds and the latest records in one request
+        const summaryResponse = await axios.get('/api/dashboard/summary?recent_limit=5');
+        const summary = summaryResponse.data;
         setStats({
-          totalLiters: statsResponse.data.total_liters,
-          averagePerDay: statsResponse.data.average_per_day,
-          daysRecorded: statsResponse.data.days_recorded
+          totalLiters: summary.stats.total_liters,
+          averagePerDay: summary.stats.average_per_day,
+          daysRecorded: summary.stats.days_recorded
         });
+        setHerds(summary.herds);
+        setMilkProductions(summary.recent_records);
         
-        // Fetch herds
-        const herdsResponse = await axios.get('/api/herds/');
-        setHerds(herdsResponse.data);
-        
-        // Fetch milk production data
-        const milkResponse = await axios.get('/api/milk-production/');
-        setMilkProductions(milkResponse.data);
+        // Fetch daily totals for the chart
+        const seriesResponse = await axios.get('/api/milk-production/series?bucket=day');
+        setSeriesPoints(seriesResponse.data.points);
         
         setLoading(false);
       } catch (error) {
@@ -52,19 +52,14 @@ const Dashboard = () => {
 
   // Prepare chart data
   const prepareChartData = () => {
-    if (milkProductions.length === 0) return null;
-    
-    // Sort by date
-    const sortedProductions = [...milkProductions].sort((a, b) => 
-      new Date(a.date) - new Date(b.date)
-    );
+    if (seriesPoints.length === 0) return null;
     
-    // Extract dates and amounts
-    const labels = sortedProductions.map(item => 
-      new Date(item.date).toLocaleDateString()
+    // Extract dates and amounts; the server already buckets and sorts them
+    const labels = seriesPoints.map(point => 
+      new Date(`${point.period_start}T00:00:00`).toLocaleDateString()
     );
     
-    const data = sortedProductions.map(item => item.amount_liters);
+    const data = seriesPoints.map(point => point.total_liters);
     
     return {
       labels,
@@ -12,7 +12,7 @@ const DashboardNew = () => {
   const { currentUser } = useAuth();
   const [selectedHerd, setSelectedHerd] = useState('');
   const [herds, setHerds] = useState([]);
-  const [milkProductions, setMilkProductions] = useState([]);
+  const [seriesPoints, setSeriesPoints] = useState([]);
   const [stats, setStats] = useState({
     totalLiters: 0,
     averagePerDay: 0,
@@ -36,10 +36,71 @@ const DashboardNew = () => {
   useEffect(() => {
     if (selectedHerd) {
       fetchStats();
-      fetchMilkProductions();
+      fetchSeries();
     }
   }, [selectedHerd, timeSpan]);
 
+  // Refetch when the server announces a change instead of polling
+  useEffect(() => {
+    if (!localStorage.getItem('token') || !selectedHerd) {
+      return undefined;
+    }
+
+    const refresh = () => {
+      fetchStats();
+      fetchSeries();
+    };
+    let events = null;
+    let retryTimer = null;
+    let closed = false;
+    let connected = false;
+    const reconnect = () => {
+      retryTimer = setTimeout(connect, 5000);
+    };
+    const connect = async () => {
+      try {
+        // Stream tokens are short-lived, so every connection gets a new one
+        const { data } = await axios.post('/api/events/token');
+        if (closed) {
+          return;
+        }
+        events = new EventSource(`/api/events?token=${encodeURIComponent(data.token)}`);
+      } catch (error) {
+        if (!closed) {
+          reconnect();
+        }
+        return;
+      }
+      events.addEventListener('ready', () => {
+        // Changes may have been missed while reconnecting
+        if (connected) {
+          refresh();
+        }
+        connected = true;
+      });
+      events.addEventListener('milk_production', (event) => {
+        const { herd_ids: herdIds } = JSON.parse(event.data);
+        if (herdIds.includes(parseInt(selectedHerd))) {
+          refresh();
+        }
+      });
+      events.addEventListener('resync', refresh);
+      events.onerror = () => {
+        // The token in the URL has expired by now; reconnect with a new one
+        events.close();
+        reconnect();
+      };
+    };
+    connect();
+    return () => {
+      closed = true;
+      clearTimeout(retryTimer);
+      if (events) {
+        events.close();
+      }
+    };
+  }, [selectedHerd, timeSpan]);
+
   const fetchInitialData = async () => {
     try {
       setLoading(true);
@@ -80,10 +141,19 @@ const DashboardNew = () => {
     }
   };
 
-  const fetchMilkProductions = async () => {
+  const fetchSeries = async () => {
     try {
-      const milkResponse = await axios.get(`/api/milk-production/?herd_id=${selectedHerd}`);
-      setMilkProductions(milkResponse.data);
+      // Daily buckets for the short spans, weekly ones for a whole year
+      const spanDays = { week: 7, month: 30, year: 365 }[timeSpan];
+      const bucket = timeSpan === 'year' ? 'week' : 'day';
+      const fromDate = new Date();
+      fromDate.setDate(fromDate.getDate() - spanDays + 1);
+      const from = fromDate.toISOString().slice(0, 10);
+      
+      const seriesResponse = await axios.get(
+        `/api/milk-production/series?herd_id=${selectedHerd}&bucket=${bucket}&from=${from}`
+      );
+      setSeriesPoints(seriesResponse.data.points);
     } catch (error) {
       console.error('Error fetching milk production data:', error);
       setError('Failed to load milk production data');
@@ -128,7 +198,7 @@ const DashboardNew = () => {
       
       // Refresh data
       fetchStats();
-      fetchMilkProductions();
+      fetchSeries();
       setNewProduction('');
     } catch (error) {
       console.error('Error adding milk production:', error);
@@ -155,31 +225,22 @@ const DashboardNew = () => {
 
   // Prepare chart data
   const prepareChartData = () => {
-    if (milkProductions.length === 0) return null;
-    
-    // Sort by date
-    const sortedProductions = [...milkProductions].sort((a, b) => 
-      new Date(a.date) - new Date(b.date)
-    );
-    
-    // Get the last 7 or relevant number of entries
-    let filteredProductions = sortedProductions;
-    if (timeSpan === 'week') {
-      filteredProductions = sortedProductions.slice(-7);
-    } else if (timeSpan === 'month') {
-      filteredProductions = sortedProductions.slice(-30);
-    }
+    if (seriesPoints.length === 0) return null;
     
     // Use Spanish day abbreviations
     const dayLabels = ['Lun', 'Mar', 'Mie', 'Jue', 'Vie', 'Sab', 'Dom'];
     
-    // Extract dates and amounts
-    const labels = filteredProductions.map(item => {
-      const date = new Date(item.date);
-      return dayLabels[date.getDay() === 0 ? 6 : date.getDay() - 1];
+    // Extract periods and amounts; the server already buckets and sorts them
+    const labels = seriesPoints.map(point => {
+      const date = new Date(`${point.period_start}T00:00:00`);
+      if (timeSpan === 'week') {
+        return dayLabels[date.getDay() === 0 ? 6 : date.getDay() - 1];
+      }
+      return date.toLocaleDateString();
     });
     
-    const data = filteredProductions.map(item => item.amount_liters);
+    const data = seriesPoints.map(point => point.total_liters);
+    const trend = seriesPoints.map(point => point.moving_average_7d);
     
     return {
       labels,
@@ -194,7 +255,7 @@ const DashboardNew = () => {
         {
           type: 'line',
           label: 'Trend',
-          data,
+          data: trend,
           borderColor: 'rgb(75, 192, 192)',
           backgroundColor: 'rgba(75, 192, 192, 0.3)',
           fill: true,
@@ -10,6 +10,12 @@ ChartJS.register(CategoryScale, LinearScale, PointElement, LineElement, Title, T
 const HerdDetail = () => {
   const [herd, setHerd] = useState(null);
   const [milkProductions, setMilkProductions] = useState([]);
+  const [stats, setStats] = useState({
+    totalLiters: 0,
+    averagePerDay: 0,
+    daysRecorded: 0,
+    litersPerCow: 0
+  });
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState('');
   const { id } = useParams();
@@ -19,13 +25,17 @@ const HerdDetail = () => {
       try {
         setLoading(true);
         
-        // Fetch herd details
-        const herdResponse = await axios.get(`/api/herds/${id}`);
-        setHerd(herdResponse.data);
-        
-        // Fetch milk production data for this herd
-        const milkResponse = await axios.get(`/api/milk-production/?herd_id=${id}`);
-        setMilkProductions(milkResponse.data);
+        // Herd, its totals and latest records in one request
+        const summaryResponse = await axios.get(`/api/dashboard/summary?herd_id=${id}&recent_limit=100`);
+        const summary = summaryResponse.data;
+        setHerd(summary.herds.find(h => h.id === Number(id)));
+        setStats({
+          totalLiters: summary.stats.total_liters,
+          averagePerDay: summary.stats.average_per_day,
+          daysRecorded: summary.stats.days_recorded,
+          litersPerCow: summary.stats.liters_per_cow
+        });
+        setMilkProductions(summary.recent_records);
         
         setLoading(false);
       } catch (error) {
@@ -68,26 +78,6 @@ const HerdDetail = () => {
     };
   };
 
-  const calculateStats = () => {
-    if (milkProductions.length === 0) {
-      return {
-        totalLiters: 0,
-        averagePerDay: 0,
-        daysRecorded: 0
-      };
-    }
-    
-    const totalLiters = milkProductions.reduce((sum, record) => sum + record.amount_liters, 0);
-    const daysRecorded = milkProductions.length;
-    const averagePerDay = totalLiters / daysRecorded;
-    
-    return {
-      totalLiters,
-      averagePerDay,
-      daysRecorded
-    };
-  };
-
   const chartOptions = {
     responsive: true,
     plugins: {
@@ -102,7 +92,6 @@ const HerdDetail = () => {
   };
 
   const chartData = prepareChartData();
-  const stats = calculateStats();
 
   if (loading) {
     return (
@@ -162,9 +151,7 @@ const HerdDetail = () => {
         <div className="stat-card">
           <h3>Average Per Cow</h3>
           <div className="stat-value">
-            {herd.cow_count > 0 
-              ? (stats.averagePerDay / herd.cow_count).toFixed(1) 
-              : '0'} L
+            {stats.litersPerCow.toFixed(1)} L
           </div>
         </div>
       </div>
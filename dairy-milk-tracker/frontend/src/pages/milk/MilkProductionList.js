@@ -8,6 +8,20 @@ const MilkProductionList = () => {
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState('');
   const [selectedHerd, setSelectedHerd] = useState('all');
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
+
+  const milkProductionUrl = (cursor) => {
+    const params = new URLSearchParams();
+    if (selectedHerd !== 'all') {
+      params.append('herd_id', selectedHerd);
+    }
+    if (cursor) {
+      params.append('cursor', cursor);
+    }
+    const query = params.toString();
+    return query ? `/api/milk-production/?${query}` : '/api/milk-production/';
+  };
 
   useEffect(() => {
     const fetchData = async () => {
@@ -18,13 +32,10 @@ const MilkProductionList = () => {
         const herdsResponse = await axios.get('/api/herds/');
         setHerds(herdsResponse.data);
         
-        // Fetch milk production data
-        const url = selectedHerd === 'all' 
-          ? '/api/milk-production/' 
-          : `/api/milk-production/?herd_id=${selectedHerd}`;
-        
-        const milkResponse = await axios.get(url);
+        // Fetch the first page of milk production data
+        const milkResponse = await axios.get(milkProductionUrl());
         setMilkProductions(milkResponse.data);
+        setNextCursor(milkResponse.headers['x-next-cursor'] || null);
         
         setLoading(false);
       } catch (error) {
@@ -37,6 +48,21 @@ const MilkProductionList = () => {
     fetchData();
   }, [selectedHerd]);
 
+  const handleLoadMore = async () => {
+    try {
+      setLoadingMore(true);
+      // Keyset pagination: every page costs the same as the first one
+      const milkResponse = await axios.get(milkProductionUrl(nextCursor));
+      setMilkProductions([...milkProductions, ...milkResponse.data]);
+      setNextCursor(milkResponse.headers['x-next-cursor'] || null);
+    } catch (error) {
+      console.error('Error loading more records', error);
+      setError('Failed to load more records');
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const handleDeleteRecord = async (id) => {
     if (window.confirm('Are you sure you want to delete this record?')) {
       try {
@@ -133,6 +159,13 @@ const MilkProductionList = () => {
               })}
             </tbody>
           </table>
+          {nextCursor && (
+            <div style={{ textAlign: 'center', marginTop: '20px' }}>
+              <button className="btn-primary" onClick={handleLoadMore} disabled={loadingMore}>
+                {loadingMore ? 'Loading...' : 'Load More'}
+              </button>
+            </div>
+          )}
         </div>
       )}
     </div>
@@ -56,16 +56,7 @@ else
   echo -e "${GREEN}npm is installed.${NC}"
 fi
 
-# Fix database if needed
-echo -e "\n${GREEN}Checking database...${NC}"
-if [ -f "backend/dairy_milk_tracker.db" ]; then
-  echo -e "${YELLOW}Running database fix script...${NC}"
-  cd backend
-  python fix_database.py
-  cd ..
-else
-  echo -e "${YELLOW}No existing database found. A new one will be created.${NC}"
-fi
+# Database migrations are applied by the backend when it starts
 
 # Start backend
 echo -e "\n${GREEN}Starting backend server...${NC}"